@@ -0,0 +1,145 @@
+import os
+import json
+import asyncio
+import logging
+import argparse
+
+from telegram.ext import ContextTypes
+
+import db
+import migrations
+import constants as consts
+
+logger = logging.getLogger(__name__)
+
+# A challenge is resolved once nobody can still act on it: no response is waiting to be
+# completed or to be validated. 'issued' responses that were never accepted count as resolved.
+_RESOLVED_BATCH = """
+    SELECT c.id FROM challenges c
+    WHERE c.created_at < DATETIME('now', ?)
+    AND NOT EXISTS (
+        SELECT 1 FROM challenge_responses cr
+        WHERE cr.challenge_id = c.id
+        AND (cr.status = 'pending' OR (cr.status = 'completed' AND NOT cr.validated))
+    )
+    ORDER BY c.id
+    LIMIT ?
+"""
+
+_CHALLENGE_COLUMNS = "id, goal_id, description, due_date, created_at, rejected"
+_RESPONSE_COLUMNS = "id, challenge_id, user_id, status, validated, completed_at, validated_at, created_at"
+_IN_BATCH = "IN (SELECT value FROM json_each(?))"
+
+
+def _archive_batch(conn, after_days, batch_size):
+    """
+    Move up to batch_size resolved challenges and their responses into the archive tables,
+    in the caller's transaction. Deleting doesn't touch user_goal_stats or leaderboard_scores:
+    their triggers only fire on inserts and updates.
+
+    Returns:
+        int: Number of challenges moved
+    """
+    ids = [row["id"] for row in conn.execute(_RESOLVED_BATCH, (f"-{int(after_days)} days", batch_size))]
+    if not ids:
+        return 0
+    ids_json = json.dumps(ids)
+
+    conn.execute(f"""
+        INSERT OR REPLACE INTO challenges_archive ({_CHALLENGE_COLUMNS})
+        SELECT {_CHALLENGE_COLUMNS} FROM challenges WHERE id {_IN_BATCH}
+    """, (ids_json,))
+    conn.execute(f"""
+        INSERT OR REPLACE INTO challenge_responses_archive ({_RESPONSE_COLUMNS})
+        SELECT {_RESPONSE_COLUMNS} FROM challenge_responses WHERE challenge_id {_IN_BATCH}
+    """, (ids_json,))
+
+    # Explicit rather than relying on ON DELETE CASCADE, which only applies with SQLITE_FOREIGN_KEYS on
+    conn.execute(f"DELETE FROM challenge_responses WHERE challenge_id {_IN_BATCH}", (ids_json,))
+    conn.execute(f"DELETE FROM challenges WHERE id {_IN_BATCH}", (ids_json,))
+    return len(ids)
+
+
+def _incremental_vacuum(conn, pages):
+    """
+    Return up to pages free pages to the OS (all of them if pages is 0).
+
+    Returns:
+        int: Pages released, or None if the database isn't in incremental auto_vacuum mode
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return None
+
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    # Each step of the pragma frees one page and execute() only steps it once; executescript
+    # runs it to completion. Nothing else is pending in this transaction for it to commit.
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+async def archive_resolved_challenges(after_days=consts.ARCHIVE_AFTER_DAYS, batch_size=consts.ARCHIVE_BATCH_SIZE):
+    """
+    Move challenges resolved more than after_days ago out of the hot tables, one transaction
+    per batch so handlers' writes are never queued behind the whole run.
+
+    Returns:
+        int: Number of challenges archived
+    """
+    total = 0
+    while True:
+        moved = await db.run(_archive_batch, after_days, batch_size)
+        total += moved
+        if moved < batch_size:
+            return total
+        await asyncio.sleep(consts.ARCHIVE_BATCH_PAUSE)
+
+
+async def archive_job(context: ContextTypes.DEFAULT_TYPE):
+    """Job: archive old resolved challenges, then reclaim the space they used."""
+    archived = await archive_resolved_challenges()
+    released = await db.run(_incremental_vacuum, consts.ARCHIVE_VACUUM_PAGES)
+
+    if archived or released:
+        logger.info(f"Archived {archived} challenges, released {released or 0} free pages")
+    if released is None and archived:
+        logger.info("auto_vacuum is not INCREMENTAL; freed pages are reused but the file won't shrink. "
+                    "Run `python archive.py --vacuum` once while the bot is stopped to convert it.")
+
+
+def enable_incremental_vacuum(path=None):
+    """
+    Switch an existing database to incremental auto_vacuum. Rewrites the whole file with
+    VACUUM, so run it while the bot is stopped. New databases are created in this mode.
+    """
+    conn = db.connect(path)
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive resolved challenges and reclaim space in goals.db")
+    parser.add_argument("--days", type=int, default=consts.ARCHIVE_AFTER_DAYS, help="Archive challenges older than this")
+    parser.add_argument("--vacuum", action="store_true", help="Convert the database to incremental auto_vacuum (bot must be stopped)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # A fresh checkout has no goals.db until bootstrap below creates it
+    size_before = os.path.getsize(consts.GOALS_DB_SQLITE) if os.path.exists(consts.GOALS_DB_SQLITE) else 0
+
+    async def main():
+        try:
+            await db.run(migrations.bootstrap)
+            archived = await archive_resolved_challenges(after_days=args.days)
+            released = await db.run(_incremental_vacuum, 0)
+        finally:
+            await db.close()
+        print(f"Archived {archived} challenges, released {released or 0} free pages")
+
+    asyncio.run(main())
+    if args.vacuum:
+        print("Incremental auto_vacuum enabled" if enable_incremental_vacuum() else "Could not enable incremental auto_vacuum")
+    print(f"goals.db: {size_before / 1e6:.1f} MB -> {os.path.getsize(consts.GOALS_DB_SQLITE) / 1e6:.1f} MB")
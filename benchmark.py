@@ -0,0 +1,383 @@
+"""
+Benchmark for the database query helpers.
+
+Generates a goals.db of configurable scale filled with synthetic groups, users, goals and
+months of daily challenges and responses. Then it times every query helper in utils.py,
+plus challenge.get_goals_to_challenge and challenge.get_users_for_goal, through the real
+db layer. Results (p50/p95 per helper plus the scale they were measured at) are written as
+JSON. Pass --compare with an earlier results file to flag regressions after a schema or
+query change:
+
+    python benchmark.py --groups 200 --months 6 --output before.json
+    python benchmark.py --groups 200 --months 6 --reuse --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timedelta
+
+os.environ.setdefault("ADMIN_TELEGRAM_USER_ID", "1")
+
+from telegram import User, Chat
+
+import db
+import utils
+import challenge
+import migrations
+import user_cache
+import constants as consts
+from timing import summarise
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def create_schema(workdir):
+    """Create an empty goals.db in workdir with the production schema."""
+    conn = db.connect(os.path.join(workdir, "goals.db"))
+    try:
+        migrations.bootstrap(conn)
+    finally:
+        conn.close()
+
+
+def generate(conn, args, rng):
+    """
+    Fill an empty goals.db with synthetic data.
+
+    Every group has its own users, some goals with a subset of those users as members, and one
+    challenge per goal per day for args.months months ending today. Older responses are
+    mostly completed or failed; the last two days are issued, pending or awaiting validation,
+    which is what the daily jobs look at. Returns ID pools for picking benchmark arguments.
+    """
+    now = datetime.utcnow()
+    days = args.months * 30
+    start = now - timedelta(days=days)
+
+    ids = {"groups": [], "members": {}, "goals": [], "challenges": [], "responses": [], "prizefights": [], "names": []}
+    users, groups, group_members, goals, goal_members = [], [], [], [], []
+    prizefights, prizefight_participants = [], []
+
+    next_user_id = 1
+    goal_id = 0
+    for g in range(args.groups):
+        group_id = -1000000000000 - g
+        groups.append((group_id, f"Group {g}"))
+        ids["groups"].append(group_id)
+
+        members = []
+        for _ in range(args.users_per_group):
+            user_id = next_user_id
+            next_user_id += 1
+            username = f"user_{user_id}" if rng.random() < 0.7 else None
+            users.append((user_id, username, f"First{user_id}"))
+            group_members.append((group_id, user_id))
+            members.append(user_id)
+            ids["names"].append(f"@{username}" if username else f"First{user_id}")
+        ids["members"][group_id] = members
+
+        for _ in range(args.goals_per_group):
+            goal_id += 1
+            status = rng.choices(["active", "completed", "abandoned"], [8, 1, 1])[0]
+            goals.append((goal_id, group_id, f"Goal {goal_id}: practise something daily", status, start.strftime("%Y-%m-%d %H:%M:%S")))
+            ids["goals"].append(goal_id)
+            for user_id in rng.sample(members, min(args.members_per_goal, len(members))):
+                goal_members.append((goal_id, user_id))
+
+        for _ in range(args.prizefights_per_group):
+            prizefight_id = len(prizefights) + 1
+            prizefights.append((prizefight_id, group_id, "Run 5km", "Coffee"))
+            ids["prizefights"].append(prizefight_id)
+            for user_id in rng.sample(members, min(2, len(members))):
+                prizefight_participants.append((prizefight_id, user_id, rng.choice(["pending", "verifying", "completed", "failed"])))
+
+    conn.executemany("INSERT INTO users (user_id, username, display_name) VALUES (?, ?, ?)", users)
+    conn.executemany("INSERT INTO groups (group_id, group_name) VALUES (?, ?)", groups)
+    conn.executemany("INSERT INTO group_members (group_id, user_id) VALUES (?, ?)", group_members)
+    conn.executemany("INSERT INTO goals (id, group_id, goal, status, created_at) VALUES (?, ?, ?, ?, ?)", goals)
+    conn.executemany("INSERT INTO goal_members (goal_id, user_id) VALUES (?, ?)", goal_members)
+    conn.executemany("INSERT INTO prizefights (id, group_id, challenge, prize) VALUES (?, ?, ?, ?)", prizefights)
+    conn.executemany("INSERT INTO prizefight_participants (prizefight_id, user_id, status) VALUES (?, ?, ?)", prizefight_participants)
+
+    members_by_goal = {}
+    for goal, user_id in goal_members:
+        members_by_goal.setdefault(goal, []).append(user_id)
+
+    challenge_id = 0
+    challenges, responses = [], []
+    for day in range(days + 1):
+        created_at = start + timedelta(days=day)
+        recent = (now - created_at) < timedelta(days=2)
+        for goal, members in members_by_goal.items():
+            challenge_id += 1
+            challenges.append((
+                challenge_id, goal, f"Day {day} challenge for goal {goal}",
+                (created_at + timedelta(days=consts.CHALLENGE_DEADLINE_DAYS)).isoformat(),
+                created_at.strftime("%Y-%m-%d %H:%M:%S"),
+                int(rng.random() < 0.03),
+            ))
+            for user_id in members:
+                if recent:
+                    status, validated = rng.choices([("issued", 0), ("pending", 0), ("completed", 0)], [3, 5, 2])[0]
+                else:
+                    status, validated = rng.choices([("completed", 1), ("failed", 0), ("rejected", 0)], [6, 3, 1])[0]
+                responses.append((challenge_id, user_id, status, validated))
+
+    conn.executemany("INSERT INTO challenges (id, goal_id, description, due_date, created_at, rejected) VALUES (?, ?, ?, ?, ?, ?)", challenges)
+    conn.executemany("INSERT INTO challenge_responses (challenge_id, user_id, status, validated) VALUES (?, ?, ?, ?)", responses)
+    conn.commit()
+
+    ids["challenges"] = [c[0] for c in challenges]
+    ids["responses"] = [r[0] for r in conn.execute("SELECT id FROM challenge_responses")]
+    return ids
+
+
+def load_ids(conn):
+    """ID pools for an existing benchmark database (--reuse)."""
+    ids = {
+        "groups": [r[0] for r in conn.execute("SELECT group_id FROM groups")],
+        "goals": [r[0] for r in conn.execute("SELECT id FROM goals")],
+        "challenges": [r[0] for r in conn.execute("SELECT id FROM challenges")],
+        "responses": [r[0] for r in conn.execute("SELECT id FROM challenge_responses")],
+        "prizefights": [r[0] for r in conn.execute("SELECT id FROM prizefights")],
+        "names": [f"@{r[0]}" if r[0] else r[1] for r in conn.execute("SELECT username, display_name FROM users")],
+        "members": {},
+    }
+    for group_id, user_id in conn.execute("SELECT group_id, user_id FROM group_members"):
+        ids["members"].setdefault(group_id, []).append(user_id)
+    return ids
+
+
+def benchmarks(ids, rng):
+    """
+    (name, iterations divisor, argument factory, coroutine function) for every helper.
+
+    Helpers that scan a whole table or the daily job paths run a tenth as often.
+    """
+    next_user_id = [10 ** 9]
+
+    def group_and_member():
+        group_id = rng.choice(ids["groups"])
+        return group_id, rng.choice(ids["members"][group_id])
+
+    def new_user_and_group():
+        next_user_id[0] += 1
+        user_id = next_user_id[0]
+        group_id = rng.choice(ids["groups"])
+        return User(user_id, f"First{user_id}", False, username=f"user_{user_id}"), Chat(group_id, Chat.SUPERGROUP, title="Group")
+
+    async def drain_reminders():
+        return [row async for row in utils.iter_challenges_to_remind()]
+
+    goal = lambda: (rng.choice(ids["goals"]),)
+    response = lambda: (rng.choice(ids["responses"]),)
+    challenge_ = lambda: (rng.choice(ids["challenges"]),)
+    prizefight = lambda: (rng.choice(ids["prizefights"]),)
+    user = lambda: (group_and_member()[1],)
+    none = lambda: ()
+
+    return [
+        ("utils.upsert_user_and_group", 1, new_user_and_group, utils.upsert_user_and_group),
+        ("utils.upsert_user_and_group (wait=False)", 1, lambda: (*new_user_and_group(), False), utils.upsert_user_and_group),
+        ("utils.get_active_participanting_goals", 1, group_and_member, utils.get_active_participanting_goals),
+        ("utils.get_active_non_participanting_goal_ids", 1, group_and_member, utils.get_active_non_participanting_goal_ids),
+        ("utils.get_pending_challenges", 1, group_and_member, utils.get_pending_challenges),
+        ("utils.get_completed_unvalidated_challenges", 10, none, utils.get_completed_unvalidated_challenges),
+        ("utils.get_challenge_from_challenge_response_id", 1, response, utils.get_challenge_from_challenge_response_id),
+        ("utils.get_members_in_goal", 1, goal, utils.get_members_in_goal),
+        ("utils.get_group_id_by_goal_id", 1, goal, utils.get_group_id_by_goal_id),
+        ("utils.get_group_id_by_prize_fight_id", 1, prizefight, utils.get_group_id_by_prize_fight_id),
+        ("utils.get_user_display_name_by_challenge_response_id", 1, response, utils.get_user_display_name_by_challenge_response_id),
+        ("utils.mark_challenge_as_validated", 1, response, utils.mark_challenge_as_validated),
+        ("utils.mark_challenge_as_rejected", 1, response, utils.mark_challenge_as_rejected),
+        ("utils.goal_id_from_challenge_response_id_and_user_id", 1, lambda: (rng.choice(ids["responses"]), user()[0]), utils.goal_id_from_challenge_response_id_and_user_id),
+        ("utils.get_goal_id_from_challenge_id", 1, challenge_, utils.get_goal_id_from_challenge_id),
+        ("utils.get_display_name_from_user_id", 1, user, utils.get_display_name_from_user_id),
+        ("utils.get_user_id_from_display_name", 1, lambda: (rng.choice(ids["names"]),), utils.get_user_id_from_display_name),
+        ("utils.get_username_from_user_id", 1, user, utils.get_username_from_user_id),
+        ("utils.get_challenge_accepted_participants", 1, challenge_, utils.get_challenge_accepted_participants),
+        ("utils.get_goal_starting_date", 1, goal, utils.get_goal_starting_date),
+        ("utils.get_past_challenges", 1, goal, utils.get_past_challenges),
+        ("utils.iter_challenges_to_remind", 10, none, drain_reminders),
+        ("utils.insert_into_prizefights", 1, lambda: ("Run 5km", "Coffee", rng.choice(ids["groups"])), utils.insert_into_prizefights),
+        ("utils.insert_into_prizefight_participants", 1, lambda: (rng.choice(ids["prizefights"]), next_user_id[0] + rng.randrange(10 ** 6)), utils.insert_into_prizefight_participants),
+        ("utils.get_prize_fight_for_user_id", 1, lambda: tuple(reversed(group_and_member())), utils.get_prize_fight_for_user_id),
+        ("utils.edit_prize_fight_status", 1, lambda: (rng.choice(ids["prizefights"]), user()[0], "pending"), utils.edit_prize_fight_status),
+        ("utils.get_prize_fight_details", 1, prizefight, utils.get_prize_fight_details),
+        ("utils.get_prize_fight_participants", 1, prizefight, utils.get_prize_fight_participants),
+        ("utils.get_pending_prizefights", 10, none, utils.get_pending_prizefights),
+        ("utils.expire_overdue_challenges", 10, none, utils.expire_overdue_challenges),
+        ("challenge.get_goals_to_challenge", 10, none, challenge.get_goals_to_challenge),
+        ("challenge.get_users_for_goal", 1, goal, challenge.get_users_for_goal),
+    ]
+
+
+async def overdue_responses_reset():
+    """
+    Capture the responses expire_overdue_challenges will fail, and return a coroutine function
+    that puts them back to pending, so every call has the same work to do.
+    """
+    rows = await db.fetchall("""
+        SELECT cr.id
+        FROM challenge_responses cr
+        JOIN challenges c ON c.id = cr.challenge_id
+        WHERE cr.status = 'pending' AND c.due_date <= ?
+    """, (datetime.now().isoformat(),))
+    response_ids = json.dumps([row["id"] for row in rows])
+
+    def _reset(conn):
+        conn.execute("UPDATE challenge_responses SET status = 'pending' WHERE id IN (SELECT value FROM json_each(?))", (response_ids,))
+
+    return lambda: db.run(_reset)
+
+
+# Helpers that change the rows they work on, with a factory for an untimed reset run after each call
+RESETS = {
+    "utils.expire_overdue_challenges": overdue_responses_reset,
+}
+
+
+async def time_helpers(ids, args, rng):
+    results = {}
+    for name, divisor, make_args, fn in benchmarks(ids, rng):
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+
+        reset = await RESETS[name]() if name in RESETS else None
+
+        durations = []
+        for _ in range(max(1, args.iterations // divisor)):
+            call_args = make_args()
+            if not args.warm_cache:
+                # Measure the queries themselves, not the in-process name cache
+                user_cache.users = user_cache.UserCache(consts.USER_CACHE_SIZE)
+            started = time.perf_counter()
+            await fn(*call_args)
+            durations.append(time.perf_counter() - started)
+            if reset:
+                await reset()
+
+        results[name] = summarise(durations)
+        print(f"{name:<55} p50 {results[name]['p50_ms']:8.3f} ms   p95 {results[name]['p95_ms']:8.3f} ms")
+
+    await db.close()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """Print p50/p95 changes against a previous results file. Returns the names that regressed."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    if baseline["meta"]["scale"] != results["meta"]["scale"]:
+        print(f"Warning: baseline was measured at a different scale: {baseline['meta']['scale']}")
+
+    regressions = []
+    print(f"\n{'helper':<55} {'p50 before':>11} {'p50 after':>10} {'p95 before':>11} {'p95 after':>10}")
+    for name, after in results["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<55} {'(new)':>11}")
+            continue
+
+        # Ignore sub-0.1 ms differences; they are timer noise, not regressions
+        regressed = after["p95_ms"] > before["p95_ms"] * (1 + threshold) and after["p95_ms"] - before["p95_ms"] > 0.1
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<55} {before['p50_ms']:11.3f} {after['p50_ms']:10.3f} {before['p95_ms']:11.3f} {after['p95_ms']:10.3f}{flag}")
+        if regressed:
+            regressions.append(name)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the goals.db query helpers against synthetic data")
+    parser.add_argument("--workdir", default=os.path.join(HERE, "benchmark_data"), help="Where the benchmark goals.db lives")
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--users-per-group", type=int, default=20)
+    parser.add_argument("--goals-per-group", type=int, default=5)
+    parser.add_argument("--members-per-goal", type=int, default=4)
+    parser.add_argument("--prizefights-per-group", type=int, default=5)
+    parser.add_argument("--months", type=int, default=3, help="Months of daily challenges and responses")
+    parser.add_argument("--iterations", type=int, default=200, help="Calls per helper (a tenth for full scans)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reuse", action="store_true", help="Benchmark the existing database instead of regenerating it")
+    parser.add_argument("--warm-cache", action="store_true", help="Keep the user name cache between calls")
+    parser.add_argument("--only", nargs="*", help="Only run helpers whose name contains one of these strings")
+    parser.add_argument("--output", help="Results file (default: <workdir>/results.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative p95 increase reported as a regression")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    os.makedirs(args.workdir, exist_ok=True)
+    path = os.path.join(args.workdir, "goals.db")
+    consts.GOALS_DB_SQLITE = path
+
+    scale = {
+        "groups": args.groups,
+        "users_per_group": args.users_per_group,
+        "goals_per_group": args.goals_per_group,
+        "members_per_goal": args.members_per_goal,
+        "prizefights_per_group": args.prizefights_per_group,
+        "months": args.months,
+        "seed": args.seed,
+    }
+
+    if args.reuse and os.path.exists(path):
+        conn = db.connect(path)
+        ids = load_ids(conn)
+    else:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        create_schema(args.workdir)
+        conn = db.connect(path)
+        started = time.perf_counter()
+        ids = generate(conn, args, rng)
+        print(f"Generated {len(ids['challenges'])} challenges and {len(ids['responses'])} responses in {time.perf_counter() - started:.1f}s")
+
+    schema_version = migrations.get_schema_version(conn)
+    conn.close()
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "schema_version": schema_version,
+            "iterations": args.iterations,
+            "warm_cache": args.warm_cache,
+            "scale": scale,
+        },
+        "results": asyncio.run(time_helpers(ids, args, rng)),
+    }
+
+    output = args.output or os.path.join(args.workdir, "results.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} helper(s) regressed by more than {args.threshold:.0%} at p95")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ import traceback
 import logging
 from telegram.error import Forbidden, BadRequest, TimedOut, NetworkError
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -19,7 +20,17 @@ import challenge
 import validate_completion
 import prizefight
 import clear_challenges
+import remind
 import utils
+import db
+import migrations
+import dispatcher
+import scheduler
+import chat_state
+import callbacks
+import metrics
+import slow_queries
+import archive
 from datetime import datetime, time
 import pytz
 
@@ -83,13 +94,13 @@ async def goals_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     user_id = user.id
 
     # Insert or update the user in the database
-    await utils.upsert_user_and_group(user, group)
+    await utils.upsert_user_and_group(user, group, wait=False)
 
     # Fetch active goals the user has already joined
-    joined_goals = utils.get_active_participanting_goals(group.id, user_id)
+    joined_goals = await utils.get_active_participanting_goals(group.id, user_id)
 
     # Fetch active goals the user has not joined
-    available_goals = utils.get_active_non_participanting_goal_ids(group.id, user_id)
+    available_goals = await utils.get_active_non_participanting_goal_ids(group.id, user_id)
 
     # Build the message
     message_parts = []
@@ -103,7 +114,7 @@ async def goals_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     if available_goals:
         message_parts.append("\nAvailable goals to join:")
         keyboard = [
-            [InlineKeyboardButton(goal, callback_data=f"join_goal_from_goals_command:{goal_id}")]
+            [InlineKeyboardButton(goal, callback_data=callbacks.encode(callbacks.JOIN_GOAL_FROM_GOALS, goal_id))]
             for goal_id, goal in available_goals
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -121,20 +132,15 @@ async def join_goals_from_goals_command(update: Update, context: ContextTypes.DE
     user = query.from_user
     user_id = user.id
     group_id = query.message.chat.id
-    goal_id = query.data.split(":")[1]  # Extract the goal ID (e.g., "42")
+    goal_id = context.args[0]  # Goal ID decoded from the callback data by callbacks.CallbackRouter
     display_name = utils.get_display_name_from_telegram_user(user)
 
     # Insert the user into the database
     try:
-        conn = sqlite3.connect(consts.GOALS_DB_SQLITE)
-        cursor = conn.cursor()
-
-        cursor.execute(
+        await db.execute(
             "INSERT INTO goal_members (goal_id, user_id, role) VALUES (?, ?, ?)",
             (goal_id, user_id, "member")
         )
-        conn.commit()
-        conn.close()
 
     except sqlite3.Error as e:
         await update.message.reply_text("An error occurred while joining goal. Please try again.")
@@ -148,8 +154,8 @@ async def join_goals_from_goals_command(update: Update, context: ContextTypes.DE
     # Update the original message to reflect the change
     new_message_parts = []
 
-    new_joined_goals = utils.get_active_participanting_goals(group_id, user_id)
-    new_available_goals = utils.get_active_non_participanting_goal_ids(group_id, user_id)
+    new_joined_goals = await utils.get_active_participanting_goals(group_id, user_id)
+    new_available_goals = await utils.get_active_non_participanting_goal_ids(group_id, user_id)
 
     if new_joined_goals:
         new_joined_list = "\n".join(f"• {goal}" for _, goal in new_joined_goals)
@@ -160,7 +166,7 @@ async def join_goals_from_goals_command(update: Update, context: ContextTypes.DE
     if new_available_goals:
         new_message_parts.append("\nAvailable goals to join:")
         keyboard = [
-            [InlineKeyboardButton(goal, callback_data=f"join_goal_from_goals_command:{goal_id}")]
+            [InlineKeyboardButton(goal, callback_data=callbacks.encode(callbacks.JOIN_GOAL_FROM_GOALS, goal_id))]
             for goal_id, goal in new_available_goals
         ]
         new_reply_markup = InlineKeyboardMarkup(keyboard)
@@ -193,23 +199,29 @@ async def add_goal_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         return
 
     # Insert the goal into the database
+    def _insert_goal(conn):
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO goals (group_id, goal, status) VALUES (?, ?, ?)",
+            (group.id, message, "active")
+        )
+        goal_id = cursor.lastrowid # Get the auto-incremented goal ID
+
+        cursor.execute(
+            "INSERT INTO goal_members (goal_id, user_id, role) VALUES (?, ?, ?)",
+            (goal_id, user.id, "owner")
+        )
+        return goal_id
+
     try:
-        with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO goals (group_id, goal, status) VALUES (?, ?, ?)",
-                (group.id, message, "active")
-            )
-
-            cursor.execute(
-                "INSERT INTO goal_members (goal_id, user_id, role) VALUES (?, ?, ?)",
-                (cursor.lastrowid, user.id, "owner")
-            )
-            conn.commit()
-            goal_id = cursor.lastrowid # Get the auto-incremented goal ID
-
-        # Save the goal temporarily in the context for later use
-        context.chat_data[f"goal_id_{goal_id}"] = {"goal": message, "creator_id": user.id, "participants":[user.id]}
+        goal_id = await db.run(_insert_goal)
+
+        # Remember who joined through the creation message, so the Join Goal button works across restarts
+        await chat_state.store.set(
+            group.id, f"goal_id_{goal_id}",
+            {"goal": message, "creator_id": user.id, "participants": [user.id]},
+            consts.GOAL_JOIN_STATE_TTL
+        )
 
         await update.message.reply_text(f"Goal added: '{message}' by {display_name}.")
     except sqlite3.Error as e:
@@ -219,7 +231,7 @@ async def add_goal_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
     # Callback for encouraging others to join the goal
     keyboard = [
-        InlineKeyboardButton("Join Goal", callback_data=f"join_goal_from_creation:{goal_id}")
+        InlineKeyboardButton("Join Goal", callback_data=callbacks.encode(callbacks.JOIN_GOAL_FROM_CREATION, goal_id))
     ]
     reply_markup = InlineKeyboardMarkup([keyboard])
 
@@ -235,14 +247,18 @@ async def join_goal(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = query.from_user
     user_id = user.id
     group_id = query.message.chat.id
-    goal_id = query.data.split(":")[1]
+    goal_id = context.args[0]
     display_name = utils.get_display_name_from_telegram_user(user)
 
-    # Adding user to goal in chat_data
+    # Adding user to the goal's stored participant list
+    def _add_participant(goal_data):
+        goal_data.setdefault('participants', []).append(user_id)
+        return goal_data
+
     try:
-        goal_data = context.chat_data.get(f"goal_id_{goal_id}")
+        goal_data = await chat_state.store.get(group_id, f"goal_id_{goal_id}")
         if goal_data and 'participants' in goal_data:
-            goal_data['participants'].append(user_id)
+            await chat_state.store.update(group_id, f"goal_id_{goal_id}", _add_participant)
             await query.answer(f"@{display_name} joined the goal.", show_alert=True)
         else:
             raise KeyError("Participants list not found in goal data.")
@@ -252,15 +268,10 @@ async def join_goal(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     # Insert the user into the database
     try:
-        conn = sqlite3.connect(consts.GOALS_DB_SQLITE)
-        cursor = conn.cursor()
-
-        cursor.execute(
+        await db.execute(
             "INSERT INTO goal_members (goal_id, user_id, role) VALUES (?, ?, ?)",
             (goal_id, user_id, "member")
         )
-        conn.commit()
-        conn.close()
 
     except sqlite3.Error as e:
         await update.message.reply_text("An error occurred while joining goal. Please try again.")
@@ -275,9 +286,9 @@ async def join_goal_from_creation(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     user = query.from_user
     user_id = user.id
-    goal_id = query.data.split(":")[1]
+    goal_id = context.args[0]
     group = query.message.chat
-    new_goal = context.chat_data.get(f"goal_id_{goal_id}")
+    new_goal = await chat_state.store.get(group.id, f"goal_id_{goal_id}")
 
     await utils.upsert_user_and_group(user, group)
 
@@ -315,10 +326,10 @@ async def complete_challenge_command(update: Update, context: ContextTypes.DEFAU
     display_name = utils.get_display_name_from_telegram_user(user)
 
     # Insert or update the user in the database
-    await utils.upsert_user_and_group(user, group)
+    await utils.upsert_user_and_group(user, group, wait=False)
 
     # Fetch active challenges the user has already joined
-    pending_challenges = utils.get_pending_challenges(group.id, user_id)
+    pending_challenges = await utils.get_pending_challenges(group.id, user_id)
 
     if not pending_challenges:
         await update.message.reply_text("You have no pending challenges to complete.")
@@ -328,7 +339,7 @@ async def complete_challenge_command(update: Update, context: ContextTypes.DEFAU
     message = f"{display_name} is completing a challenge! Pending challenges are listed below. Choose one to mark as completed and I will validate it with another group member:"
 
     keyboard = [
-            [InlineKeyboardButton(challenges['description'], callback_data=f"mark_challenge_complete:{challenges['challenge_response_id']}")]
+            [InlineKeyboardButton(challenges['description'], callback_data=callbacks.encode(callbacks.MARK_CHALLENGE_COMPLETE, challenges['challenge_response_id']))]
             for challenges in pending_challenges
         ]
     
@@ -345,23 +356,20 @@ async def mark_challenge_complete_handler(update: Update, context: ContextTypes.
     user_id = user.id
     display_name = utils.get_display_name_from_telegram_user(user)
 
-    challenge_response_id = query.data.split(":")[1]  # Extract the challenge response ID
+    challenge_response_id = context.args[0]  # Challenge response ID from the callback data
 
     # Update the challenge response status to 'completed'
     try:
-        with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE challenge_responses SET status = 'completed', completed_at = ? WHERE id = ? AND user_id = ?",
-                (datetime.now().isoformat(), challenge_response_id, user_id)
-            )
-            conn.commit()
+        await db.execute(
+            "UPDATE challenge_responses SET status = 'completed', completed_at = ? WHERE id = ? AND user_id = ?",
+            (datetime.now().isoformat(), challenge_response_id, user_id)
+        )
     except sqlite3.Error as e:
         await query.answer("An error occurred while marking the challenge as completed. Please try again.")
         logger.error(f"Database error: {e}")
         return
     
-    challenge = utils.get_challenge_from_challenge_response_id(challenge_response_id)
+    challenge = await utils.get_challenge_from_challenge_response_id(challenge_response_id)
 
     await query.edit_message_text(
         text = f"🎉 {display_name} has completed challenge '{challenge['description']}'. Remember to send your proof of completion to here for validation!",
@@ -370,6 +378,108 @@ async def mark_challenge_complete_handler(update: Update, context: ContextTypes.
     
     await validate_completion.validate(update, context, challenge_response_id, user_id)
 
+async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show or set the timezone the group's challenges, deadlines and reminders follow."""
+    group = update.effective_chat
+    user = update.effective_user
+
+    # Insert or update the user in the database
+    await utils.upsert_user_and_group(user, group)
+
+    if not context.args:
+        timezone = await utils.get_group_timezone(group.id)
+        await update.message.reply_text(
+            f"This group's timezone is {timezone}. Change it with /timezone <Area/City>, e.g. /timezone Europe/London."
+        )
+        return
+
+    timezone = context.args[0]
+    if timezone not in pytz.all_timezones_set:
+        await update.message.reply_text(
+            f"I don't know the timezone '{timezone}'. Use an Area/City name like Asia/Singapore or America/New_York."
+        )
+        return
+
+    await utils.set_group_timezone(group.id, timezone)
+    await update.message.reply_text(
+        f"Timezone set to {timezone}. Challenges, deadlines and reminders will follow this group's local time from now on."
+    )
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the user's streaks and completion counts for their goals in this group."""
+    group = update.effective_chat
+    user = update.effective_user
+    display_name = utils.get_display_name_from_telegram_user(user)
+
+    # Insert or update the user in the database
+    await utils.upsert_user_and_group(user, group, wait=False)
+
+    stats = await utils.get_user_goal_stats(user.id, group.id)
+    if not stats:
+        await update.message.reply_text("You have not joined any goals yet. Use /goals to join one or /addgoal to create one.")
+        return
+
+    lines = [f"📊 {display_name}'s stats"]
+    for row in stats:
+        lines.append(
+            f"\n<b>{html.escape(row['goal'])}</b>\n"
+            f"🔥 Streak: {row['current_streak']} (best {row['best_streak']})\n"
+            f"✅ {row['completed_count']} completed, ❌ {row['failed_count']} failed, out of {row['issued_count']} challenges"
+        )
+
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
+LEADERBOARD_PERIODS = {
+    "weekly": ("week", "This week"),
+    "monthly": ("month", "This month"),
+    "alltime": ("all", "All time"),
+}
+
+async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the group's top members for the week (default), month or all time."""
+    group = update.effective_chat
+    user = update.effective_user
+
+    # Insert or update the user in the database
+    await utils.upsert_user_and_group(user, group, wait=False)
+
+    choice = context.args[0].lower() if context.args else "weekly"
+    if choice not in LEADERBOARD_PERIODS:
+        await update.message.reply_text("Usage: /leaderboard [weekly|monthly|alltime]")
+        return
+
+    period, title = LEADERBOARD_PERIODS[choice]
+    leaders = await utils.get_leaderboard(group.id, period)
+    if not leaders:
+        await update.message.reply_text(f"No validated challenges yet for {title.lower()}. Complete one with /complete to get on the board!")
+        return
+
+    medals = ["🥇", "🥈", "🥉"]
+    lines = [f"🏆 <b>Leaderboard — {title}</b>\n"]
+    for rank, leader in enumerate(leaders, 1):
+        prefix = medals[rank - 1] if rank <= len(medals) else f"{rank}."
+        detail = f"{leader['challenges_completed']} challenges"
+        if leader["prizefights_won"]:
+            detail += f", {leader['prizefights_won']} prize fights"
+        lines.append(f"{prefix} {html.escape(leader['name'])} — {leader['points']} pts ({detail})")
+
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin only: summary of handler and job latencies since the bot started."""
+    if update.effective_user.id != consts.ADMIN_TELEGRAM_USER_ID:
+        return
+
+    await update.message.reply_text(f"<pre>{html.escape(metrics.summary())}</pre>", parse_mode='HTML')
+
+async def slow_queries_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin only: the slowest database statements since the bot started, with their query plans."""
+    if update.effective_user.id != consts.ADMIN_TELEGRAM_USER_ID:
+        return
+
+    # Stay under Telegram's 4096 character limit
+    await update.message.reply_text(f"<pre>{html.escape(slow_queries.report()[:3900])}</pre>", parse_mode='HTML')
+
 async def toggle_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Toggle daily reminders for the goal."""
     group = update.effective_chat
@@ -443,48 +553,95 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         print(f"Failed to send error to admin: {e}")
 
 
-def main() -> None:
-    """Start the bot."""
-    # Create the Application
-    application = Application.builder().token(consts.TELEGRAM_BOT_TOKEN).build()
+async def post_init(application: Application) -> None:
+    """Bring the database schema up to date and start background services before handling any updates."""
+    version = await db.run(migrations.bootstrap)
+    logger.info(f"Database schema at version {version}")
+
+    dispatcher.outbox.start(application.bot)
+
+    if consts.METRICS_PORT:
+        try:
+            await metrics.start_server()
+        except OSError as e:
+            logger.error(f"Could not start metrics endpoint on {consts.METRICS_LISTEN}:{consts.METRICS_PORT}: {e}")
+
 
-    # Set timezone for scheduling
-    sgt = pytz.timezone('Asia/Singapore')
+async def post_shutdown(application: Application) -> None:
+    """Release shared resources once the application has stopped."""
+    await dispatcher.outbox.stop()
+    await metrics.stop_server()
+    await challenge.close_groq_client()
+    await db.close()
+
+
+def build_application(request=None) -> Application:
+    """
+    Create the Application with its scheduled jobs and handlers, ready to run in either mode.
+
+    Args:
+        request: Optional telegram.request.BaseRequest for Bot API calls, replacing the default
+                 HTTP client (the load test passes a stub)
+
+    Every handler and job is wrapped by metrics.instrument, and Bot API calls are timed by
+    metrics.InstrumentedRequest.
+    """
+    # Same client PTB would build by default, wrapped so API time is attributed to handlers
+    request = metrics.InstrumentedRequest(request or HTTPXRequest(connection_pool_size=256))
+    builder = Application.builder().token(consts.TELEGRAM_BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown)
+    builder = builder.request(request)
+    builder = builder.concurrent_updates(consts.CONCURRENT_UPDATES if consts.CONCURRENT_UPDATES > 1 else False)
+    if consts.TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(consts.TELEGRAM_API_BASE_URL)
+    application = builder.build()
 
     if consts.DEV_MODE:
-        application.job_queue.run_repeating(challenge.schedule_challenges, interval=consts.DEV_CHALLENGE_INTERVAL, first=10)
-        application.job_queue.run_repeating(clear_challenges.fail_prizefights, interval=consts.DEV_CHALLENGE_INTERVAL, first=30)
+        application.job_queue.run_repeating(metrics.instrument(challenge.schedule_challenges), interval=consts.DEV_CHALLENGE_INTERVAL, first=10)
+        application.job_queue.run_repeating(metrics.instrument(clear_challenges.fail_prizefights), interval=consts.DEV_CHALLENGE_INTERVAL, first=30)
 
     else:
-        # Generate and issue challenges for the next day at 9:30 PM SGT daily
-        application.job_queue.run_daily(challenge.schedule_challenges, time=time(hour=consts.CHALLENGE_GENERATION_HOUR, minute=consts.CHALLENGE_GENERATION_MINUTE, tzinfo=sgt))
+        # Pre-generation, challenges, deadlines and reminders run at each group's local time;
+        # the scheduler wakes up every SCHEDULER_TICK_MINUTES and runs whatever is due where
+        application.job_queue.run_repeating(metrics.instrument(scheduler.tick), interval=consts.SCHEDULER_TICK_MINUTES * 60, first=scheduler.seconds_until_next_tick())
+
+        # Retry pre-generated challenges that failed, in the background until the nightly run
+        application.job_queue.run_repeating(metrics.instrument(challenge.retry_pending_challenges), interval=consts.PREGENERATION_RETRY_INTERVAL, first=consts.PREGENERATION_RETRY_INTERVAL)
 
-        # Clear expiring challenges at 11:59 PM SGT daily
-        application.job_queue.run_daily(clear_challenges.fail_expiring_challenges, time=time(hour=consts.CHALLENGE_DEADLINE_HOUR, minute=consts.CHALLENGE_DEADLINE_MINUTE, tzinfo=sgt))
-        application.job_queue.run_daily(clear_challenges.fail_prizefights, time=time(hour=consts.CHALLENGE_DEADLINE_HOUR, minute=consts.CHALLENGE_DEADLINE_MINUTE, tzinfo=sgt))
 
+    # Move old resolved challenges out of the hot tables, at a quiet hour
+    application.job_queue.run_daily(metrics.instrument(archive.archive_job), time=time(consts.ARCHIVE_HOUR, consts.ARCHIVE_MINUTE, tzinfo=pytz.timezone(consts.SCHEDULE_TIMEZONE)))
+
+    # Sweep expired join lists and suggestion prompts
+    application.job_queue.run_repeating(metrics.instrument(chat_state.purge_expired), interval=consts.CHAT_STATE_PURGE_INTERVAL, first=consts.CHAT_STATE_PURGE_INTERVAL)
 
     # Add command handlers
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("goals", goals_command))
     application.add_handler(CommandHandler("addgoal", add_goal_command))
     application.add_handler(CommandHandler("feedback", feedback_to_admin))
+    application.add_handler(CommandHandler("timezone", timezone_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("leaderboard", leaderboard_command))
+    application.add_handler(CommandHandler("metrics", metrics_command))
+    application.add_handler(CommandHandler("slowqueries", slow_queries_command))
     application.add_handler(CommandHandler("deletegoal", delete_goal_command))
     application.add_handler(CommandHandler("prizefight", prizefight.prize_fight))
     application.add_handler(CommandHandler("complete", complete_challenge_command))
     application.add_handler(CommandHandler("complete_prizefight", prizefight.complete_prize_fight_handler))
 
-    # Add callback handler for inline buttons
-    application.add_handler(CallbackQueryHandler(join_goal_from_creation, pattern=r"^join_goal_from_creation:"))
-    application.add_handler(CallbackQueryHandler(join_goals_from_goals_command, pattern=r"^join_goal_from_goals_command:"))
-    application.add_handler(CallbackQueryHandler(challenge.accept_challenge, pattern=r"^accept_challenge_"))
-    application.add_handler(CallbackQueryHandler(challenge.handle_suggest_challenge, pattern=r"^suggest_challenge_"))
-    application.add_handler(CallbackQueryHandler(mark_challenge_complete_handler, pattern=r"^mark_challenge_complete:"))
-    application.add_handler(CallbackQueryHandler(validate_completion.handle_validation_response, pattern=r"^validate_"))
-    application.add_handler(CallbackQueryHandler(prizefight.handle_prize_fight_response, pattern=r"^accept_prizefight:"))
-    application.add_handler(CallbackQueryHandler(prizefight.handle_prize_fight_response, pattern=r"^suggest_prizefight"))
-    application.add_handler(CallbackQueryHandler(prizefight.complete_selected_prize_fight, pattern=r"^complete_prizefight:"))
-    application.add_handler(CallbackQueryHandler(prizefight.handle_prize_fight_validation, pattern=r"^prizefight_validate:"))
+    # Add callback handler for inline buttons: one router, keyed by the action in the callback data
+    router = callbacks.CallbackRouter()
+    router.add(callbacks.JOIN_GOAL_FROM_CREATION, metrics.instrument(join_goal_from_creation))
+    router.add(callbacks.JOIN_GOAL_FROM_GOALS, metrics.instrument(join_goals_from_goals_command))
+    router.add(callbacks.ACCEPT_CHALLENGE, metrics.instrument(challenge.accept_challenge))
+    router.add(callbacks.SUGGEST_CHALLENGE, metrics.instrument(challenge.handle_suggest_challenge))
+    router.add(callbacks.MARK_CHALLENGE_COMPLETE, metrics.instrument(mark_challenge_complete_handler))
+    router.add(callbacks.VALIDATE_CHALLENGE, metrics.instrument(validate_completion.handle_validation_response))
+    router.add(callbacks.ACCEPT_PRIZEFIGHT, metrics.instrument(prizefight.handle_prize_fight_response))
+    router.add(callbacks.SUGGEST_PRIZEFIGHT, metrics.instrument(prizefight.handle_prize_fight_suggestion))
+    router.add(callbacks.COMPLETE_PRIZEFIGHT, metrics.instrument(prizefight.complete_selected_prize_fight))
+    router.add(callbacks.VALIDATE_PRIZEFIGHT, metrics.instrument(prizefight.handle_prize_fight_validation))
+    application.add_handler(CallbackQueryHandler(router.dispatch))
     application.add_handler(MessageHandler(filters.TEXT & filters.REPLY & ~filters.COMMAND, prizefight.prize_fight))
     application.add_handler(MessageHandler(filters.TEXT & filters.REPLY & ~filters.COMMAND, challenge.handle_suggestion_reply))
     application.add_handler(ChatMemberHandler(bot_added_to_group, ChatMemberHandler.MY_CHAT_MEMBER))
@@ -495,12 +652,45 @@ def main() -> None:
     # Add message handler for regular text messages
     # application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
+    # Record latency, errors, DB and Bot API time for everything registered above. Button
+    # presses are recorded once, under their route; the router itself isn't wrapped.
+    metrics.instrument_handlers(application, exclude=(router.dispatch,))
+
     # Add error handler
     application.add_error_handler(error_handler)
 
-    # Start the bot
-    print("Bot is starting...")
-    application.run_polling(allowed_updates=["message", "callback_query", "my_chat_member"])
+    return application
+
+
+def main() -> None:
+    """Start the bot."""
+    application = build_application()
+
+    if consts.BOT_MODE == "webhook":
+        if not consts.WEBHOOK_URL:
+            raise RuntimeError("BOT_MODE=webhook requires WEBHOOK_URL")
+        if not consts.WEBHOOK_SECRET_TOKEN:
+            # Without it anyone who can reach the listener can post forged updates
+            raise RuntimeError("BOT_MODE=webhook requires WEBHOOK_SECRET_TOKEN")
+
+        print(f"Bot is starting in webhook mode on {consts.WEBHOOK_LISTEN}:{consts.WEBHOOK_PORT}/{consts.WEBHOOK_PATH}...")
+        # setWebhook is called on startup; requests without the matching secret token are rejected with 403
+        application.run_webhook(
+            listen=consts.WEBHOOK_LISTEN,
+            port=consts.WEBHOOK_PORT,
+            url_path=consts.WEBHOOK_PATH,
+            webhook_url=consts.WEBHOOK_URL,
+            secret_token=consts.WEBHOOK_SECRET_TOKEN,
+            max_connections=consts.WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=consts.ALLOWED_UPDATES,
+        )
+
+    elif consts.BOT_MODE == "polling":
+        print("Bot is starting...")
+        application.run_polling(allowed_updates=consts.ALLOWED_UPDATES)
+
+    else:
+        raise RuntimeError(f"Unknown BOT_MODE {consts.BOT_MODE!r}, expected 'polling' or 'webhook'")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+import logging
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# callback_data is "<version><action>" followed by ":"-separated base36 integers, e.g.
+# "1vp:1a:2k201:1" for prizefight_validate on prize fight 46 by user 4294945. Telegram caps
+# callback_data at 64 bytes, which the old "prizefight_validate:<id>:<user id>:accept" format
+# could approach. Bump CALLBACK_VERSION if the meaning of an action's arguments changes.
+CALLBACK_VERSION = "1"
+MAX_CALLBACK_DATA_BYTES = 64
+
+JOIN_GOAL_FROM_CREATION = "jc" # goal_id
+JOIN_GOAL_FROM_GOALS = "jg" # goal_id
+ACCEPT_CHALLENGE = "ac" # challenge_id
+SUGGEST_CHALLENGE = "sc" # goal_id, challenge_id
+MARK_CHALLENGE_COMPLETE = "mc" # challenge_response_id
+VALIDATE_CHALLENGE = "vc" # challenge_response_id, 1 = yes / 0 = no
+ACCEPT_PRIZEFIGHT = "ap" # prizefight_id, challenger user_id
+SUGGEST_PRIZEFIGHT = "sp" # prizefight_id
+COMPLETE_PRIZEFIGHT = "cp" # prizefight_id
+VALIDATE_PRIZEFIGHT = "vp" # prizefight_id, challenger user_id, 1 = accept / 0 = reject
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def to_base36(number):
+    number = int(number)
+    if number < 0:
+        return "-" + to_base36(-number)
+
+    digits = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        digits = _DIGITS[remainder] + digits
+        if not number:
+            return digits
+
+
+def encode(action, *args):
+    """
+    Build callback_data for an action and its integer arguments.
+
+    Raises:
+        ValueError: If the result would exceed Telegram's 64-byte limit
+    """
+    data = CALLBACK_VERSION + action + "".join(f":{to_base36(arg)}" for arg in args)
+    if len(data.encode()) > MAX_CALLBACK_DATA_BYTES:
+        raise ValueError(f"callback_data too long ({len(data.encode())} bytes): {data}")
+    return data
+
+
+def decode(data):
+    """
+    Parse callback_data produced by encode.
+
+    Returns:
+        tuple: (action, list of ints), or None if data isn't in the current format
+    """
+    head, *args = data.split(":")
+    if not head.startswith(CALLBACK_VERSION):
+        return None
+    try:
+        return head[len(CALLBACK_VERSION):], [int(arg, 36) for arg in args]
+    except ValueError:
+        return None
+
+
+# Buttons already sent to chats still carry the old formats, so they are translated to
+# (action, args) as well. Each parser gets the text after its prefix.
+def _colon_ints(rest):
+    return [int(part) for part in rest.split(":")]
+
+
+def _underscore_ints(rest):
+    return [int(part) for part in rest.split("_")]
+
+
+def _legacy_validate_challenge(rest):
+    challenge_response_id, answer = rest.split("_")
+    return [int(challenge_response_id), int(answer == "yes")]
+
+
+def _legacy_validate_prizefight(rest):
+    prizefight_id, user_id, action = rest.split(":")
+    return [int(prizefight_id), int(user_id), int(action == "accept")]
+
+
+LEGACY_PREFIXES = {
+    "join_goal_from_creation:": (JOIN_GOAL_FROM_CREATION, _colon_ints),
+    "join_goal_from_goals_command:": (JOIN_GOAL_FROM_GOALS, _colon_ints),
+    "accept_challenge_": (ACCEPT_CHALLENGE, _underscore_ints),
+    "suggest_challenge_": (SUGGEST_CHALLENGE, _underscore_ints),
+    "mark_challenge_complete:": (MARK_CHALLENGE_COMPLETE, _colon_ints),
+    "validate_": (VALIDATE_CHALLENGE, _legacy_validate_challenge),
+    # Legacy proposals carried the challenge text and prize instead of a prize fight row;
+    # the handler falls back to reading them from the message when it gets no arguments
+    "accept_prizefight:": (ACCEPT_PRIZEFIGHT, lambda rest: []),
+    "suggest_prizefight": (SUGGEST_PRIZEFIGHT, lambda rest: []),
+    "complete_prizefight:": (COMPLETE_PRIZEFIGHT, _colon_ints),
+    "prizefight_validate:": (VALIDATE_PRIZEFIGHT, _legacy_validate_prizefight),
+}
+
+
+class CallbackRouter:
+    """
+    Single entry point for every inline button. Current-format data is routed by its action
+    code with one dict lookup; legacy data is matched against LEGACY_PREFIXES with a
+    character trie. Handlers find the decoded integer arguments in context.args.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._trie = {}
+
+        for prefix, route in LEGACY_PREFIXES.items():
+            node = self._trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[None] = route
+
+    def add(self, action, handler):
+        self._handlers[action] = handler
+
+    def _match_legacy(self, data):
+        node = self._trie
+        for i, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                return None
+            if None in node:
+                action, parse = node[None]
+                return action, parse(data[i + 1:])
+        return None
+
+    def resolve(self, data):
+        """
+        Returns:
+            tuple: (handler, list of ints), or None if nothing handles data
+        """
+        try:
+            route = decode(data) or self._match_legacy(data)
+        except ValueError:
+            route = None
+
+        if route is None or route[0] not in self._handlers:
+            return None
+        action, args = route
+        return self._handlers[action], args
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        resolved = self.resolve(query.data or "")
+        if resolved is None:
+            logger.warning(f"Unhandled callback data: {query.data!r}")
+            await query.answer()
+            return
+
+        handler, context.args = resolved
+        await handler(update, context)
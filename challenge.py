@@ -1,8 +1,9 @@
-import os
 import json
+import asyncio
 import logging
-import sqlite3
-from groq import Groq
+import httpx
+import pytz
+from groq import AsyncGroq, DefaultAsyncHttpxClient
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
@@ -17,10 +18,17 @@ from telegram.ext import (
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply
 
 import utils
+import db
+import ratelimit
+import challenge_cache
+import dispatcher
+import user_cache
+import chat_state
+import callbacks
 import constants as consts
 import prompt_template as ptemplates
 
-def get_users_for_goal(goal_id):
+async def get_users_for_goal(goal_id):
     """
     Fetch users working on a specific goal.
 
@@ -28,123 +36,496 @@ def get_users_for_goal(goal_id):
         goal_id (int): The ID of the goal.
 
     Returns:
-        list: A list of users working on the goal.
+        list: A list of users working on the goal, as dicts with "user_id" and "name".
     """
 
-    user_list = []
+    rows = await db.fetchall("""
+        SELECT gm.user_id
+        FROM goal_members gm
+        WHERE gm.goal_id = ?
+    """, (goal_id,))
 
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT u.user_id, 
-                CASE 
-                    WHEN u.username IS NOT NULL THEN '@' || u.username
-                    ELSE u.display_name
-                END AS name
-            FROM users u
-            JOIN goal_members gm ON u.user_id = gm.user_id
-            WHERE gm.goal_id = ?
-        """, (goal_id,))
-        
-        users = cursor.fetchall() # list of sqlite3.Row objects, each representing a user, can be accessed like a dict
+    names = await user_cache.users.get_names(r["user_id"] for r in rows)
 
-        return users 
+    return [{"user_id": r["user_id"], "name": names[r["user_id"]]} for r in rows if r["user_id"] in names]
     
-def get_goals_to_challenge(db_path):
+async def get_goals_to_challenge(group_ids=None):
     """
     Fetch goals from the database that should be challenged based on their frequency
     and last_challenged timestamp.
 
     Args:
-        db_path (str): Path to the SQLite database file.
+        group_ids (list): Only goals in these groups; None for every group
 
     Returns:
         list: A list of goals that need to be challenged.
     """
 
-    # Connect to the database
-    with sqlite3.connect(db_path) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT *
-            FROM goals
-            WHERE status = 'active'
-        """)
-        rows = cursor.fetchall()
+    return await db.fetchall("""
+        SELECT *
+        FROM goals
+        WHERE status = 'active'
+        AND (?1 IS NULL OR group_id IN (SELECT value FROM json_each(?1)))
+    """, (utils.optional_json_list(group_ids),))
+
+# Shared across every caller so the whole process stays inside the Groq quota
+groq_limiter = ratelimit.RateLimiter(consts.GROQ_REQUESTS_PER_MINUTE, consts.GROQ_TOKENS_PER_MINUTE)
+
+def estimate_tokens(messages, max_tokens):
+    """Rough token estimate for a chat request (~4 characters per token plus the completion budget)."""
+    return sum(len(m["content"]) for m in messages) // 4 + max_tokens
+
+# One client for the whole process, so requests reuse pooled keep-alive connections instead
+# of paying for a new TLS handshake each. Created on first use, closed by close_groq_client.
+_groq_client = None
+
+def get_groq_client():
+    """Return the shared AsyncGroq client, creating it on first use."""
+    global _groq_client
+    if _groq_client is None:
+        _groq_client = AsyncGroq(
+            api_key=consts.GROQ_TOKEN,
+            timeout=httpx.Timeout(consts.GROQ_TIMEOUT, connect=consts.GROQ_CONNECT_TIMEOUT),
+            max_retries=consts.GROQ_MAX_RETRIES,
+            http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=consts.GROQ_MAX_CONNECTIONS,
+                max_keepalive_connections=consts.GROQ_MAX_CONNECTIONS,
+                keepalive_expiry=consts.GROQ_KEEPALIVE_EXPIRY,
+            )),
+        )
+    return _groq_client
+
+async def close_groq_client():
+    """Close the shared client's connections. Called on application shutdown."""
+    global _groq_client
+    if _groq_client is not None:
+        client, _groq_client = _groq_client, None
+        await client.close()
+
+async def _complete(messages, max_tokens):
+    """Send a JSON-mode chat completion request to Groq once quota is available. Returns the raw response."""
+
+    # Wait for quota before sending the request
+    await groq_limiter.acquire(estimate_tokens(messages, max_tokens))
+
+    return await asyncio.wait_for(
+        get_groq_client().chat.completions.create(
+            model="meta-llama/llama-4-scout-17b-16e-instruct",  
+            messages=messages,
+            max_tokens = max_tokens,
+            response_format = {'type': 'json_object'}
+        ),
+        timeout = consts.CHALLENGE_GENERATION_DEADLINE
+    )
 
-    return rows
+def _goal_day(start_date):
+    """Number of days since the goal started."""
+    return (datetime.now() - datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S")).days
 
-def generate_challenge(goal, start_date, past_challenges):
+async def generate_challenge(goal, start_date, past_challenges, streak_days=0):
     """
     Generate a challenge message for a given goal.
 
     Args:
         goal (str): The goal text.
+        streak_days (int): The members' current streak, from user_goal_stats.
 
     Returns:
         str: A challenge message.
     """
 
-    # Get number of days since the goal started
-    num_days = datetime.now() - datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S")
-
-    # Initialize the Groq client
-    client = Groq(api_key=os.getenv("GROQ_TOKEN"))
+    messages = [
+        {"role": "system", "content": ptemplates.CHALLENGE_PROMPT_TEMPLATE.format(goal = goal, num_day = _goal_day(start_date), past_challenges = [challenge['description'] for challenge in past_challenges], streak_days = streak_days)},
+        {"role": "user", "content": f"Generate a challenge for: {goal}."}
+    ]
 
     # Create a chat completion request to generate the challenge
-    response = client.chat.completions.create(
-        model="meta-llama/llama-4-scout-17b-16e-instruct",  
-        messages=[
-            {"role": "system", "content": ptemplates.CHALLENGE_PROMPT_TEMPLATE.format(goal = goal, num_day = num_days.days, past_challenges = [challenge['description'] for challenge in past_challenges])},
-            {"role": "user", "content": f"Generate a challenge for: {goal}."}
-        ],
-        max_tokens = consts.CHALLENGE_MAX_TOKENS,
-        response_format = {'type': 'json_object'}
-    )
+    response = await _complete(messages, consts.CHALLENGE_MAX_TOKENS)
 
     # Extract the generated challenge from the response
     generated_challenge = json.loads(response.choices[0].message.content)
 
     return generated_challenge
 
-async def schedule_challenges(context: ContextTypes.DEFAULT_TYPE):
+def _batch_messages(entries):
+    """Build the chat messages for a batch of goal entries."""
+    goals = "\n".join(json.dumps(entry, ensure_ascii=False) for entry in entries)
+    return [
+        {"role": "system", "content": ptemplates.BATCH_CHALLENGE_PROMPT_TEMPLATE.format(goals = goals)},
+        {"role": "user", "content": f"Generate a challenge for each of the {len(entries)} goals."}
+    ]
+
+def _batch_max_tokens(entries):
+    # Each item also carries its goal_id and JSON punctuation on top of the challenge text
+    return (consts.CHALLENGE_MAX_TOKENS + consts.CHALLENGE_BATCH_ITEM_OVERHEAD_TOKENS) * len(entries)
+
+def _split_into_batches(entries):
+    """Greedily pack goal entries into batches that fit the per-request goal and token budgets."""
+    batches = []
+    current = []
+
+    for entry in entries:
+        candidate = current + [entry]
+        over_budget = estimate_tokens(_batch_messages(candidate), _batch_max_tokens(candidate)) > consts.CHALLENGE_BATCH_MAX_TOKENS
+
+        if current and (len(candidate) > consts.CHALLENGE_BATCH_MAX_GOALS or over_budget):
+            batches.append(current)
+            current = [entry]
+        else:
+            current = candidate
+
+    if current:
+        batches.append(current)
+
+    return batches
+
+async def generate_challenges_batch(entries):
     """
-    Schedule challenges for goals based on their frequency and last challenged timestamp.
-    This function fetches goals that need to be challenged and generates challenges for them.
+    Generate challenges for several goals in a single request.
+
+    Args:
+        entries (list): Dicts with "goal_id", "goal", "day", "past_challenges" and "streak_days" keys.
+
+    Returns:
+        dict: Mapping of goal_id to challenge text, for every well-formed item in the response.
+              Goals missing from the result should be retried individually.
     """
 
-    # Fetch goals that need to be challenged
-    goals_to_challenge = get_goals_to_challenge(consts.GOALS_DB_SQLITE)
+    response = await _complete(_batch_messages(entries), _batch_max_tokens(entries))
+    choice = response.choices[0]
 
-    for goal in goals_to_challenge:
+    # Output was cut off, so the JSON is incomplete. Halve the batch and try again.
+    if choice.finish_reason == "length" and len(entries) > 1:
+        middle = len(entries) // 2
+        first, second = await asyncio.gather(
+            generate_challenges_batch(entries[:middle]),
+            generate_challenges_batch(entries[middle:])
+        )
+        return {**first, **second}
 
-        # Get past challenges
-        past_challenges = utils.get_past_challenges(goal['id'])
+    items = json.loads(choice.message.content).get("challenges")
+    if not isinstance(items, list):
+        raise ValueError(f"Batch response has no challenges list: {choice.message.content}")
 
-        # Generate a challenge for the goal
-        challenge_message = generate_challenge(goal["goal"], goal["created_at"], past_challenges).get("challenge")
+    expected_ids = {entry["goal_id"] for entry in entries}
+    generated = {}
 
-        # Get users working on this goal
-        users = get_users_for_goal(goal["id"])
+    for item in items:
+        goal_id = item.get("goal_id") if isinstance(item, dict) else None
+        challenge_message = item.get("challenge") if isinstance(item, dict) else None
 
-        # Store the challenge in the database        
-        with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO challenges (goal_id, description, due_date) VALUES (?, ?, ?)", (goal['id'], challenge_message, (datetime.now() + timedelta(days=consts.CHALLENGE_DEADLINE_DAYS)).isoformat())
-            )
+        if goal_id in expected_ids and isinstance(challenge_message, str) and challenge_message.strip():
+            generated[goal_id] = challenge_message.strip()
+        else:
+            logger.warning(f"Skipping malformed batch item: {item}")
 
-            challenge_id = cursor.lastrowid
+    return generated
 
-            for i in users:
-                cursor.execute(
-                    "INSERT INTO challenge_responses (challenge_id, user_id, status) VALUES (?, ?, ?)", 
-                    (challenge_id, i['user_id'], 'issued')
-                )
+async def _generate_for_goal(goal, past_challenges, streak_days, semaphore):
+    """Generate a challenge for one goal, holding a concurrency slot for the duration."""
+    async with semaphore:
+        return await generate_challenge(goal["goal"], goal["created_at"], past_challenges, streak_days)
+
+async def _generate_batch(entries, semaphore):
+    async with semaphore:
+        return await generate_challenges_batch(entries)
+
+async def generate_challenges_for_goals(goals):
+    """
+    Generate one challenge per goal, serving goals with popular text from the challenge cache.
+
+    Goals are keyed by normalized text and day bucket. A goal takes the newest cached
+    challenge for its key that it hasn't been given before. The remaining goals are
+    generated once per distinct key, and the result is shared by every goal with that key.
+
+    Args:
+        goals (list): Goal rows with "id", "goal" and "created_at".
+
+    Returns:
+        dict: Mapping of goal_id to challenge text. Goals that could not be generated are
+              logged and left out.
+    """
+    if not consts.CHALLENGE_CACHE_ENABLED:
+        return await _generate_uncached(goals)
+
+    evicted = await challenge_cache.evict()
+    keys = {
+        goal["id"]: (challenge_cache.normalize_goal(goal["goal"]), challenge_cache.day_bucket(_goal_day(goal["created_at"])))
+        for goal in goals
+    }
+    cached = await challenge_cache.lookup(keys.values())
+    used = await challenge_cache.used_by_goals(keys)
+
+    generated = {}
+    misses = {}
+    for goal in goals:
+        hit = next((c for c in cached.get(keys[goal["id"]], []) if c not in used.get(goal["id"], ())), None)
+        if hit:
+            generated[goal["id"]] = hit
+        else:
+            misses.setdefault(keys[goal["id"]], []).append(goal)
+
+    hits = len(generated)
+
+    # One request per distinct key, shared by every goal with that key
+    fresh = await _generate_uncached([same[0] for same in misses.values()])
+
+    # Goals that already had the shared challenge get their own
+    conflicts = []
+    for same in misses.values():
+        challenge_message = fresh.get(same[0]["id"])
+        for goal in same:
+            if challenge_message and challenge_message not in used.get(goal["id"], ()):
+                generated[goal["id"]] = challenge_message
+            elif challenge_message:
+                conflicts.append(goal)
+
+    if conflicts:
+        fresh.update(await _generate_uncached(conflicts))
+        generated.update({goal["id"]: fresh[goal["id"]] for goal in conflicts if goal["id"] in fresh})
+
+    await challenge_cache.store((keys[goal_id], challenge_message) for goal_id, challenge_message in fresh.items())
+
+    logger.info(
+        f"Challenge cache: {hits} hits, {len(goals) - hits} misses over {len(misses)} distinct goals, "
+        f"{len(fresh)} generated, {evicted} evicted"
+    )
+
+    return generated
+
+async def _generate_uncached(goals):
+    """
+    Generate one challenge per goal, concurrently and within the Groq quota.
+
+    In batch mode goals are packed into multi-goal requests; any goal a batch fails to
+    return a usable challenge for falls back to its own request.
+
+    Returns:
+        dict: Mapping of goal_id to challenge text, leaving out goals that failed
+    """
+    if not goals:
+        return {}
+
+    semaphore = asyncio.Semaphore(consts.CHALLENGE_GENERATION_CONCURRENCY)
+    past_challenges = {goal["id"]: await utils.get_past_challenges(goal["id"]) for goal in goals}
+    streaks = await utils.get_goal_streaks(goal["id"] for goal in goals)
+    generated = {}
+    remaining = list(goals)
+
+    if consts.CHALLENGE_BATCH_MODE and len(goals) > 1:
+        entries = [
+            {
+                "goal_id": goal["id"],
+                "goal": goal["goal"],
+                "day": _goal_day(goal["created_at"]),
+                "past_challenges": [c["description"] for c in past_challenges[goal["id"]]],
+                "streak_days": streaks.get(goal["id"], 0)
+            }
+            for goal in goals
+        ]
+        batches = _split_into_batches(entries)
+        results = await asyncio.gather(
+            *(_generate_batch(batch, semaphore) for batch in batches),
+            return_exceptions=True
+        )
+
+        for batch, result in zip(batches, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error generating batch of {len(batch)} challenges, falling back to single requests: {result!r}")
+            else:
+                generated.update(result)
 
-            conn.commit()
+        remaining = [goal for goal in goals if goal["id"] not in generated]
+
+    results = await asyncio.gather(
+        *(_generate_for_goal(goal, past_challenges[goal["id"]], streaks.get(goal["id"], 0), semaphore) for goal in remaining),
+        return_exceptions=True
+    )
+
+    for goal, result in zip(remaining, results):
+        if isinstance(result, asyncio.TimeoutError):
+            logger.error(f"Timed out generating challenge for goal {goal['id']}")
+        elif isinstance(result, Exception):
+            logger.error(f"Error generating challenge for goal {goal['id']}: {result}")
+        elif not result.get("challenge"):
+            logger.error(f"No challenge in generated response for goal {goal['id']}: {result}")
+        else:
+            generated[goal["id"]] = result["challenge"]
+
+    return generated
+
+def _insert_challenge(conn, goal_id, description, users):
+    """Insert a challenge and issue it to every user working on the goal. Returns the challenge ID."""
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO challenges (goal_id, description, due_date) VALUES (?, ?, ?)", (goal_id, description, (datetime.now() + timedelta(days=consts.CHALLENGE_DEADLINE_DAYS)).isoformat())
+    )
+
+    challenge_id = cursor.lastrowid
+
+    cursor.executemany(
+        "INSERT INTO challenge_responses (challenge_id, user_id, status) VALUES (?, ?, ?)",
+        [(challenge_id, u['user_id'], 'issued') for u in users]
+    )
+
+    return challenge_id
+
+def _issue_date(timezone=None):
+    """Date of the nightly run that will send challenges prepared now, in the groups' timezone."""
+    return datetime.now(pytz.timezone(timezone or consts.SCHEDULE_TIMEZONE)).date().isoformat()
+
+def _enqueue_pending(conn, issue_date, group_ids):
+    """Queue every active goal (in group_ids, if given) without a pending row for issue_date, and drop rows older than a week."""
+    conn.execute("DELETE FROM pending_challenges WHERE issue_date < DATE(?, '-7 days')", (issue_date,))
+    return conn.execute("""
+        INSERT OR IGNORE INTO pending_challenges (goal_id, issue_date)
+        SELECT id, ?1 FROM goals
+        WHERE status = 'active'
+        AND (?2 IS NULL OR group_id IN (SELECT value FROM json_each(?2)))
+    """, (issue_date, utils.optional_json_list(group_ids))).rowcount
+
+def _save_pending(conn, rows, generated):
+    """Mark generated rows ready; schedule a retry with backoff (or give up) for the rest."""
+    conn.executemany("""
+        UPDATE pending_challenges
+        SET status = 'ready', description = ?, attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    """, [(generated[row["id"]], row["pending_id"]) for row in rows if row["id"] in generated])
+
+    conn.executemany("""
+        UPDATE pending_challenges
+        SET attempts = attempts + 1,
+            status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'queued' END,
+            next_attempt_at = DATETIME('now', '+' || (? << attempts) || ' seconds'),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    """, [
+        (consts.PREGENERATION_MAX_ATTEMPTS, consts.PREGENERATION_RETRY_BACKOFF, row["pending_id"])
+        for row in rows if row["id"] not in generated
+    ])
+
+async def _generate_pending(issue_date=None):
+    """Generate challenges for queued rows that are due, for issue_date or any recent date. Returns (generated, failed) counts."""
+    rows = await db.fetchall("""
+        SELECT g.id, g.goal, g.created_at, pc.id AS pending_id
+        FROM pending_challenges pc
+        JOIN goals g ON pc.goal_id = g.id
+        WHERE (?1 IS NULL AND pc.issue_date >= DATE('now', '-1 day') OR pc.issue_date = ?1)
+        AND pc.status = 'queued' AND pc.next_attempt_at <= CURRENT_TIMESTAMP
+        AND g.status = 'active'
+    """, (issue_date,))
+
+    if not rows:
+        return 0, 0
+
+    generated = await generate_challenges_for_goals(rows)
+    await db.run(_save_pending, rows, generated)
+
+    return len(generated), len(rows) - len(generated)
+
+async def pregenerate_challenges(context: ContextTypes.DEFAULT_TYPE, group_ids=None, timezone=None):
+    """
+    Prepare tonight's challenges ahead of time, so the nightly run doesn't wait on Groq.
+
+    Every active goal gets a pending_challenges row for tonight's run, and the challenges are
+    generated into it. Goals that fail are retried by retry_pending_challenges.
+
+    Args:
+        group_ids (list): Only these groups' goals; None for every group
+        timezone (str): The groups' timezone, which decides the date of "tonight"
+    """
+    issue_date = _issue_date(timezone)
+    queued = await db.run(_enqueue_pending, issue_date, group_ids)
+    generated, failed = await _generate_pending(issue_date)
+    logger.info(f"Pre-generation for {issue_date}: {queued} goals queued, {generated} ready, {failed} to retry")
+
+async def retry_pending_challenges(context: ContextTypes.DEFAULT_TYPE):
+    """Background retry pass for pre-generated challenges that failed and are due another attempt."""
+    generated, failed = await _generate_pending()
+    if generated or failed:
+        logger.info(f"Pre-generation retry: {generated} ready, {failed} still failing")
+
+def _issue_challenge(conn, goal_id, description, users, issue_date):
+    """
+    Insert the challenge and record the goal as issued for issue_date, in the same transaction.
+
+    The pending_challenges row doubles as the record that tonight's challenge went out, so a
+    second run for the same night (a restart or late tick inside the scheduler window) is a
+    no-op. Goals created after pre-generation get their row here.
+
+    Returns:
+        int: The challenge ID, or None if the goal was already issued a challenge for issue_date
+    """
+    if not consts.DEV_MODE and conn.execute("""
+        SELECT 1 FROM pending_challenges WHERE goal_id = ? AND issue_date = ? AND status = 'issued'
+    """, (goal_id, issue_date)).fetchone():
+        return None
+
+    challenge_id = _insert_challenge(conn, goal_id, description, users)
+    conn.execute("""
+        INSERT INTO pending_challenges (goal_id, issue_date, description, status)
+        VALUES (?, ?, ?, 'issued')
+        ON CONFLICT (goal_id, issue_date) DO UPDATE SET
+            status = 'issued', description = excluded.description, updated_at = CURRENT_TIMESTAMP
+    """, (goal_id, issue_date, description))
+    return challenge_id
+
+async def schedule_challenges(context: ContextTypes.DEFAULT_TYPE, group_ids=None, timezone=None):
+    """
+    Schedule challenges for goals based on their frequency and last challenged timestamp.
+
+    Challenges prepared by pregenerate_challenges are sent as they are. Only goals without a
+    ready challenge (created since pre-generation, or still failing) are generated inline.
+
+    Args:
+        group_ids (list): Only these groups' goals; None for every group
+        timezone (str): The groups' timezone, which decides the date of "tonight"
+    """
+
+    # Fetch goals that need to be challenged
+    goals_to_challenge = await get_goals_to_challenge(group_ids)
+    issue_date = _issue_date(timezone)
+
+    # Skip goals already issued tonight's challenge, e.g. when the run repeats after a restart.
+    # DEV_MODE issues a challenge every DEV_CHALLENGE_INTERVAL, so it has no nightly run to guard.
+    if not consts.DEV_MODE:
+        issued = await db.fetchall("""
+            SELECT goal_id FROM pending_challenges WHERE issue_date = ? AND status = 'issued'
+        """, (issue_date,))
+        issued = {row["goal_id"] for row in issued}
+        if issued:
+            logger.info(f"{len(issued)} goals were already issued a challenge for {issue_date}, skipping them")
+            goals_to_challenge = [goal for goal in goals_to_challenge if goal["id"] not in issued]
+
+    # Pre-generated challenges for tonight
+    prepared = await db.fetchall("""
+        SELECT goal_id, description
+        FROM pending_challenges
+        WHERE issue_date = ? AND status = 'ready'
+    """, (issue_date,))
+    generated = {row["goal_id"]: row["description"] for row in prepared}
+
+    # Generate the rest concurrently, within the Groq quota
+    missing = [goal for goal in goals_to_challenge if goal["id"] not in generated]
+    if missing:
+        logger.info(f"{len(generated)} challenges pre-generated, generating {len(missing)} inline")
+        generated.update(await generate_challenges_for_goals(missing))
+
+    deliveries = []
+
+    for goal in goals_to_challenge:
+
+        challenge_message = generated.get(goal["id"])
+        if not challenge_message:
+            continue
+
+        # Get users working on this goal
+        users = await get_users_for_goal(goal["id"])
+
+        # Store the challenge in the database
+        challenge_id = await db.run(_issue_challenge, goal['id'], challenge_message, users, issue_date)
+        if challenge_id is None:
+            continue  # Issued by another run in the meantime
 
         # Format user list to string for message
         username_string = utils.format_names_list([u['name'] for u in users])
@@ -155,19 +536,32 @@ async def schedule_challenges(context: ContextTypes.DEFAULT_TYPE):
         # Create inline keyboard for accepting or suggesting a challenge
         keyboard = [
             [
-                InlineKeyboardButton("✅ Accept", callback_data=f"accept_challenge_{challenge_id}"),
-                InlineKeyboardButton("💡 Suggest my own", callback_data=f"suggest_challenge_{goal['id']}_{challenge_id}")
+                InlineKeyboardButton("✅ Accept", callback_data=callbacks.encode(callbacks.ACCEPT_CHALLENGE, challenge_id)),
+                InlineKeyboardButton("💡 Suggest my own", callback_data=callbacks.encode(callbacks.SUGGEST_CHALLENGE, goal['id'], challenge_id))
             ]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        # Send messsage to the group
-        await context.bot.send_message(
+        # Queue messsage to the group
+        deliveries.append(dispatcher.outbox.submit(
                 chat_id = goal["group_id"],
+                priority = dispatcher.PRIORITY_HIGH,
                 text = message,
                 reply_markup=reply_markup,
                 parse_mode = 'HTML'
-            )
+            ))
+
+    # Tonight's run is done; stop background retries for it
+    await db.execute("""
+        UPDATE pending_challenges
+        SET status = 'failed', updated_at = CURRENT_TIMESTAMP
+        WHERE issue_date = ? AND status = 'queued'
+        AND goal_id IN (SELECT value FROM json_each(?))
+    """, (issue_date, json.dumps([goal["id"] for goal in goals_to_challenge])))
+
+    results = await asyncio.gather(*deliveries, return_exceptions=True)
+    failed = sum(isinstance(r, Exception) for r in results)
+    logger.info(f"Sent {len(results) - failed} challenges, {failed} failed. Dispatcher: {dispatcher.outbox.stats()}")
 
 async def accept_challenge(update, context):
     """
@@ -178,31 +572,30 @@ async def accept_challenge(update, context):
         query = update.callback_query
         user = query.from_user
         user_id = user.id
-        display_name = utils.get_display_name_from_user_id(user_id)
+        display_name = await utils.get_display_name_from_user_id(user_id)
         
         # Extract challenge ID from callback data
-        challenge_id = query.data.split("_")[-1]
+        challenge_id = context.args[0]
 
         # Get goal_id
-        goal_id = utils.get_goal_id_from_challenge_id(challenge_id)
+        goal_id = await utils.get_goal_id_from_challenge_id(challenge_id)
 
         # Get all participants in goal
-        full_users_list = utils.get_members_in_goal(goal_id)
+        full_users_list = await utils.get_members_in_goal(goal_id)
 
         # Get all users that have yet to accept challenge
-        accepted_user_list = utils.get_challenge_accepted_participants(challenge_id)
+        accepted_user_list = await utils.get_challenge_accepted_participants(challenge_id)
         
         # Get list of users that have not accepted challenge
         accepted_names = [u['user_id'] for u in accepted_user_list]
         unaccepted_list = [u for u in full_users_list if u['user_id'] not in accepted_names]
-        unaccpeted_user_list = [utils.get_display_name_from_user_id(u['user_id']) for u in unaccepted_list]
+        unaccpeted_user_list = [await utils.get_display_name_from_user_id(u['user_id']) for u in unaccepted_list]
 
         # Format user list to string for message
         username_string = utils.format_names_list([u['name'] for u in unaccpeted_user_list])
 
         # Add challenge response to the database
-        with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-            conn.row_factory = sqlite3.Row
+        def _accept(conn):
             cursor = conn.cursor()
 
             # Check current status first
@@ -211,20 +604,24 @@ async def accept_challenge(update, context):
                 (challenge_id, user_id)
             )
             row = cursor.fetchone()
-            
-            if not row:
-                await query.answer("You're not part of this challenge! Use /goals to join this goal and be part of the challenge", show_alert=True)
-                return
-            
-            if row["status"] == "pending":
-                await query.answer("Love the enthusiasm, but you've already accepted this challenge!", show_alert=True)
-                return
 
-            cursor.execute(
-                "UPDATE challenge_responses SET status = ? WHERE challenge_id = ? AND user_id = ?", 
-                ('pending', challenge_id, user_id)
-            )
-            conn.commit()
+            if row and row["status"] != "pending":
+                cursor.execute(
+                    "UPDATE challenge_responses SET status = ? WHERE challenge_id = ? AND user_id = ?", 
+                    ('pending', challenge_id, user_id)
+                )
+
+            return row
+
+        row = await db.run(_accept)
+
+        if not row:
+            await query.answer("You're not part of this challenge! Use /goals to join this goal and be part of the challenge", show_alert=True)
+            return
+
+        if row["status"] == "pending":
+            await query.answer("Love the enthusiasm, but you've already accepted this challenge!", show_alert=True)
+            return
 
         await query.answer("✅ Challenge accepted!")
         await query.message.reply_text(f"{username_string}\n\n{display_name['name']} has accepted the challenge, don't be left behind!")
@@ -235,8 +632,7 @@ async def accept_challenge(update, context):
 
 async def handle_suggest_challenge(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    goal_id = query.data.split("_")[-2]
-    challenge_id = query.data.split("_")[-1]
+    goal_id, challenge_id = context.args
     
     await query.answer()
     
@@ -246,10 +642,10 @@ async def handle_suggest_challenge(update: Update, context: ContextTypes.DEFAULT
     )
     
     # Only store goal_id, keyed by message_id
-    if "suggestion_prompts" not in context.chat_data:
-        context.chat_data["suggestion_prompts"] = {}
-    
-    context.chat_data["suggestion_prompts"][sent_message.message_id] = (goal_id, challenge_id)
+    await chat_state.store.set(
+        query.message.chat.id, f"suggestion_prompt:{sent_message.message_id}",
+        [goal_id, challenge_id], consts.SUGGESTION_PROMPT_TTL
+    )
 
 async def handle_suggestion_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
@@ -261,33 +657,36 @@ async def handle_suggestion_reply(update: Update, context: ContextTypes.DEFAULT_
     # Get the ID of the message the user replied to
     reply_to_id = update.message.reply_to_message.message_id
     
-    # Get our stored prompts (or empty dict if none exist)
-    # This contains {message_id: goal_id} pairs
-    prompts = context.chat_data.get("suggestion_prompts", {})
+    # Look up the prompt stored for that message (None if it isn't one of ours)
+    # This contains [goal_id, challenge_id]
+    chat_id = update.message.chat.id
+    prompt = await chat_state.store.get(chat_id, f"suggestion_prompt:{reply_to_id}")
     
     # Check if the message they replied to is one of our prompts
     # If they replied to some random message, ignore it
-    if reply_to_id not in prompts:
+    if prompt is None:
         return
     
     # We found a match! Get the goal_id we stored earlier
-    goal_id, old_challenge_id = prompts[reply_to_id]
+    goal_id, old_challenge_id = prompt
     
     # Get the user's suggestion text
     suggestion = update.message.text
     
     # Clean up - remove this prompt since it's been used
-    del context.chat_data["suggestion_prompts"][reply_to_id]
+    await chat_state.store.delete(chat_id, f"suggestion_prompt:{reply_to_id}")
 
-    users = get_users_for_goal(goal_id)
+    users = await get_users_for_goal(goal_id)
 
-    # Store the challenge in the database        
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
+    # Store the challenge in the database
+    def _replace_challenge(conn):
         cursor = conn.cursor()
         cursor.execute(
             "INSERT INTO challenges (goal_id, description, due_date) VALUES (?, ?, ?)", (goal_id, suggestion, (datetime.now() + timedelta(days=consts.CHALLENGE_DEADLINE_DAYS)).isoformat())
         )
 
+        challenge_id = cursor.lastrowid
+
         cursor.execute(
             "UPDATE challenges SET rejected = 1 WHERE id = ?",
             (old_challenge_id,)
@@ -298,8 +697,6 @@ async def handle_suggestion_reply(update: Update, context: ContextTypes.DEFAULT_
             (old_challenge_id,)
         )
 
-        challenge_id = cursor.lastrowid
-
         for i in users:
             cursor.execute(
                 "INSERT INTO challenge_responses (challenge_id, user_id, status) VALUES (?, ?, ?)", 
@@ -310,19 +707,21 @@ async def handle_suggestion_reply(update: Update, context: ContextTypes.DEFAULT_
                 # No matching row found
                 logger.warning(f"User {i} not in challenge {challenge_id}")
 
-        conn.commit()
+        return challenge_id
+
+    challenge_id = await db.run(_replace_challenge)
 
     # Confirm to the user
     keyboard = [
         [
-            InlineKeyboardButton("✅ Accept", callback_data=f"accept_challenge_{challenge_id}"),
+            InlineKeyboardButton("✅ Accept", callback_data=callbacks.encode(callbacks.ACCEPT_CHALLENGE, challenge_id)),
         ]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     display_name = utils.get_display_name_from_telegram_user(update.effective_user)
 
-    other_participants = utils.get_members_in_goal(goal_id)
+    other_participants = await utils.get_members_in_goal(goal_id)
     other_participants_name = [participants['name'] for participants in other_participants]
 
     other_participants_name.remove(display_name)
@@ -0,0 +1,87 @@
+import re
+import json
+import unicodedata
+from datetime import datetime, timedelta
+
+import db
+import constants as consts
+
+
+def normalize_goal(goal):
+    """Cache key for a goal's text, ignoring case, punctuation and spacing ("Get fit!" == "get  fit")."""
+    text = unicodedata.normalize("NFKC", goal).casefold()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def day_bucket(day):
+    """Which CHALLENGE_CACHE_DAY_BUCKETS range a goal's day number falls in (0 for the first)."""
+    return sum(day >= boundary for boundary in consts.CHALLENGE_CACHE_DAY_BUCKETS)
+
+
+def _cutoff():
+    # Same format as CURRENT_TIMESTAMP so it compares correctly with created_at
+    return (datetime.utcnow() - timedelta(days=consts.CHALLENGE_CACHE_MAX_AGE_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+async def evict():
+    """Delete cached challenges older than CHALLENGE_CACHE_MAX_AGE_DAYS. Returns the number removed."""
+    cursor = await db.execute("DELETE FROM challenge_cache WHERE created_at < ?", (_cutoff(),))
+    return cursor.rowcount
+
+
+async def lookup(keys):
+    """
+    Fetch cached challenges for many (goal_key, day_bucket) keys in one query.
+
+    Args:
+        keys: Iterable of (goal_key, day_bucket) tuples
+
+    Returns:
+        dict: (goal_key, day_bucket) -> list of challenge descriptions, newest first
+    """
+    rows = await db.fetchall("""
+        SELECT goal_key, day_bucket, description
+        FROM challenge_cache
+        WHERE (goal_key, day_bucket) IN (
+            SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)
+        )
+        AND created_at >= ?
+        ORDER BY created_at DESC, id DESC
+    """, (json.dumps([list(key) for key in set(keys)]), _cutoff()))
+
+    cached = {}
+    for row in rows:
+        cached.setdefault((row["goal_key"], row["day_bucket"]), []).append(row["description"])
+    return cached
+
+
+async def used_by_goals(goal_ids):
+    """
+    Challenges each goal was given within the cache age window, rejected ones included.
+    A cached challenge is never served to a goal that has already had it.
+
+    Returns:
+        dict: goal_id -> set of challenge descriptions
+    """
+    rows = await db.fetchall("""
+        SELECT goal_id, description
+        FROM challenges
+        WHERE goal_id IN (SELECT value FROM json_each(?))
+        AND created_at >= ?
+    """, (json.dumps(list(goal_ids)), _cutoff()))
+
+    used = {}
+    for row in rows:
+        used.setdefault(row["goal_id"], set()).add(row["description"])
+    return used
+
+
+async def store(entries):
+    """Add freshly generated challenges to the cache. entries: iterable of ((goal_key, day_bucket), description)."""
+    rows = [(goal_key, bucket, description) for (goal_key, bucket), description in entries]
+    if rows:
+        await db.run(lambda conn: conn.executemany(
+            "INSERT OR IGNORE INTO challenge_cache (goal_key, day_bucket, description) VALUES (?, ?, ?)",
+            rows
+        ))
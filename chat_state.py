@@ -0,0 +1,139 @@
+import json
+import time
+import logging
+from collections import OrderedDict
+
+from telegram.ext import ContextTypes
+
+import db
+import metrics
+import constants as consts
+
+logger = logging.getLogger(__name__)
+
+
+class ChatStateStore:
+    """
+    Per-chat conversational state (who joined a new goal, which messages are suggestion
+    prompts) persisted in the chat_state table so it survives restarts. Every entry has a
+    TTL; recently used entries are also kept in an in-process LRU so hot lookups skip the
+    database, and expired rows are swept by purge_expired.
+
+    Values are anything JSON-serialisable and come back as fresh copies, so callers can
+    modify what they get without affecting the store.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict() # (chat_id, key) -> (JSON value, expires_at)
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, chat_id, key, value_json, expires_at):
+        self._entries[(chat_id, key)] = (value_json, expires_at)
+        self._entries.move_to_end((chat_id, key))
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, chat_id, key, default=None):
+        """Return the value stored for a chat under key, or default if there is none or it expired."""
+        entry = self._entries.get((chat_id, key))
+        if entry is not None:
+            value_json, expires_at = entry
+            if expires_at > time.time():
+                self._entries.move_to_end((chat_id, key))
+                self.hits += 1
+                return json.loads(value_json)
+            del self._entries[(chat_id, key)]
+
+        self.misses += 1
+        row = await db.fetchone(
+            "SELECT value, expires_at FROM chat_state WHERE chat_id = ? AND key = ? AND expires_at > ?",
+            (chat_id, key, int(time.time()))
+        )
+        if not row:
+            return default
+
+        self._remember(chat_id, key, row["value"], row["expires_at"])
+        return json.loads(row["value"])
+
+    async def set(self, chat_id, key, value, ttl):
+        """Store value for a chat under key for ttl seconds, replacing any previous value."""
+        value_json = json.dumps(value)
+        expires_at = int(time.time() + ttl)
+
+        await db.execute("""
+            INSERT INTO chat_state (chat_id, key, value, expires_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (chat_id, key) DO UPDATE SET
+                value = excluded.value,
+                expires_at = excluded.expires_at,
+                updated_at = CURRENT_TIMESTAMP
+        """, (chat_id, key, value_json, expires_at))
+
+        self._remember(chat_id, key, value_json, expires_at)
+
+    async def update(self, chat_id, key, fn):
+        """
+        Atomically replace a live value with fn(value), keeping its expiry.
+
+        fn runs on the database writer thread, so concurrent updates to the same key
+        are applied one after another instead of overwriting each other.
+
+        Returns:
+            The new value, or None if there was no live value to update
+        """
+        def _update(conn):
+            row = conn.execute(
+                "SELECT value, expires_at FROM chat_state WHERE chat_id = ? AND key = ? AND expires_at > ?",
+                (chat_id, key, int(time.time()))
+            ).fetchone()
+            if not row:
+                return None
+
+            value_json = json.dumps(fn(json.loads(row["value"])))
+            conn.execute(
+                "UPDATE chat_state SET value = ?, updated_at = CURRENT_TIMESTAMP WHERE chat_id = ? AND key = ?",
+                (value_json, chat_id, key)
+            )
+            return value_json, row["expires_at"]
+
+        result = await db.run(_update)
+        if result is None:
+            self._entries.pop((chat_id, key), None)
+            return None
+
+        value_json, expires_at = result
+        self._remember(chat_id, key, value_json, expires_at)
+        return json.loads(value_json)
+
+    async def delete(self, chat_id, key):
+        """Forget the value stored for a chat under key."""
+        self._entries.pop((chat_id, key), None)
+        await db.execute("DELETE FROM chat_state WHERE chat_id = ? AND key = ?", (chat_id, key))
+
+    async def purge(self):
+        """Delete expired entries from memory and the database. Returns the number of rows removed."""
+        now = time.time()
+        for entry_key in [k for k, (_, expires_at) in self._entries.items() if expires_at <= now]:
+            del self._entries[entry_key]
+
+        cursor = await db.execute("DELETE FROM chat_state WHERE expires_at <= ?", (int(now),))
+        return cursor.rowcount
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+store = ChatStateStore(consts.CHAT_STATE_CACHE_SIZE)
+metrics.register_cache("chat_state", store.stats)
+
+
+async def purge_expired(context: ContextTypes.DEFAULT_TYPE):
+    """Job: sweep expired conversational state."""
+    removed = await store.purge()
+    if removed:
+        logger.info(f"Purged {removed} expired chat state entries")
@@ -1,7 +1,12 @@
 import os
+import html
+import asyncio
+import sqlite3
+from itertools import groupby
 from datetime import datetime, timedelta
 import constants as consts
 import utils
+import dispatcher
 from telegram.error import Forbidden, BadRequest, TimedOut, NetworkError
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply
 from telegram.ext import (
@@ -14,53 +19,81 @@ from telegram.ext import (
     ChatMemberHandler,
 )
 
-async def fail_expiring_challenges(context: ContextTypes.DEFAULT_TYPE):
-    """Mark challenges that have not been completed failed."""
+def _build_digests(failed_responses):
+    """
+    Group failed responses into one digest message per group chat.
 
-    expiring_challenges = utils.get_expiring_challenges()
+    Args:
+        failed_responses: Rows ordered by group_id then challenge_id
 
-    if not expiring_challenges:
-        await context.bot.send_message(
+    Yields:
+        tuple: (group_id, message text), split into several messages for very large groups
+    """
+    for group_id, group_rows in groupby(failed_responses, key=lambda r: r["group_id"]):
+        lines = []
+        for _, challenge_rows in groupby(group_rows, key=lambda r: r["challenge_id"]):
+            challenge_rows = list(challenge_rows)
+            names = utils.format_names_list([html.escape(r["name"] or "Someone") for r in challenge_rows])
+            lines.append(f"• {names}: {html.escape(challenge_rows[0]['description'] or '')}")
+
+        header = "⏰ <b>Time's up!</b> These challenges were not completed on time:\n\n"
+        footer = "\n\nTry again tomorrow! 💪"
+        chunk = []
+        length = len(header) + len(footer)
+
+        for line in lines:
+            if chunk and length + len(line) + 1 > consts.TELEGRAM_MAX_MESSAGE_LENGTH:
+                yield group_id, header + "\n".join(chunk) + footer
+                chunk = []
+                length = len(header) + len(footer)
+            chunk.append(line)
+            length += len(line) + 1
+
+        yield group_id, header + "\n".join(chunk) + footer
+
+async def fail_expiring_challenges(context: ContextTypes.DEFAULT_TYPE, group_ids=None, timezone=None):
+    """Mark challenges that have not been completed failed, and post one digest per group. group_ids limits it to those groups."""
+
+    try:
+        failed_responses = await utils.expire_overdue_challenges(group_ids)
+    except sqlite3.Error as e:
+        dispatcher.outbox.submit(
             chat_id=os.getenv("ADMIN_TELEGRAM_USER_ID"),
-            text="No expiring challenges found, everyone completed their challenges today! 🎉"
+            priority=dispatcher.PRIORITY_LOW,
+            text=f"Failed to expire overdue challenges for {len(group_ids) if group_ids else 'all'} groups in {timezone or consts.SCHEDULE_TIMEZONE}: {e}"
         )
+        raise
+
+    # Runs once per timezone, so only runs that failed something are reported
+    if not failed_responses:
         return
 
-    for challenge in expiring_challenges:
-        challenge_response_id = challenge["id"]
-        challenge_id = challenge["challenge_id"]
-        goal_id = challenge["goal_id"]
-        description = challenge["description"]
-        user_id = challenge["user_id"]
-        display_name = utils.get_display_name_from_user_id(user_id)
+    notices = [
+        dispatcher.outbox.submit(chat_id=group_id, text=text, parse_mode='HTML')
+        for group_id, text in _build_digests(failed_responses)
+    ]
 
-        # Get group ID
-        group_id = utils.get_group_id_by_goal_id(goal_id)
+    await asyncio.gather(*notices, return_exceptions=True)
 
-        await context.bot.send_message(
-            chat_id=group_id,
-            text=f"{display_name} failed to complete challenge {description} on time. Try again tomorrow! 💪"
-        )
-    
-    await context.bot.send_message(
+    dispatcher.outbox.submit(
         chat_id=os.getenv("ADMIN_TELEGRAM_USER_ID"),
-        text=f"{len(expiring_challenges)} challenges were marked as failed today."
+        priority=dispatcher.PRIORITY_LOW,
+        text=f"{len(failed_responses)} challenges were marked as failed today in {timezone or consts.SCHEDULE_TIMEZONE}."
     )
 
     return
 
-async def fail_prizefights(context: ContextTypes.DEFAULT_TYPE):
-    """Mark prize fights that have not been completed failed."""
+async def fail_prizefights(context: ContextTypes.DEFAULT_TYPE, group_ids=None, timezone=None):
+    """Mark prize fights that have not been completed failed. group_ids limits it to those groups."""
 
-    expiring_prizefights = utils.get_pending_prizefights()
+    expiring_prizefights = await utils.get_pending_prizefights(group_ids)
 
+    # Runs once per timezone, so only runs that failed something are reported
     if not expiring_prizefights:
-        await context.bot.send_message(
-            chat_id=os.getenv("ADMIN_TELEGRAM_USER_ID"),
-            text="No expiring prize fights found, everyone completed their prize fights today! 🎉"
-        )
         return
 
+    notices = []
+
     for prizefight in expiring_prizefights:
         prizefight_participant_id = prizefight["id"]
         prize_fight_id = prizefight["prizefight_id"]
@@ -68,16 +101,21 @@ async def fail_prizefights(context: ContextTypes.DEFAULT_TYPE):
         prize = prizefight["prize"]
         user_id = prizefight["user_id"]
         group_id = prizefight["group_id"]
-        display_name = utils.get_display_name_from_user_id(user_id)
+        # The user row may be gone; one missing name shouldn't stop the other groups' notices
+        user = await utils.get_display_name_from_user_id(user_id)
+        display_name = user["name"] if user else "Someone"
 
-        await context.bot.send_message(
+        notices.append(dispatcher.outbox.submit(
             chat_id=group_id,
             text=f"{display_name} failed to complete the prize fight '{challenge}' for ${prize} on time. Try again tomorrow! 💪"
-        )
-    
-    await context.bot.send_message(
+        ))
+
+    await asyncio.gather(*notices, return_exceptions=True)
+
+    dispatcher.outbox.submit(
         chat_id=os.getenv("ADMIN_TELEGRAM_USER_ID"),
-        text=f"{len(expiring_prizefights)} prize fights were marked as failed today."
+        priority=dispatcher.PRIORITY_LOW,
+        text=f"{len(expiring_prizefights)} prize fights were marked as failed today in {timezone or consts.SCHEDULE_TIMEZONE}."
     )
 
     return
@@ -11,15 +11,126 @@ ADMIN_TELEGRAM_USER_ID=int(os.getenv("ADMIN_TELEGRAM_USER_ID"))
 
 GOALS_DB_SQLITE = "./goals.db"
 
+# Update ingestion: "polling" (long-poll getUpdates) or "webhook" (Telegram POSTs to a local listener)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+ALLOWED_UPDATES = ["message", "callback_query", "my_chat_member"]
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") # Public HTTPS URL Telegram posts to, including WEBHOOK_PATH
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN") # Checked against X-Telegram-Bot-Api-Secret-Token; required in webhook mode
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")) # Concurrent deliveries Telegram may open (1-100)
+# Updates handled at once; 1 processes them strictly in order. Handlers read then write without
+# locking (e.g. joining a goal twice on a double press), so only raise this once they're idempotent
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "1"))
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL") # Override for a local Bot API server or the webhook harness
+
+# Handler metrics (see metrics.py)
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464")) # Prometheus endpoint at /metrics; 0 disables it
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRICS_SUMMARY_TOP = 15 # Handlers listed by the /metrics command
+
+# Slow query log (see slow_queries.py)
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "100")) # Statements slower than this are logged with their plan; 0 disables
+SLOW_QUERY_REPORT_TOP = 10 # Statements listed by the /slowqueries command
+
+# SQLite connection profile, applied to every connection by db.connect
+SQLITE_JOURNAL_MODE = "WAL" # Readers don't block the writer and vice versa
+SQLITE_SYNCHRONOUS = "NORMAL" # OFF | NORMAL | FULL; NORMAL is durable enough under WAL
+SQLITE_BUSY_TIMEOUT_MS = 5000 # Wait this long for a lock instead of failing with "database is locked"
+SQLITE_CACHE_SIZE = -64000 # Negative values are KiB, so 64 MB of page cache per connection
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+SQLITE_FOREIGN_KEYS = True
+SQLITE_READ_POOL_SIZE = 4 # Threads (and connections) serving reads
+
+USER_CACHE_SIZE = 10000 # Display names kept in memory by user_cache
+
+# Conversational state (join lists, suggestion prompts) kept by chat_state
+CHAT_STATE_CACHE_SIZE = 5000 # Entries kept in memory; the rest are read back from SQLite
+CHAT_STATE_PURGE_INTERVAL = 3600 # Seconds between sweeps of expired state
+GOAL_JOIN_STATE_TTL = 7 * 24 * 3600 # How long a new goal's "Join Goal" button keeps working
+SUGGESTION_PROMPT_TTL = 24 * 3600 # How long a "suggest a challenge" prompt accepts replies
+
+# upsert_user_and_group write coalescing
+UPSERT_MEMO_TTL = 600 # Seconds an unchanged (user, group, name) tuple skips the database
+UPSERT_MEMO_SIZE = 50000
+UPSERT_FLUSH_DELAY = 0.05 # Seconds new rows wait to be batched with other handlers' upserts
+
 # Challenge generation settings
 CHALLENGE_MAX_TOKENS = 100
 CHALLENGE_DEADLINE_DAYS = 1
-
-# Scheduled job times (SGT timezone)
+CHALLENGE_GENERATION_CONCURRENCY = 8 # Max in-flight Groq requests during schedule_challenges
+CHALLENGE_GENERATION_TIMEOUT = 20 # Seconds a Groq attempt may wait on a read, write or pooled connection before it is retried
+
+# Batched generation packs many goals into one Groq request
+CHALLENGE_BATCH_MODE = True
+CHALLENGE_BATCH_MAX_GOALS = 25
+CHALLENGE_BATCH_MAX_TOKENS = 6000 # Estimated prompt + completion tokens per batch request
+CHALLENGE_BATCH_ITEM_OVERHEAD_TOKENS = 20 # goal_id and JSON punctuation per generated item
+
+# Challenges generated for one goal are reused by other goals with the same normalized text
+CHALLENGE_CACHE_ENABLED = True
+CHALLENGE_CACHE_MAX_AGE_DAYS = 30 # Cached challenges older than this are evicted
+CHALLENGE_CACHE_DAY_BUCKETS = (7, 30, 90) # Goal-day boundaries; a goal on day 3 doesn't share with one on day 60
+
+# Pre-generation retries for goals whose challenge failed to generate
+PREGENERATION_RETRY_INTERVAL = 900 # Seconds between background retry passes
+PREGENERATION_RETRY_BACKOFF = 300 # Seconds before a goal's first retry, doubled on each attempt
+PREGENERATION_MAX_ATTEMPTS = 5 # After this many failures the nightly run generates the goal inline
+
+# Shared Groq HTTP client (challenge.get_groq_client)
+GROQ_CONNECT_TIMEOUT = 5 # Seconds to open a connection
+GROQ_TIMEOUT = CHALLENGE_GENERATION_TIMEOUT # Seconds per read, write or wait for a pooled connection
+GROQ_MAX_RETRIES = 2 # SDK retries on connection errors, 429 and 5xx
+GROQ_RETRY_BACKOFF_MAX = 8 # Longest pause the SDK takes between retries
+# Overall cap per generation request: every attempt plus the pauses between them, so the SDK's retries get to run
+CHALLENGE_GENERATION_DEADLINE = (GROQ_MAX_RETRIES + 1) * (GROQ_CONNECT_TIMEOUT + GROQ_TIMEOUT) + GROQ_MAX_RETRIES * GROQ_RETRY_BACKOFF_MAX
+GROQ_MAX_CONNECTIONS = CHALLENGE_GENERATION_CONCURRENCY # Pooled connections, all kept alive between requests
+GROQ_KEEPALIVE_EXPIRY = 60 # Seconds an idle connection stays open for reuse
+
+# Groq quota for the challenge model, see https://console.groq.com/settings/limits
+GROQ_REQUESTS_PER_MINUTE = 30
+GROQ_TOKENS_PER_MINUTE = 30000
+
+# Outbound message dispatcher, kept under Telegram's flood limits
+# (~30 messages/second overall, ~20 messages/minute per group)
+TELEGRAM_GLOBAL_MESSAGES_PER_SECOND = 25
+TELEGRAM_CHAT_MESSAGES_PER_MINUTE = 20
+TELEGRAM_CHAT_BURST = 3 # Messages a chat may receive back to back before pacing kicks in
+DISPATCHER_MAX_CHAT_BUCKETS = 10000 # Per-chat buckets kept; past this, the least recently used full ones are dropped
+DISPATCHER_WORKERS = 8
+DISPATCHER_MAX_RETRIES = 3 # Retries on TimedOut/NetworkError before giving up on a message
+DISPATCHER_RETRY_BACKOFF = 1 # Seconds before the first retry, doubled on each attempt
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+# Scheduled job times, in each group's local time (SCHEDULE_TIMEZONE unless the group set one with /timezone)
+SCHEDULE_TIMEZONE = "Asia/Singapore"
+SCHEDULER_TICK_MINUTES = 15 # The scheduler wakes up this often and runs the jobs due in each timezone
+CHALLENGE_PREGENERATION_HOUR = 14 # Off-peak run that prepares tonight's challenges
+CHALLENGE_PREGENERATION_MINUTE = 0
 CHALLENGE_GENERATION_HOUR = 22
 CHALLENGE_GENERATION_MINUTE = 45
 CHALLENGE_DEADLINE_HOUR = 23
 CHALLENGE_DEADLINE_MINUTE = 59
+MORNING_REMINDER_HOUR = 8
+MORNING_REMINDER_MINUTE = 0
+EVENING_REMINDER_HOUR = 20
+EVENING_REMINDER_MINUTE = 0
+REMINDER_BATCH_SIZE = 500 # Challenges fetched per page by the reminder jobs
+
+# /leaderboard
+LEADERBOARD_SIZE = 10 # Members shown
+LEADERBOARD_CHALLENGE_POINTS = 1 # Per validated challenge
+LEADERBOARD_PRIZEFIGHT_POINTS = 3 # Per prize fight won
+
+# Archival of resolved challenges (see archive.py)
+ARCHIVE_AFTER_DAYS = 90 # Challenges older than this with no open responses move to the archive tables
+ARCHIVE_BATCH_SIZE = 500 # Challenges moved per transaction
+ARCHIVE_BATCH_PAUSE = 0.1 # Seconds between batches, so handlers' writes get the write thread
+ARCHIVE_VACUUM_PAGES = 5000 # Free pages returned to the OS per run by incremental vacuum; 0 for all
+ARCHIVE_HOUR = 4 # Daily, in SCHEDULE_TIMEZONE
+ARCHIVE_MINUTE = 30
 
 # Dev mode intervals (seconds)
 DEV_CHALLENGE_INTERVAL = 3600
@@ -47,6 +158,9 @@ I'm an accountability bot that generates daily challenges based on your goals. R
 - /goals — View all goals in this group
 - /complete — Mark your challenge as done
 - /deletegoal — Remove a goal
+- /stats — See your streaks and completed challenges
+- /leaderboard — This week's top members (also monthly or alltime)
+- /timezone — Show or set this group's timezone
 - /feedback — Send feedback to the developer
 - /help — Show this message again
 
@@ -0,0 +1,171 @@
+import time
+import asyncio
+import logging
+import pathlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import slow_queries
+import constants as consts
+
+logger = logging.getLogger(__name__)
+
+
+def _new_executors():
+    return (
+        ThreadPoolExecutor(max_workers=1, thread_name_prefix="goals-db-write"),
+        ThreadPoolExecutor(max_workers=consts.SQLITE_READ_POOL_SIZE, thread_name_prefix="goals-db-read"),
+    )
+
+
+# Writes are serialised on a single thread with one long-lived connection. Reads run on a
+# small pool of threads, each with its own connection; WAL lets them proceed while a write
+# is in progress. Handlers await results instead of blocking the event loop.
+_write_executor, _read_executor = _new_executors()
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+# Bumped by close() so threads reopen instead of reusing a closed connection
+_generation = 0
+
+
+def connect(path=None, read_only=False):
+    """
+    Open a connection to goals.db with the tuned connection profile from constants.py.
+
+    Args:
+        path (str): Database file, defaults to consts.GOALS_DB_SQLITE
+        read_only (bool): Open the file read-only. Only the per-connection pragmas are
+                          applied, so the file's journal mode is left as it is
+
+    Returns:
+        sqlite3.Connection: Connection with sqlite3.Row as its row factory
+    """
+    path = path or consts.GOALS_DB_SQLITE
+    if read_only:
+        path, uri = f"{pathlib.Path(path).resolve().as_uri()}?mode=ro", True
+    else:
+        uri = False
+
+    conn = sqlite3.connect(
+        path,
+        timeout=consts.SQLITE_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        uri=uri
+    )
+    conn.row_factory = sqlite3.Row
+
+    if not read_only:
+        # Stored in the database file, so only the writing side sets it
+        conn.execute(f"PRAGMA journal_mode = {consts.SQLITE_JOURNAL_MODE}")
+        conn.execute(f"PRAGMA synchronous = {consts.SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA busy_timeout = {int(consts.SQLITE_BUSY_TIMEOUT_MS)}")
+    conn.execute(f"PRAGMA cache_size = {int(consts.SQLITE_CACHE_SIZE)}")
+    conn.execute(f"PRAGMA mmap_size = {int(consts.SQLITE_MMAP_SIZE)}")
+    conn.execute(f"PRAGMA foreign_keys = {'ON' if consts.SQLITE_FOREIGN_KEYS else 'OFF'}")
+
+    return conn
+
+
+def _get_connection(read_only):
+    """Return this thread's connection, opening it on first use (DB threads only)."""
+    if getattr(_local, "generation", None) != _generation:
+        conn = connect(read_only=read_only)
+        if slow_queries.enabled():
+            conn.set_trace_callback(slow_queries.trace)
+        _local.conn = conn
+        _local.generation = _generation
+        with _connections_lock:
+            _connections.append(conn)
+    return _local.conn
+
+
+def _call(fn, args, caller):
+    conn = _get_connection(read_only=False)
+    slow_queries.begin(caller)
+    try:
+        # Commits on success, rolls back if fn raises
+        with conn:
+            return fn(conn, *args)
+    finally:
+        slow_queries.end(conn)
+
+
+def _read(fn, args, caller):
+    conn = _get_connection(read_only=True)
+    slow_queries.begin(caller)
+    try:
+        return fn(conn, *args)
+    finally:
+        slow_queries.end(conn)
+
+
+async def run(fn, *args):
+    """
+    Run fn(conn, *args) on the write thread inside a single transaction.
+
+    Args:
+        fn: Callable taking a sqlite3.Connection as its first argument
+        *args: Extra positional arguments passed to fn
+
+    Returns:
+        Whatever fn returns
+    """
+    loop = asyncio.get_running_loop()
+    caller = slow_queries.find_caller() if slow_queries.enabled() else None
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_write_executor, _call, fn, args, caller)
+    finally:
+        metrics.record_db_time(time.perf_counter() - started)
+
+
+async def run_read(fn, *args):
+    """Run fn(conn, *args) on a read-only pooled connection. fn must not write."""
+    loop = asyncio.get_running_loop()
+    caller = slow_queries.find_caller() if slow_queries.enabled() else None
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_read_executor, _read, fn, args, caller)
+    finally:
+        metrics.record_db_time(time.perf_counter() - started)
+
+
+async def fetchall(sql, params=()):
+    """Execute a query and return all rows as sqlite3.Row objects."""
+    return await run_read(lambda conn: conn.execute(sql, params).fetchall())
+
+
+async def fetchone(sql, params=()):
+    """Execute a query and return the first row, or None."""
+    return await run_read(lambda conn: conn.execute(sql, params).fetchone())
+
+
+async def execute(sql, params=()):
+    """Execute a single write statement and commit it. Returns the cursor (for lastrowid/rowcount)."""
+    return await run(lambda conn: conn.execute(sql, params))
+
+
+async def close():
+    """
+    Close every pooled connection. Called on application shutdown.
+
+    Calls made from now on go to fresh threads with fresh connections. The old threads are
+    drained before their connections are closed, so none is closed while still in use.
+    """
+    global _generation, _write_executor, _read_executor
+
+    with _connections_lock:
+        _generation += 1
+        connections = list(_connections)
+        _connections.clear()
+
+    executors = (_write_executor, _read_executor)
+    _write_executor, _read_executor = _new_executors()
+    for executor in executors:
+        await asyncio.to_thread(executor.shutdown, wait=True)
+
+    for conn in connections:
+        conn.close()
@@ -0,0 +1,226 @@
+import asyncio
+import itertools
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+
+from telegram.error import RetryAfter, TimedOut, NetworkError
+
+import metrics
+import ratelimit
+import constants as consts
+
+logger = logging.getLogger(__name__)
+
+# Lower values are sent first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class _OutgoingMessage:
+    __slots__ = ("chat_id", "kwargs", "future", "attempts")
+
+    def __init__(self, chat_id, kwargs, future):
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+
+class MessageDispatcher:
+    """
+    Prioritised outbound queue for bulk send_message calls.
+
+    Messages are released through a global token bucket and a token bucket per chat so
+    bulk jobs stay under Telegram's flood limits. RetryAfter pauses the chat for the
+    requested time and re-queues the message; TimedOut/NetworkError are retried with
+    exponential backoff. Every submitted message gets a future with the sent Message
+    or the final error.
+    """
+
+    def __init__(self):
+        self._bot = None
+        self._queue = None
+        self._workers = []
+        self._sequence = itertools.count()
+        self._global_bucket = ratelimit.TokenBucket(
+            consts.TELEGRAM_GLOBAL_MESSAGES_PER_SECOND,
+            consts.TELEGRAM_GLOBAL_MESSAGES_PER_SECOND
+        )
+        # chat_id -> TokenBucket, least recently used first
+        self._chat_buckets = OrderedDict()
+        self._delayed = 0
+
+        # Metrics
+        self.max_queue_depth = 0
+        self.sent = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self.throttled = 0
+        self.failed = 0
+
+    def start(self, bot):
+        """Start the worker tasks. Called from the application's post_init."""
+        self._bot = bot
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"dispatcher-worker-{i}")
+            for i in range(consts.DISPATCHER_WORKERS)
+        ]
+
+    async def stop(self):
+        """Stop the workers and cancel anything still queued."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        while self._queue is not None and not self._queue.empty():
+            _, _, message = self._queue.get_nowait()
+            message.future.cancel()
+
+    @property
+    def queue_depth(self):
+        """Messages waiting to be sent, including those waiting out a delay."""
+        return (self._queue.qsize() if self._queue else 0) + self._delayed
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "chat_buckets": len(self._chat_buckets),
+            "sent": self.sent,
+            "retried": self.retried,
+            "rate_limited": self.rate_limited,
+            "throttled": self.throttled,
+            "failed": self.failed,
+        }
+
+    def submit(self, chat_id, priority=PRIORITY_NORMAL, **kwargs):
+        """
+        Queue a message for sending.
+
+        Args:
+            chat_id: Target chat
+            priority (int): PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW
+            **kwargs: Any other bot.send_message arguments (text, parse_mode, reply_markup, ...)
+
+        Returns:
+            asyncio.Future: Resolves to the sent telegram.Message, or raises the final error
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._put(priority, _OutgoingMessage(chat_id, kwargs, future))
+        return future
+
+    async def send_message(self, chat_id, priority=PRIORITY_NORMAL, **kwargs):
+        """Queue a message and wait until it has been sent."""
+        return await self.submit(chat_id, priority=priority, **kwargs)
+
+    def _put(self, priority, message):
+        self._queue.put_nowait((priority, next(self._sequence), message))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+    def _put_later(self, delay, priority, message):
+        def _release():
+            self._delayed -= 1
+            self._put(priority, message)
+
+        self._delayed += 1
+        asyncio.get_running_loop().call_later(delay, _release)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is not None:
+            self._chat_buckets.move_to_end(chat_id)
+            return bucket
+
+        bucket = ratelimit.TokenBucket(
+            consts.TELEGRAM_CHAT_MESSAGES_PER_MINUTE / 60,
+            consts.TELEGRAM_CHAT_BURST
+        )
+        self._chat_buckets[chat_id] = bucket
+        self._evict_chat_buckets()
+        return bucket
+
+    def _evict_chat_buckets(self):
+        """
+        Drop the least recently used buckets beyond DISPATCHER_MAX_CHAT_BUCKETS. Only full
+        buckets go, since a new bucket starts full and nothing is lost; chats still being
+        paced or paused by flood control keep theirs.
+        """
+        excess = len(self._chat_buckets) - consts.DISPATCHER_MAX_CHAT_BUCKETS
+        if excess <= 0:
+            return
+
+        idle = []
+        for chat_id, bucket in self._chat_buckets.items():
+            if len(idle) == excess:
+                break
+            if bucket.is_full():
+                idle.append(chat_id)
+
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+
+    async def _worker(self):
+        while True:
+            priority, _, message = await self._queue.get()
+            try:
+                await self._deliver(priority, message)
+            except Exception as e:
+                logger.exception(f"Unexpected dispatcher error for chat {message.chat_id}")
+                if not message.future.done():
+                    message.future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, priority, message):
+        if message.future.cancelled():
+            return
+
+        # Don't hold a worker on a busy chat; come back when its bucket has refilled
+        wait = self._chat_bucket(message.chat_id).try_acquire()
+        if wait:
+            self.throttled += 1
+            self._put_later(wait, priority, message)
+            return
+
+        await self._global_bucket.acquire()
+
+        try:
+            result = await self._bot.send_message(chat_id=message.chat_id, **message.kwargs)
+
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+            self.rate_limited += 1
+            logger.warning(f"Flood control for chat {message.chat_id}, retrying in {retry_after}s")
+            self._chat_bucket(message.chat_id).pause(retry_after)
+            self._put_later(retry_after, priority, message)
+
+        except (TimedOut, NetworkError) as e:
+            message.attempts += 1
+            if message.attempts > consts.DISPATCHER_MAX_RETRIES:
+                self._fail(message, e)
+            else:
+                self.retried += 1
+                self._put_later(consts.DISPATCHER_RETRY_BACKOFF * 2 ** (message.attempts - 1), priority, message)
+
+        except Exception as e:
+            self._fail(message, e)
+
+        else:
+            self.sent += 1
+            if not message.future.done():
+                message.future.set_result(result)
+
+    def _fail(self, message, error):
+        self.failed += 1
+        logger.error(f"Failed to send message to chat {message.chat_id}: {error}")
+        if not message.future.done():
+            message.future.set_exception(error)
+
+
+# Shared by every bulk-send job; started and stopped with the application
+outbox = MessageDispatcher()
+metrics.register_stats("dispatcher", outbox.stats, counters=("sent", "retried", "rate_limited", "throttled", "failed"))
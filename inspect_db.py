@@ -0,0 +1,84 @@
+import os
+import sys
+import argparse
+
+import db
+import constants as consts
+
+
+def list_tables(conn):
+    """
+    Returns:
+        dict: Name -> "table" or "view" for everything that can be dumped, tables first
+    """
+    rows = conn.execute("""
+        SELECT name, type FROM sqlite_master
+        WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'
+        ORDER BY type, name
+    """)
+    return {row["name"]: row["type"] for row in rows}
+
+
+def dump_table(conn, table, limit=None, page_size=500, out=sys.stdout):
+    """
+    Print a table's column names and then its rows, fetching page_size rows at a time so
+    memory use doesn't grow with the table.
+
+    Args:
+        limit (int): Stop after this many rows, or None for all of them
+
+    Returns:
+        int: Number of rows printed
+    """
+    cursor = conn.execute(f'SELECT * FROM "{table}"' + (" LIMIT ?" if limit is not None else ""),
+                          (limit,) if limit is not None else ())
+    print(f"== {table} ==", file=out)
+    print(tuple(column[0] for column in cursor.description), file=out)
+
+    printed = 0
+    while True:
+        rows = cursor.fetchmany(page_size)
+        if not rows:
+            break
+        for row in rows:
+            print(tuple(row), file=out)
+        printed += len(rows)
+
+    suffix = " (limit reached)" if limit is not None and printed == limit else ""
+    print(f"-- {printed} rows{suffix}\n", file=out)
+    return printed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the contents of goals.db, a page of rows at a time")
+    parser.add_argument("--db", default=consts.GOALS_DB_SQLITE, help="Database file")
+    parser.add_argument("--table", action="append", help="Table or view to print (repeatable); all tables by default")
+    parser.add_argument("--limit", type=int, default=None, help="Print at most this many rows per table")
+    parser.add_argument("--page-size", type=int, default=500, help="Rows fetched from SQLite at a time")
+    parser.add_argument("--list", action="store_true", help="Only list the tables and views")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist")
+
+    conn = db.connect(args.db, read_only=True)
+    try:
+        names = list_tables(conn)
+        if args.list:
+            print("\n".join(f"{name} ({kind})" for name, kind in names.items()))
+            return
+
+        # Views repeat the tables' rows, so they're only printed when asked for
+        for table in args.table or [name for name, kind in names.items() if kind == "table"]:
+            if table not in names:
+                parser.error(f"No table or view named {table!r}; try --list")
+            dump_table(conn, table, args.limit, args.page_size)
+    except BrokenPipeError:
+        # Piped into head or less and the reader went away
+        sys.stderr.close()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
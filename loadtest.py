@@ -0,0 +1,427 @@
+"""
+End-to-end load test: the real Application against a stub Telegram and a stub Groq.
+
+The Application comes from bot.build_application with a stub Bot API transport. The stub
+records every call, adds simulated latency and answers a configurable fraction of calls
+with 429 RetryAfter. challenge.get_groq_client returns a stub that answers with canned
+challenges after a simulated delay. A synthetic goals.db (same generator as benchmark.py)
+provides groups, users and goals.
+
+The run has two phases:
+  1. schedule_challenges issues a challenge for every active goal, through the stub Groq
+     and the outbound dispatcher.
+  2. Thousands of user sessions press buttons concurrently via Application.process_update:
+     accept -> mark complete -> validate for issued challenges, and accept -> complete ->
+     validate for prize fight pairs.
+
+The report has handler latency percentiles per button, time spent waiting for the database
+write thread and read pool, Bot API calls and errors, and throughput:
+
+    python loadtest.py --groups 300 --sessions 5000 --concurrency 200 --api-latency-ms 80
+"""
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+from types import SimpleNamespace
+from collections import defaultdict
+
+os.environ.setdefault("ADMIN_TELEGRAM_USER_ID", "1")
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+import db
+import bot
+import utils
+import callbacks
+import challenge
+import dispatcher
+import benchmark
+import constants as consts
+from timing import summarise
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LOADTEST_BOT_ID = 123456
+
+
+class StubRequest(BaseRequest):
+    """Bot API transport that never leaves the process. Records calls, sleeps, and sometimes rate limits."""
+
+    def __init__(self, latency, retry_after_rate, retry_after, rng):
+        self.latency = latency
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.rng = rng
+        self.calls = defaultdict(int)
+        self.rate_limited = 0
+        self.durations = []
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[api_method] += 1
+
+        # Uniform jitter of +/-50% around the configured latency
+        delay = self.latency * self.rng.uniform(0.5, 1.5)
+        await asyncio.sleep(delay)
+        self.durations.append(delay)
+
+        if api_method != "getMe" and self.rng.random() < self.retry_after_rate:
+            self.rate_limited += 1
+            return 429, json.dumps({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }).encode()
+
+        return 200, json.dumps({"ok": True, "result": self._result(api_method, params)}).encode()
+
+    def _result(self, api_method, params):
+        if api_method == "getMe":
+            return {"id": LOADTEST_BOT_ID, "is_bot": True, "first_name": "Loadtest", "username": "loadtest_bot",
+                    "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+        if api_method.startswith("send") or api_method.startswith("edit"):
+            self._message_id += 1
+            chat_id = params.get("chat_id") or 0
+            return {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if int(chat_id) > 0 else "supergroup"},
+                "text": params.get("text") or "",
+            }
+
+        return True
+
+
+class _StubCompletions:
+    def __init__(self, stub):
+        self.stub = stub
+
+    async def create(self, model, messages, max_tokens, response_format=None):
+        self.stub.requests += 1
+        await asyncio.sleep(self.stub.latency * self.stub.rng.uniform(0.5, 1.5))
+
+        # Batch prompts list one JSON entry per line for each goal
+        goal_ids = [int(goal_id) for goal_id in re.findall(r'^\{"goal_id": (\d+)', messages[0]["content"], re.MULTILINE)]
+        if goal_ids:
+            content = {"challenges": [{"goal_id": goal_id, "challenge": f"Load test challenge for goal {goal_id}"} for goal_id in goal_ids]}
+        else:
+            content = {"challenge": "Load test challenge"}
+
+        message = SimpleNamespace(content=json.dumps(content))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")])
+
+
+class StubGroq:
+    """Stands in for groq.AsyncGroq: canned JSON challenges after a simulated delay."""
+
+    def __init__(self, latency, rng):
+        self.latency = latency
+        self.rng = rng
+        self.requests = 0
+
+    @property
+    def chat(self):
+        return SimpleNamespace(completions=_StubCompletions(self))
+
+
+class DbTimings:
+    """Wraps db.run and db.run_read to record queue wait (submit to start) and execution time."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def install(self):
+        db.run = self._wrap("write", db.run)
+        db.run_read = self._wrap("read", db.run_read)
+
+    def _wrap(self, kind, original):
+        samples = self.samples
+
+        async def wrapper(fn, *args):
+            submitted = time.perf_counter()
+            started = []
+
+            def timed(conn, *fn_args):
+                started.append(time.perf_counter())
+                return fn(conn, *fn_args)
+
+            try:
+                return await original(timed, *args)
+            finally:
+                if started:
+                    samples[f"{kind}_wait"].append(started[0] - submitted)
+                    samples[f"{kind}_execute"].append(time.perf_counter() - started[0])
+
+        return wrapper
+
+
+class Driver:
+    """Builds synthetic callback query updates and times Application.process_update for each."""
+
+    def __init__(self, application, rng):
+        self.application = application
+        self.rng = rng
+        self.latencies = defaultdict(list)
+        self._update_id = 0
+
+    def _callback_update(self, user, group_id, data):
+        self._update_id += 1
+        return Update.de_json({
+            "update_id": self._update_id,
+            "callback_query": {
+                "id": str(self._update_id),
+                "from": user,
+                "chat_instance": str(group_id),
+                "data": data,
+                "message": {
+                    "message_id": self._update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": group_id, "type": "supergroup", "title": "Load test group"},
+                    "from": {"id": LOADTEST_BOT_ID, "is_bot": True, "first_name": "Loadtest"},
+                    "text": "",
+                },
+            },
+        }, self.application.bot)
+
+    async def press(self, label, user, group_id, data):
+        update = self._callback_update(user, group_id, data)
+        started = time.perf_counter()
+        await self.application.process_update(update)
+        self.latencies[label].append(time.perf_counter() - started)
+
+
+def telegram_user(row):
+    user = {"id": row["user_id"], "is_bot": False, "first_name": row["display_name"]}
+    if row["username"]:
+        user["username"] = row["username"]
+    return user
+
+
+async def challenge_session(driver, session, approve_rate):
+    """Accept, complete and get validated for one issued challenge."""
+    user, group_id = session["user"], session["group_id"]
+    await driver.press("accept_challenge", user, group_id, callbacks.encode(callbacks.ACCEPT_CHALLENGE, session['challenge_id']))
+    await driver.press("mark_challenge_complete", user, group_id, callbacks.encode(callbacks.MARK_CHALLENGE_COMPLETE, session['response_id']))
+    verdict = int(driver.rng.random() < approve_rate)
+    await driver.press("validate", session["validator"], group_id, callbacks.encode(callbacks.VALIDATE_CHALLENGE, session['response_id'], verdict))
+
+
+async def prizefight_session(driver, session):
+    """Opponent accepts a proposal, the challenger completes it and the opponent validates."""
+    challenger, opponent, group_id = session["challenger"], session["opponent"], session["group_id"]
+    # /prizefight stores the proposal before sending its buttons
+    prizefight_id = await utils.insert_into_prizefights("Run 5km", "10", group_id)
+
+    await driver.press("accept_prizefight", opponent, group_id, callbacks.encode(callbacks.ACCEPT_PRIZEFIGHT, prizefight_id, challenger["id"]))
+    await driver.press("complete_prizefight", challenger, group_id, callbacks.encode(callbacks.COMPLETE_PRIZEFIGHT, prizefight_id))
+    await driver.press("prizefight_validate", opponent, group_id, callbacks.encode(callbacks.VALIDATE_PRIZEFIGHT, prizefight_id, challenger["id"], 1))
+
+
+def load_sessions(path, first_challenge_id, args, rng):
+    """Challenge sessions for the responses issued in phase 1, and prizefight pairs from group members."""
+    conn = db.connect(path)
+
+    members = defaultdict(list)
+    users = {}
+    for row in conn.execute("""
+        SELECT gm.group_id, u.user_id, u.username, u.display_name
+        FROM group_members gm JOIN users u ON gm.user_id = u.user_id
+    """):
+        members[row["group_id"]].append(row["user_id"])
+        users[row["user_id"]] = row
+
+    goal_members = defaultdict(list)
+    for row in conn.execute("SELECT goal_id, user_id FROM goal_members"):
+        goal_members[row["goal_id"]].append(row["user_id"])
+
+    challenge_sessions = []
+    for row in conn.execute("""
+        SELECT cr.id, cr.challenge_id, cr.user_id, c.goal_id, g.group_id
+        FROM challenge_responses cr
+        JOIN challenges c ON cr.challenge_id = c.id
+        JOIN goals g ON c.goal_id = g.id
+        WHERE c.id >= ? AND cr.status = 'issued'
+    """, (first_challenge_id,)):
+        validators = [u for u in goal_members[row["goal_id"]] if u != row["user_id"]] or [row["user_id"]]
+        challenge_sessions.append({
+            "user": telegram_user(users[row["user_id"]]),
+            "validator": telegram_user(users[rng.choice(validators)]),
+            "group_id": row["group_id"],
+            "challenge_id": row["challenge_id"],
+            "response_id": row["id"],
+        })
+    conn.close()
+
+    rng.shuffle(challenge_sessions)
+    challenge_sessions = challenge_sessions[:args.sessions]
+
+    prizefight_sessions = []
+    groups = [g for g, m in members.items() if len(m) >= 2]
+    for _ in range(int(args.sessions * args.prizefight_share)):
+        group_id = rng.choice(groups)
+        challenger_id, opponent_id = rng.sample(members[group_id], 2)
+        prizefight_sessions.append({
+            "challenger": telegram_user(users[challenger_id]),
+            "opponent": telegram_user(users[opponent_id]),
+            "group_id": group_id,
+        })
+
+    return challenge_sessions, prizefight_sessions
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    path = os.path.join(args.workdir, "goals.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    consts.GOALS_DB_SQLITE = path
+    benchmark.create_schema(args.workdir)
+
+    conn = db.connect(path)
+    benchmark.generate(conn, SimpleNamespace(
+        groups=args.groups,
+        users_per_group=args.users_per_group,
+        goals_per_group=args.goals_per_group,
+        members_per_goal=args.members_per_goal,
+        prizefights_per_group=0,
+        months=args.months,
+    ), rng)
+    first_challenge_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM challenges").fetchone()[0]
+    conn.close()
+
+    # Never talk to the real services, whatever is in .env
+    consts.TELEGRAM_BOT_TOKEN = f"{LOADTEST_BOT_ID}:loadtest"
+    request = StubRequest(args.api_latency_ms / 1000, args.retry_after_rate, args.retry_after, rng)
+    groq = StubGroq(args.groq_latency_ms / 1000, rng)
+    challenge.get_groq_client = lambda: groq
+
+    db_timings = DbTimings()
+    db_timings.install()
+
+    errors = defaultdict(int)
+
+    async def count_errors(update, context):
+        errors[type(context.error).__name__] += 1
+
+    application = bot.build_application(request=request)
+    application.add_error_handler(count_errors)
+    await application.initialize()
+    await bot.post_init(application)
+
+    # Phase 1: nightly challenge generation and delivery
+    started = time.perf_counter()
+    await challenge.schedule_challenges(SimpleNamespace(bot=application.bot, application=application))
+    generation_seconds = time.perf_counter() - started
+
+    challenge_sessions, prizefight_sessions = load_sessions(path, first_challenge_id, args, rng)
+    db_timings.samples.clear()
+    request.durations.clear()
+
+    # Phase 2: concurrent button presses
+    driver = Driver(application, rng)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def bounded(coro):
+        async with semaphore:
+            await coro
+
+    sessions = [challenge_session(driver, s, args.approve_rate) for s in challenge_sessions]
+    sessions += [prizefight_session(driver, s) for s in prizefight_sessions]
+    rng.shuffle(sessions)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(bounded(s) for s in sessions))
+    elapsed = time.perf_counter() - started
+
+    dispatcher_stats = dispatcher.outbox.stats()
+    await application.shutdown()
+    await bot.post_shutdown(application)
+
+    all_latencies = [latency for values in driver.latencies.values() for latency in values]
+    report = {
+        "scale": {
+            "groups": args.groups,
+            "users_per_group": args.users_per_group,
+            "goals_per_group": args.goals_per_group,
+            "members_per_goal": args.members_per_goal,
+            "challenge_sessions": len(challenge_sessions),
+            "prizefight_sessions": len(prizefight_sessions),
+            "concurrency": args.concurrency,
+            "api_latency_ms": args.api_latency_ms,
+            "retry_after_rate": args.retry_after_rate,
+        },
+        "generation": {
+            "seconds": generation_seconds,
+            "groq_requests": groq.requests,
+            "dispatcher": dispatcher_stats,
+        },
+        "handlers": {label: summarise(values) for label, values in sorted(driver.latencies.items())},
+        "all_handlers": summarise(all_latencies),
+        "updates": len(all_latencies),
+        "seconds": elapsed,
+        "throughput_per_second": len(all_latencies) / elapsed if elapsed else None,
+        "db": {kind: summarise(values) for kind, values in sorted(db_timings.samples.items())},
+        "bot_api": {
+            "calls": dict(request.calls),
+            "rate_limited": request.rate_limited,
+            "latency": summarise(request.durations),
+        },
+        "errors": dict(errors),
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the real Application with synthetic users against stub Telegram and Groq")
+    parser.add_argument("--workdir", default=os.path.join(HERE, "loadtest_data"), help="Where the scratch goals.db lives")
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--users-per-group", type=int, default=20)
+    parser.add_argument("--goals-per-group", type=int, default=3)
+    parser.add_argument("--members-per-goal", type=int, default=5)
+    parser.add_argument("--months", type=int, default=1, help="Months of challenge history to generate")
+    parser.add_argument("--sessions", type=int, default=1000, help="Challenge sessions (accept, complete, validate)")
+    parser.add_argument("--prizefight-share", type=float, default=0.2, help="Prizefight sessions as a fraction of --sessions")
+    parser.add_argument("--concurrency", type=int, default=100, help="Sessions in flight at once")
+    parser.add_argument("--approve-rate", type=float, default=0.9, help="Fraction of validations answered yes")
+    parser.add_argument("--api-latency-ms", type=float, default=50, help="Mean simulated Bot API latency")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="Fraction of Bot API calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after seconds in simulated 429s")
+    parser.add_argument("--groq-latency-ms", type=float, default=800, help="Mean simulated Groq latency")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
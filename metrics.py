@@ -0,0 +1,361 @@
+import time
+import asyncio
+import bisect
+import logging
+import functools
+import contextvars
+
+from telegram.ext import ApplicationHandlerStop
+from telegram.request import BaseRequest
+
+import constants as consts
+
+logger = logging.getLogger(__name__)
+
+_started_at = time.time()
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, in seconds, in the shape Prometheus expects."""
+
+    def __init__(self, buckets=consts.METRICS_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, observations at or below it) pairs, ending with +Inf."""
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (inf if it's past the last bucket)."""
+        if not self.count:
+            return 0.0
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+        return float("inf")
+
+
+class HandlerStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.db_seconds = 0.0
+        self.telegram_seconds = 0.0
+
+
+class RequestStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.failures = 0
+
+
+# handler or job name -> HandlerStats
+handlers = {}
+# Bot API method -> RequestStats
+telegram_requests = {}
+db_calls = 0
+db_seconds = 0.0
+# cache name -> callable returning a dict with size, hits and misses
+caches = {}
+# component name -> (callable returning a dict of numbers, keys that are counters)
+components = {}
+
+
+class _Span:
+    """Time the current handler has spent waiting on the database and the Bot API."""
+    __slots__ = ("db_seconds", "telegram_seconds")
+
+    def __init__(self):
+        self.db_seconds = 0.0
+        self.telegram_seconds = 0.0
+
+
+# Set by instrument() for the duration of a handler; each update runs in its own task, so
+# concurrent handlers each see their own span
+_span = contextvars.ContextVar("metrics_span", default=None)
+
+
+def record_db_time(seconds):
+    """Called by db for every query, including time spent queued for a connection."""
+    global db_calls, db_seconds
+    db_calls += 1
+    db_seconds += seconds
+
+    span = _span.get()
+    if span is not None:
+        span.db_seconds += seconds
+
+
+def register_cache(name, stats):
+    """
+    Report an in-process cache's hit rate in render() and summary().
+
+    Args:
+        name (str): Label for the cache
+        stats: Callable returning a dict with "size", "hits" and "misses"
+    """
+    caches[name] = stats
+
+
+def register_stats(name, stats, counters=()):
+    """
+    Export a component's stats() in render() and summary().
+
+    Args:
+        name (str): Component name, used in the metric names (goals_bot_<name>_<key>)
+        stats: Callable returning a dict of numbers
+        counters: Keys that only ever grow; exported as <key>_total counters, the rest as gauges
+    """
+    components[name] = (stats, frozenset(counters))
+
+
+def instrument(callback, name=None):
+    """
+    Wrap a handler or job callback so its latency, errors, DB time and Bot API time are
+    recorded under name (the callback's qualified name by default). Exceptions are re-raised
+    for the application's error handler.
+    """
+    name = name or callback.__qualname__
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        parent = _span.get()
+        span = _Span()
+        token = _span.set(span)
+        started = time.perf_counter()
+        failed = False
+
+        try:
+            return await callback(*args, **kwargs)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            _span.reset(token)
+
+            stats = handlers.get(name)
+            if stats is None:
+                stats = handlers[name] = HandlerStats()
+            stats.latency.observe(time.perf_counter() - started)
+            stats.errors += failed
+            stats.db_seconds += span.db_seconds
+            stats.telegram_seconds += span.telegram_seconds
+
+            # Nested instrumented calls count towards the outer one too
+            if parent is not None:
+                parent.db_seconds += span.db_seconds
+                parent.telegram_seconds += span.telegram_seconds
+
+    return wrapper
+
+
+def instrument_handlers(application, exclude=()):
+    """
+    Instrument every handler registered on the application, in place.
+
+    Args:
+        exclude: Callbacks to leave alone because what they call is instrumented already,
+                 such as a callback router whose routes are wrapped with instrument()
+    """
+    for group in application.handlers.values():
+        for handler in group:
+            if handler.callback not in exclude:
+                handler.callback = instrument(handler.callback)
+
+
+class InstrumentedRequest(BaseRequest):
+    """Bot API transport that times every call per method, then delegates to another BaseRequest."""
+
+    def __init__(self, request):
+        self._request = request
+
+    @property
+    def read_timeout(self):
+        return self._request.read_timeout
+
+    async def initialize(self):
+        await self._request.initialize()
+
+    async def shutdown(self):
+        await self._request.shutdown()
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        failed = True
+
+        try:
+            status, payload = await self._request.do_request(url, method, request_data, *args, **kwargs)
+            failed = status >= 400
+            return status, payload
+        finally:
+            elapsed = time.perf_counter() - started
+
+            stats = telegram_requests.get(api_method)
+            if stats is None:
+                stats = telegram_requests[api_method] = RequestStats()
+            stats.latency.observe(elapsed)
+            stats.failures += failed
+
+            span = _span.get()
+            if span is not None:
+                span.telegram_seconds += elapsed
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def _histogram_lines(metric, label, histograms):
+    lines = [f"# TYPE {metric} histogram"]
+    for value, histogram in sorted(histograms.items()):
+        for bound, total in histogram.cumulative():
+            lines.append(f'{metric}_bucket{{{label}="{value}",le="{_format_bound(bound)}"}} {total}')
+        lines.append(f'{metric}_sum{{{label}="{value}"}} {histogram.sum}')
+        lines.append(f'{metric}_count{{{label}="{value}"}} {histogram.count}')
+    return lines
+
+
+def _counter_lines(metric, label, values, kind="counter"):
+    lines = [f"# TYPE {metric} {kind}"]
+    lines += [f'{metric}{{{label}="{key}"}} {value}' for key, value in sorted(values.items())]
+    return lines
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = [
+        "# TYPE goals_bot_uptime_seconds gauge",
+        f"goals_bot_uptime_seconds {time.time() - _started_at}",
+        "# TYPE goals_bot_db_calls_total counter",
+        f"goals_bot_db_calls_total {db_calls}",
+        "# TYPE goals_bot_db_seconds_total counter",
+        f"goals_bot_db_seconds_total {db_seconds}",
+    ]
+    lines += _histogram_lines("goals_bot_handler_duration_seconds", "handler",
+                              {name: stats.latency for name, stats in handlers.items()})
+    lines += _counter_lines("goals_bot_handler_errors_total", "handler",
+                            {name: stats.errors for name, stats in handlers.items()})
+    lines += _counter_lines("goals_bot_handler_db_seconds_total", "handler",
+                            {name: stats.db_seconds for name, stats in handlers.items()})
+    lines += _counter_lines("goals_bot_handler_telegram_seconds_total", "handler",
+                            {name: stats.telegram_seconds for name, stats in handlers.items()})
+    lines += _histogram_lines("goals_bot_telegram_request_duration_seconds", "method",
+                              {method: stats.latency for method, stats in telegram_requests.items()})
+    lines += _counter_lines("goals_bot_telegram_request_failures_total", "method",
+                            {method: stats.failures for method, stats in telegram_requests.items()})
+
+    cache_stats = {name: stats() for name, stats in caches.items()}
+    lines += _counter_lines("goals_bot_cache_hits_total", "cache",
+                            {name: stats["hits"] for name, stats in cache_stats.items()})
+    lines += _counter_lines("goals_bot_cache_misses_total", "cache",
+                            {name: stats["misses"] for name, stats in cache_stats.items()})
+    lines += _counter_lines("goals_bot_cache_entries", "cache",
+                            {name: stats["size"] for name, stats in cache_stats.items()}, kind="gauge")
+
+    for name, (stats, counters) in sorted(components.items()):
+        for key, value in stats().items():
+            if key in counters:
+                lines += [f"# TYPE goals_bot_{name}_{key}_total counter", f"goals_bot_{name}_{key}_total {value}"]
+            else:
+                lines += [f"# TYPE goals_bot_{name}_{key} gauge", f"goals_bot_{name}_{key} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def _ms(seconds):
+    return ">max" if seconds == float("inf") else f"{seconds * 1000:.0f}"
+
+
+def summary(top=consts.METRICS_SUMMARY_TOP):
+    """Plain-text table of the handlers and jobs that took the most time, for /metrics."""
+    uptime = time.time() - _started_at
+    calls = sum(stats.latency.count for stats in handlers.values())
+    lines = [
+        f"Uptime {uptime / 3600:.1f}h, {calls} handler calls ({calls / uptime:.2f}/s), "
+        f"{db_calls} DB calls ({db_seconds:.1f}s)",
+        "",
+        f"{'handler':<32} {'calls':>6} {'err':>4} {'p50':>5} {'p95':>5} {'mean':>5} {'db':>5} {'api':>5}",
+    ]
+
+    by_total_time = sorted(handlers.items(), key=lambda item: item[1].latency.sum, reverse=True)
+    for name, stats in by_total_time[:top]:
+        count = stats.latency.count
+        lines.append(
+            f"{name[:32]:<32} {count:>6} {stats.errors:>4} "
+            f"{_ms(stats.latency.quantile(0.5)):>5} {_ms(stats.latency.quantile(0.95)):>5} "
+            f"{_ms(stats.latency.sum / count):>5} {_ms(stats.db_seconds / count):>5} "
+            f"{_ms(stats.telegram_seconds / count):>5}"
+        )
+
+    if caches:
+        lines.append("")
+        lines.append(f"{'cache':<32} {'hit %':>6} {'hits':>8} {'misses':>8} {'size':>6}")
+        for name, stats in sorted(caches.items()):
+            stats = stats()
+            lookups = stats["hits"] + stats["misses"]
+            hit_rate = f"{100 * stats['hits'] / lookups:.1f}" if lookups else "-"
+            lines.append(f"{name[:32]:<32} {hit_rate:>6} {stats['hits']:>8} {stats['misses']:>8} {stats['size']:>6}")
+
+    for name, (stats, _) in sorted(components.items()):
+        lines.append("")
+        lines.append(f"{name}: " + ", ".join(f"{key} {value}" for key, value in stats().items()))
+
+    lines.append("")
+    lines.append("Latencies in ms; p50/p95 are histogram bucket bounds, db/api are means per call.")
+    return "\n".join(lines)
+
+
+_server = None
+
+
+async def _handle_scrape(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Skip the headers
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?")[0] if len(parts) > 1 else ""
+        if path == "/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host=consts.METRICS_LISTEN, port=consts.METRICS_PORT):
+    """Serve render() at http://host:port/metrics for Prometheus to scrape."""
+    global _server
+    _server = await asyncio.start_server(_handle_scrape, host, port)
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+
+
+async def stop_server():
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
@@ -0,0 +1,483 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tables from before schema versioning. Kept as CREATE TABLE IF NOT EXISTS so bootstrap can
+# run them against databases created by any earlier version; later changes are MIGRATIONS.
+BASE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        display_name TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS groups (
+        group_id INTEGER PRIMARY KEY,
+        group_name TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS group_members (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        group_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        FOREIGN KEY (group_id) REFERENCES groups(group_id),
+        UNIQUE(group_id, user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS goals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        group_id INTEGER NOT NULL,
+        goal TEXT NOT NULL,
+        status TEXT DEFAULT 'active' CHECK (status IN ('active', 'completed', 'abandoned')),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS goal_members (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        goal_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        role TEXT DEFAULT 'member' CHECK (role IN ('owner', 'member')),
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (goal_id) REFERENCES goals(id) ON DELETE CASCADE,
+        UNIQUE (goal_id, user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS challenges (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        goal_id INTEGER NOT NULL,
+        description TEXT,
+        due_date TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        rejected BOOLEAN DEFAULT 0,
+        FOREIGN KEY (goal_id) REFERENCES goals(id) ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS challenge_responses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        challenge_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        status TEXT DEFAULT 'pending' CHECK (status IN ('issued', 'pending', 'rejected', 'completed', 'failed')),
+        validated BOOLEAN DEFAULT 0,
+        completed_at TIMESTAMP,
+        validated_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (challenge_id) REFERENCES challenges(id) ON DELETE CASCADE,
+        UNIQUE (challenge_id, user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS prizefights (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        group_id INTEGER NOT NULL,
+        challenge TEXT NOT NULL,
+        prize TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS prizefight_participants (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        prizefight_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        status TEXT DEFAULT 'pending' CHECK (status IN ('pending', 'verifying', 'completed', 'failed')),
+        FOREIGN KEY (prizefight_id) REFERENCES prizefights(id) ON DELETE CASCADE,
+        UNIQUE (prizefight_id, user_id)
+    );
+"""
+
+USER_GOAL_STATS_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS user_goal_stats (
+        user_id INTEGER NOT NULL,
+        goal_id INTEGER NOT NULL,
+        issued_count INTEGER NOT NULL DEFAULT 0,
+        completed_count INTEGER NOT NULL DEFAULT 0, -- Validated completions
+        failed_count INTEGER NOT NULL DEFAULT 0, -- Expired, or rejected by the validator
+        current_streak INTEGER NOT NULL DEFAULT 0, -- Validated completions since the last failure
+        best_streak INTEGER NOT NULL DEFAULT 0,
+        last_completed_at TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, goal_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_user_goal_stats_goal ON user_goal_stats (goal_id)",
+    # Kept up to date by triggers, so every code path that issues, expires, validates or
+    # rejects a challenge response updates the counters in the same transaction
+    """
+    CREATE TRIGGER IF NOT EXISTS user_goal_stats_issued
+    AFTER INSERT ON challenge_responses
+    BEGIN
+        INSERT INTO user_goal_stats (user_id, goal_id, issued_count)
+        SELECT NEW.user_id, c.goal_id, 1 FROM challenges c WHERE c.id = NEW.challenge_id
+        ON CONFLICT (user_id, goal_id) DO UPDATE SET
+            issued_count = issued_count + 1,
+            updated_at = CURRENT_TIMESTAMP;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS user_goal_stats_validated
+    AFTER UPDATE OF validated ON challenge_responses
+    WHEN NEW.validated = 1 AND OLD.validated = 0
+    BEGIN
+        INSERT INTO user_goal_stats (user_id, goal_id, completed_count, current_streak, best_streak, last_completed_at)
+        SELECT NEW.user_id, c.goal_id, 1, 1, 1, CURRENT_TIMESTAMP FROM challenges c WHERE c.id = NEW.challenge_id
+        ON CONFLICT (user_id, goal_id) DO UPDATE SET
+            completed_count = completed_count + 1,
+            current_streak = current_streak + 1,
+            best_streak = MAX(best_streak, current_streak + 1),
+            last_completed_at = CURRENT_TIMESTAMP,
+            updated_at = CURRENT_TIMESTAMP;
+    END
+    """,
+    # 'rejected' also marks challenges replaced by a member's suggestion; only the validator's
+    # rejection sets validated_at
+    """
+    CREATE TRIGGER IF NOT EXISTS user_goal_stats_failed
+    AFTER UPDATE OF status ON challenge_responses
+    WHEN NEW.status != OLD.status
+        AND (NEW.status = 'failed' OR (NEW.status = 'rejected' AND NEW.validated_at IS NOT NULL))
+    BEGIN
+        INSERT INTO user_goal_stats (user_id, goal_id, failed_count)
+        SELECT NEW.user_id, c.goal_id, 1 FROM challenges c WHERE c.id = NEW.challenge_id
+        ON CONFLICT (user_id, goal_id) DO UPDATE SET
+            failed_count = failed_count + 1,
+            current_streak = 0,
+            updated_at = CURRENT_TIMESTAMP;
+    END
+    """,
+]
+
+
+def add_user_goal_stats(conn):
+    """Create user_goal_stats with its triggers and backfill it from the existing responses."""
+    for statement in USER_GOAL_STATS_SCHEMA:
+        conn.execute(statement)
+
+    rows = conn.execute("""
+        SELECT cr.user_id, c.goal_id, cr.status, cr.validated, cr.validated_at, cr.completed_at
+        FROM challenge_responses cr
+        JOIN challenges c ON c.id = cr.challenge_id
+        ORDER BY cr.user_id, c.goal_id, c.created_at, cr.id
+    """)
+
+    stats = {}
+    for user_id, goal_id, status, validated, validated_at, completed_at in rows:
+        entry = stats.setdefault((user_id, goal_id), {
+            "issued": 0, "completed": 0, "failed": 0, "streak": 0, "best": 0, "last_completed_at": None,
+        })
+        entry["issued"] += 1
+
+        if validated:
+            entry["completed"] += 1
+            entry["streak"] += 1
+            entry["best"] = max(entry["best"], entry["streak"])
+            entry["last_completed_at"] = validated_at or completed_at
+        elif status == "failed" or (status == "rejected" and validated_at is not None):
+            entry["failed"] += 1
+            entry["streak"] = 0
+
+    conn.executemany("""
+        INSERT INTO user_goal_stats
+            (user_id, goal_id, issued_count, completed_count, failed_count, current_streak, best_streak, last_completed_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (user_id, goal_id, e["issued"], e["completed"], e["failed"], e["streak"], e["best"], e["last_completed_at"])
+        for (user_id, goal_id), e in stats.items()
+    ])
+
+
+# Ordered (version, description, script) tuples. Append new migrations to the end and never
+# edit one that has already shipped; goals.db records the highest version applied.
+# script is either SQL, or a callable taking the connection for migrations that need Python
+# (it runs inside the migration's transaction, so it must not call executescript or commit).
+MIGRATIONS = [
+    (1, "Indexes for hot query paths", """
+        -- goals filtered by group and status (/goals, /complete) and by status alone (nightly job)
+        CREATE INDEX IF NOT EXISTS idx_goals_group_status ON goals (group_id, status);
+        CREATE INDEX IF NOT EXISTS idx_goals_status ON goals (status);
+
+        -- goals a user belongs to, and the NOT IN membership subquery
+        CREATE INDEX IF NOT EXISTS idx_goal_members_user ON goal_members (user_id, goal_id);
+
+        -- get_past_challenges: newest non-rejected challenges of a goal
+        CREATE INDEX IF NOT EXISTS idx_challenges_goal_rejected_created ON challenges (goal_id, rejected, created_at);
+
+        -- iter_challenges_to_remind: range scan on created_at
+        CREATE INDEX IF NOT EXISTS idx_challenges_created ON challenges (created_at);
+
+        -- expire_overdue_challenges / get_completed_unvalidated_challenges; covering for the former only
+        CREATE INDEX IF NOT EXISTS idx_challenge_responses_status ON challenge_responses (status, validated, challenge_id, user_id);
+
+        -- get_pending_challenges: a user's responses by status
+        CREATE INDEX IF NOT EXISTS idx_challenge_responses_user_status ON challenge_responses (user_id, status);
+
+        -- get_user_id_from_display_name matches either column
+        CREATE INDEX IF NOT EXISTS idx_users_username ON users (username);
+        CREATE INDEX IF NOT EXISTS idx_users_display_name ON users (display_name);
+
+        -- get_pending_prizefights / get_prize_fight_for_user_id
+        CREATE INDEX IF NOT EXISTS idx_prizefight_participants_status ON prizefight_participants (status);
+        CREATE INDEX IF NOT EXISTS idx_prizefight_participants_user_status ON prizefight_participants (user_id, status);
+    """),
+    (2, "Cross-group challenge cache", """
+        -- Generated challenges shared between goals with the same normalized text and day bucket
+        CREATE TABLE IF NOT EXISTS challenge_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            goal_key TEXT NOT NULL,
+            day_bucket INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (goal_key, day_bucket, description)
+        );
+        CREATE INDEX IF NOT EXISTS idx_challenge_cache_key_created ON challenge_cache (goal_key, day_bucket, created_at);
+        CREATE INDEX IF NOT EXISTS idx_challenge_cache_created ON challenge_cache (created_at);
+    """),
+    (3, "Pre-generated challenges", """
+        -- Challenges generated ahead of the nightly run. issue_date is the date of the run
+        -- (schedule timezone) that will send them.
+        CREATE TABLE IF NOT EXISTS pending_challenges (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            goal_id INTEGER NOT NULL,
+            issue_date TEXT NOT NULL,
+            description TEXT,
+            status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'ready', 'failed', 'issued')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (goal_id) REFERENCES goals(id) ON DELETE CASCADE,
+            UNIQUE (goal_id, issue_date)
+        );
+        CREATE INDEX IF NOT EXISTS idx_pending_challenges_date_status ON pending_challenges (issue_date, status, next_attempt_at);
+    """),
+    (4, "Per-group timezones", """
+        -- IANA timezone name; NULL means the default SCHEDULE_TIMEZONE
+        ALTER TABLE groups ADD COLUMN timezone TEXT;
+        CREATE INDEX IF NOT EXISTS idx_goals_group ON goals (group_id);
+        CREATE INDEX IF NOT EXISTS idx_prizefights_group ON prizefights (group_id);
+    """),
+    (5, "Durable conversational state", """
+        -- Per-chat state that used to live in context.chat_data; value is JSON
+        CREATE TABLE IF NOT EXISTS chat_state (
+            chat_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            expires_at INTEGER NOT NULL, -- Unix time
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat_id, key)
+        );
+        CREATE INDEX IF NOT EXISTS idx_chat_state_expires ON chat_state (expires_at);
+    """),
+    (6, "Streak and completion counters", add_user_goal_stats),
+    (7, "Leaderboard aggregates", """
+        -- Per group and user: validated challenges and prize fights won in each UTC calendar
+        -- week (starting Monday), month, and all time (period_start ''). Kept up to date by
+        -- triggers so /leaderboard reads one group's rows for one period instead of the history.
+        CREATE TABLE IF NOT EXISTS leaderboard_scores (
+            group_id INTEGER NOT NULL,
+            period TEXT NOT NULL CHECK (period IN ('week', 'month', 'all')),
+            period_start TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            challenges_completed INTEGER NOT NULL DEFAULT 0,
+            prizefights_won INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (group_id, period, period_start, user_id)
+        );
+
+        CREATE TRIGGER IF NOT EXISTS leaderboard_challenge_validated
+        AFTER UPDATE OF validated ON challenge_responses
+        WHEN NEW.validated = 1 AND OLD.validated = 0
+        BEGIN
+            INSERT INTO leaderboard_scores (group_id, period, period_start, user_id, challenges_completed)
+            SELECT g.group_id, p.period, p.period_start, NEW.user_id, 1
+            FROM challenges c
+            JOIN goals g ON g.id = c.goal_id
+            CROSS JOIN (
+                SELECT 'week' AS period, DATE('now', 'weekday 0', '-6 days') AS period_start
+                UNION ALL SELECT 'month', DATE('now', 'start of month')
+                UNION ALL SELECT 'all', ''
+            ) p
+            WHERE c.id = NEW.challenge_id
+            ON CONFLICT (group_id, period, period_start, user_id) DO UPDATE SET
+                challenges_completed = challenges_completed + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS leaderboard_prizefight_won
+        AFTER UPDATE OF status ON prizefight_participants
+        WHEN NEW.status = 'completed' AND OLD.status != 'completed'
+        BEGIN
+            INSERT INTO leaderboard_scores (group_id, period, period_start, user_id, prizefights_won)
+            SELECT pf.group_id, p.period, p.period_start, NEW.user_id, 1
+            FROM prizefights pf
+            CROSS JOIN (
+                SELECT 'week' AS period, DATE('now', 'weekday 0', '-6 days') AS period_start
+                UNION ALL SELECT 'month', DATE('now', 'start of month')
+                UNION ALL SELECT 'all', ''
+            ) p
+            WHERE pf.id = NEW.prizefight_id
+            ON CONFLICT (group_id, period, period_start, user_id) DO UPDATE SET
+                prizefights_won = prizefights_won + 1;
+        END;
+
+        -- Backfill from existing history, dated by when the completion was validated
+        INSERT INTO leaderboard_scores (group_id, period, period_start, user_id, challenges_completed)
+        SELECT g.group_id, p.period,
+               CASE p.period
+                   WHEN 'week' THEN DATE(COALESCE(cr.validated_at, cr.completed_at, cr.created_at), 'weekday 0', '-6 days')
+                   WHEN 'month' THEN DATE(COALESCE(cr.validated_at, cr.completed_at, cr.created_at), 'start of month')
+                   ELSE ''
+               END,
+               cr.user_id, COUNT(*)
+        FROM challenge_responses cr
+        JOIN challenges c ON c.id = cr.challenge_id
+        JOIN goals g ON g.id = c.goal_id
+        CROSS JOIN (SELECT 'week' AS period UNION ALL SELECT 'month' UNION ALL SELECT 'all') p
+        WHERE cr.validated = 1
+        GROUP BY 1, 2, 3, 4;
+
+        -- prizefight_participants has no completion time; joined_at is the closest we have
+        INSERT INTO leaderboard_scores (group_id, period, period_start, user_id, prizefights_won)
+        SELECT pf.group_id, p.period,
+               CASE p.period
+                   WHEN 'week' THEN DATE(pfp.joined_at, 'weekday 0', '-6 days')
+                   WHEN 'month' THEN DATE(pfp.joined_at, 'start of month')
+                   ELSE ''
+               END,
+               pfp.user_id, COUNT(*)
+        FROM prizefight_participants pfp
+        JOIN prizefights pf ON pf.id = pfp.prizefight_id
+        CROSS JOIN (SELECT 'week' AS period UNION ALL SELECT 'month' UNION ALL SELECT 'all') p
+        WHERE pfp.status = 'completed'
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (group_id, period, period_start, user_id) DO UPDATE SET
+            prizefights_won = prizefights_won + excluded.prizefights_won;
+    """),
+    (8, "Archive tables for resolved challenges", """
+        -- Filled by archive.py with challenges (and their responses) that were resolved long
+        -- ago, so the hot tables only hold recent rows. No foreign keys: goals may be deleted
+        -- while their history is kept.
+        CREATE TABLE IF NOT EXISTS challenges_archive (
+            id INTEGER PRIMARY KEY,
+            goal_id INTEGER NOT NULL,
+            description TEXT,
+            due_date TIMESTAMP,
+            created_at TIMESTAMP,
+            rejected BOOLEAN,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_challenges_archive_goal ON challenges_archive (goal_id, created_at);
+
+        CREATE TABLE IF NOT EXISTS challenge_responses_archive (
+            id INTEGER PRIMARY KEY,
+            challenge_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT,
+            validated BOOLEAN,
+            completed_at TIMESTAMP,
+            validated_at TIMESTAMP,
+            created_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_challenge_responses_archive_challenge ON challenge_responses_archive (challenge_id);
+        CREATE INDEX IF NOT EXISTS idx_challenge_responses_archive_user ON challenge_responses_archive (user_id);
+
+        -- Full history, for stats and reports that need more than the hot tables
+        CREATE VIEW IF NOT EXISTS all_challenges AS
+            SELECT id, goal_id, description, due_date, created_at, rejected FROM challenges
+            UNION ALL
+            SELECT id, goal_id, description, due_date, created_at, rejected FROM challenges_archive;
+
+        CREATE VIEW IF NOT EXISTS all_challenge_responses AS
+            SELECT id, challenge_id, user_id, status, validated, completed_at, validated_at, created_at FROM challenge_responses
+            UNION ALL
+            SELECT id, challenge_id, user_id, status, validated, completed_at, validated_at, created_at FROM challenge_responses_archive;
+    """),
+]
+
+
+def get_schema_version(conn):
+    """Return the highest migration version applied to the database, or 0."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Apply every migration newer than the database's schema version, in order.
+
+    Each migration runs in its own transaction together with its schema_version row,
+    so a failed migration leaves the database at the previous version.
+
+    Args:
+        conn: sqlite3.Connection to goals.db
+
+    Returns:
+        int: The schema version after migrating
+    """
+    current_version = get_schema_version(conn)
+
+    for version, description, script in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        logger.info(f"Applying migration {version}: {description}")
+        try:
+            if callable(script):
+                conn.execute("BEGIN")
+                script(conn)
+            else:
+                conn.executescript(f"BEGIN;\n{script}")
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception(f"Migration {version} failed, database left at version {current_version}")
+            raise
+
+        current_version = version
+
+    return current_version
+
+
+def bootstrap(conn):
+    """
+    Create or upgrade goals.db to the latest schema. Safe to run on every start: when the
+    database is already current it costs one read of the file header (PRAGMA user_version,
+    which mirrors the schema version) and writes nothing.
+
+    Args:
+        conn: sqlite3.Connection to goals.db, with no transaction open
+
+    Returns:
+        int: The schema version
+    """
+    latest = MIGRATIONS[-1][0]
+    if conn.execute("PRAGMA user_version").fetchone()[0] == latest:
+        return latest
+
+    if not conn.execute("SELECT 1 FROM sqlite_master").fetchone():
+        # Lets archive.py hand space back to the OS. Only possible cheaply on a new database:
+        # switching an existing one rewrites the file (python archive.py --vacuum)
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+    conn.executescript(BASE_SCHEMA)
+    version = migrate(conn)
+
+    conn.execute(f"PRAGMA user_version = {int(version)}")
+    conn.commit()
+    logger.info(f"Database schema bootstrapped at version {version}")
+    return version
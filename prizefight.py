@@ -2,6 +2,7 @@ import random
 import logging
 
 import utils
+import callbacks
 import constants as consts
 
 
@@ -70,11 +71,14 @@ async def prize_fight(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             if " " in full_text:
                 challenge, prize, participant = full_text.rsplit(" ", 2)
 
+        # Store the proposal up front so its buttons only need to carry IDs
+        prize_fight_id = await utils.insert_into_prizefights(challenge, prize, group.id)
+
         message = f"💰<b>PRIZE FIGHT</b> - {display_name} vs {participant}\n\n*********************\n<b>Challenge:</b> {challenge}\n<b>Prize:</b> ${prize}\n*********************\n\nParty that completes that challenge receives payment from the other party. If the both of you completes/fails the challenge, keep trying until one of you wins!\n\nAccept or Suggest another Prize Fight!"
 
         keyboard = [
-            InlineKeyboardButton("Accept Prize Fight", callback_data=f"accept_prizefight:{challenge}:{prize}"),
-            InlineKeyboardButton("Suggest another challenge", callback_data="suggest_prizefight")
+            InlineKeyboardButton("Accept Prize Fight", callback_data=callbacks.encode(callbacks.ACCEPT_PRIZEFIGHT, prize_fight_id, user.id)),
+            InlineKeyboardButton("Suggest another challenge", callback_data=callbacks.encode(callbacks.SUGGEST_PRIZEFIGHT, prize_fight_id))
         ]
         reply_markup = InlineKeyboardMarkup([keyboard])
 
@@ -97,47 +101,74 @@ async def handle_prize_fight_response(update: Update, context: ContextTypes.DEFA
     display_name = utils.get_display_name_from_telegram_user(user)
     group_id = query.message.chat_id
 
-    await query.answer()
+    # Every path below answers the query exactly once, with its outcome; Telegram rejects a second answer
     await utils.upsert_user_and_group(user, query.message.chat)
 
-    try:
-        parsed = parse_prizefight_message(query.message.text_html)
-        challenge = parsed['challenge']
-        prize = parsed['prize']
-        challenger_name = parsed['challenger_name']
-        challenger_user_id = utils.get_user_id_from_display_name(challenger_name)
-    except ValueError as e:
-        await query.answer("Error parsing prize fight details.", show_alert=True)
-        logger.error(f"Parse error in handle_prize_fight_response: {e}")
-        return
+    if context.args:
+        # The proposal's row already exists; the button carries its ID and the challenger's
+        prize_fight_id, challenger_user_id = context.args
+        try:
+            prize_fight = await utils.accept_prizefight(prize_fight_id, [challenger_user_id, user_id])
+        except Exception as e:
+            logger.error(f"Database error accepting prize fight: {e}")
+            await query.answer("Something went wrong accepting this prize fight. Please try again.", show_alert=True)
+            return
 
-    data_parts = query.data
-    if "accept_prizefight" in data_parts and challenger_user_id is not None:
+        if not prize_fight:
+            await query.answer("This prize fight has already been accepted.", show_alert=True)
+            return
+        challenge = prize_fight['challenge']
+        prize = prize_fight['prize']
+    else:
+        # Buttons sent before proposals were stored only carry the challenge in the message text
         try:
-            prize_fight_id = utils.insert_into_prizefights(challenge, prize, group_id)
-            utils.insert_into_prizefight_participants(prize_fight_id, challenger_user_id['user_id'])
-            utils.insert_into_prizefight_participants(prize_fight_id, user_id)
+            parsed = parse_prizefight_message(query.message.text_html)
+            challenge = parsed['challenge']
+            prize = parsed['prize']
+            challenger_user_id = await utils.get_user_id_from_display_name(parsed['challenger_name'])
+        except ValueError as e:
+            await query.answer("Error parsing prize fight details.", show_alert=True)
+            logger.error(f"Parse error in handle_prize_fight_response: {e}")
+            return
+
+        if challenger_user_id is None:
+            await query.answer("Couldn't find who started this prize fight.", show_alert=True)
+            return
 
-            await query.edit_message_reply_markup(reply_markup=None)
+        try:
+            prize_fight_id = await utils.insert_into_prizefights(challenge, prize, group_id)
+            await utils.insert_into_prizefight_participants(prize_fight_id, challenger_user_id['user_id'])
+            await utils.insert_into_prizefight_participants(prize_fight_id, user_id)
         except Exception as e:
             logger.error(f"Database error inserting prize fight: {e}")
+            await query.answer("Something went wrong accepting this prize fight. Please try again.", show_alert=True)
+            return
 
-        message = f"🏆 {display_name} accepted the prize fight!\n<b>Challenge:</b> {challenge}\n<b>Prize:</b> ${prize}!\n\nSend your proof of completion here for all to see! Challenge begins now! May the best win!"
+    await query.answer("You joined the prize fight!")
+    await query.edit_message_reply_markup(reply_markup=None)
 
-        # User accepted the prize fight
-        await query.message.reply_text(
-            text=message,
-            parse_mode='HTML')
-    else:
-        await query.message.reply_text(
-            "What would you like to suggest for the prize fight? Reply to this message with your challenge idea in this format - [challenge]<space>[prize]<space>[@participant].",
-            reply_markup=ForceReply(selective=True)
-            )
-        await query.edit_message_reply_markup(reply_markup=None)
-        return
-    
-    # Send confirmation messages
-    await query.answer(f"You joined the prize fight!")
+    message = f"🏆 {display_name} accepted the prize fight!\n<b>Challenge:</b> {challenge}\n<b>Prize:</b> ${prize}!\n\nSend your proof of completion here for all to see! Challenge begins now! May the best win!"
+
+    # User accepted the prize fight
+    await query.message.reply_text(
+        text=message,
+        parse_mode='HTML')
+
+async def handle_prize_fight_suggestion(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+
+    await query.answer()
+    await utils.upsert_user_and_group(query.from_user, query.message.chat, wait=False)
+
+    # Drop the proposal being replaced, unless someone accepted it in the meantime
+    if context.args:
+        await utils.delete_unaccepted_prizefight(context.args[0])
+
+    await query.message.reply_text(
+        "What would you like to suggest for the prize fight? Reply to this message with your challenge idea in this format - [challenge]<space>[prize]<space>[@participant].",
+        reply_markup=ForceReply(selective=True)
+        )
+    await query.edit_message_reply_markup(reply_markup=None)
 
 async def complete_prize_fight_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.message.from_user
@@ -147,7 +178,7 @@ async def complete_prize_fight_handler(update: Update, context: ContextTypes.DEF
 
     # Query for all active prize fights the user is participating in within the group
 
-    active_prize_fights = utils.get_prize_fight_for_user_id(user_id, group_id)
+    active_prize_fights = await utils.get_prize_fight_for_user_id(user_id, group_id)
 
     if not active_prize_fights:
         await update.message.reply_text("You have no active prize fights to complete in this group.")
@@ -155,7 +186,7 @@ async def complete_prize_fight_handler(update: Update, context: ContextTypes.DEF
 
     # Build the message and buttons for active prize fights
     keyboard = [
-        InlineKeyboardButton(f"{pf['challenge']} - ${pf['prize']}", callback_data=f"complete_prizefight:{pf['id']}")
+        InlineKeyboardButton(f"{pf['challenge']} - ${pf['prize']}", callback_data=callbacks.encode(callbacks.COMPLETE_PRIZEFIGHT, pf['id']))
         for pf in active_prize_fights
     ]
 
@@ -174,16 +205,16 @@ async def complete_selected_prize_fight(update: Update, context: ContextTypes.DE
     group_id = query.message.chat.id
     display_name = utils.get_display_name_from_telegram_user(user)
 
-    prize_fight_id = query.data.split(":")[1]  # Extract the prize fight ID
+    prize_fight_id = context.args[0]  # Prize fight ID from the callback data
 
     # Get prize fight details
-    prize_fight = utils.get_prize_fight_details(prize_fight_id)
+    prize_fight = await utils.get_prize_fight_details(prize_fight_id)
     if not prize_fight:
         await query.answer("Something went wrong while fetching prize fight details. Please try again.")
         return
 
     # Get other challengers of the prize fight
-    challengers = utils.get_prize_fight_participants(prize_fight_id, exclude_user_id=user_id)
+    challengers = await utils.get_prize_fight_participants(prize_fight_id, exclude_user_id=user_id)
     
     if not challengers:
         await query.answer("Something went wrong, please restart the prize fight.")
@@ -194,8 +225,8 @@ async def complete_selected_prize_fight(update: Update, context: ContextTypes.DE
     validator_display_name = f"@{validator['username']}" if validator['username'] else validator['display_name']
 
     keyboard = [
-        InlineKeyboardButton("Yes!", callback_data=f"prizefight_validate:{prize_fight_id}:{user_id}:accept"),
-        InlineKeyboardButton("Nope!", callback_data=f"prizefight_validate:{prize_fight_id}:{user_id}:reject")
+        InlineKeyboardButton("Yes!", callback_data=callbacks.encode(callbacks.VALIDATE_PRIZEFIGHT, prize_fight_id, user_id, 1)),
+        InlineKeyboardButton("Nope!", callback_data=callbacks.encode(callbacks.VALIDATE_PRIZEFIGHT, prize_fight_id, user_id, 0))
     ]
     reply_markup = InlineKeyboardMarkup([keyboard])
 
@@ -215,23 +246,20 @@ async def handle_prize_fight_validation(update: Update, context: ContextTypes.DE
     await query.answer()
     await utils.upsert_user_and_group(user, query.message.chat)
 
-    data_parts = query.data.split(":")
-    prize_fight_id = data_parts[1]
-    challenger_user_id = data_parts[2]
-    action = data_parts[3]
+    prize_fight_id, challenger_user_id, accepted = context.args
 
-    challenger = utils.get_display_name_from_user_id(int(challenger_user_id))
+    challenger = await utils.get_display_name_from_user_id(challenger_user_id)
 
-    if action == "accept":
+    if accepted:
         # Validator accepted the completion
-        utils.edit_prize_fight_status(int(prize_fight_id), int(challenger_user_id), "completed")
+        await utils.edit_prize_fight_status(prize_fight_id, challenger_user_id, "completed")
 
         await query.message.reply_text(
             text=f"🏆 Congratulations {challenger['name']}! Your prize fight completion has been validated by {display_name}. You have officially completed the challenge!"
             )
-    elif action == "reject":
+    else:
         # Validator rejected the completion
-        utils.edit_prize_fight_status(int(prize_fight_id), int(challenger_user_id), "failed")
+        await utils.edit_prize_fight_status(prize_fight_id, challenger_user_id, "failed")
 
         await query.message.reply_text(
             text=f"❌ Hey {challenger['name']}, {display_name} does not think you did enough to complete the prize fight challenge. Issue a new prize fight and prove them wrong!"
@@ -72,4 +72,34 @@ Respond in this exact JSON format:
 
 This is the {num_day} day of the goal, some of the past challenges are: {past_challenges}. Try not to be repeat the same challenges.
 
+The members' current streak is {streak_days} days of completed challenges in a row. Build on a long streak with a slightly harder challenge; after a broken streak (0 days), keep it easy to win back momentum.
+
 Respond only with the JSON, no other text."""
+
+
+BATCH_CHALLENGE_PROMPT_TEMPLATE = """You are an accountability coach helping users achieve their goals through daily challenges.
+
+Below are several goals, one JSON object per line. Each has:
+- "goal_id": the identifier to echo back
+- "goal": the goal itself
+- "day": which day of the goal it is
+- "past_challenges": some of the past challenges for that goal. Try not to repeat the same challenges.
+- "streak_days": how many challenges in a row the members have completed. Build on a long streak with a slightly harder challenge; after a broken streak (0), keep it easy to win back momentum.
+
+{goals}
+
+Generate a challenge for today for every goal. Each challenge should:
+- Help the members make progress toward the goal
+- Be specific and actionable
+- Be achievable in one day
+- Be measurable (members should be able to clearly say "done" or "not done")
+- Be motivating but not overwhelming
+
+Respond in this exact JSON format, with exactly one entry per goal_id:
+{{
+    "challenges": [
+        {{"goal_id": 1, "challenge": "Description of what members need to do (1-2 sentences)"}}
+    ]
+}}
+
+Respond only with the JSON, no other text."""
\ No newline at end of file
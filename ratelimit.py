@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Async token bucket.
+
+    Tokens refill continuously at `rate` per second up to `capacity`. Callers await
+    acquire(amount) and are released in FIFO order once enough tokens are available.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, amount=1):
+        """Wait until `amount` tokens are available, then take them."""
+        # A request larger than the bucket could never be served, so cap it
+        amount = min(amount, self.capacity)
+
+        async with self._lock:
+            self._refill()
+            while self._tokens < amount:
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= amount
+
+    def try_acquire(self, amount=1):
+        """
+        Take `amount` tokens if they are available right now.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise seconds until they will be available
+        """
+        amount = min(amount, self.capacity)
+        self._refill()
+        if self._tokens >= amount:
+            self._tokens -= amount
+            return 0
+        return (amount - self._tokens) / self.rate
+
+    def is_full(self):
+        """Whether the bucket has refilled completely, so it behaves like a new one."""
+        self._refill()
+        return self._tokens >= self.capacity
+
+    def pause(self, seconds):
+        """Drain the bucket so nothing is released for the next `seconds`."""
+        self._refill()
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limiter, matching how LLM API quotas are expressed.
+
+    Args:
+        requests_per_minute (int): Maximum requests started per minute
+        tokens_per_minute (int): Maximum (estimated) tokens consumed per minute
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+
+    async def acquire(self, tokens):
+        """Wait for one request slot and `tokens` tokens of quota."""
+        await self.requests.acquire(1)
+        await self.tokens.acquire(tokens)
@@ -1,6 +1,10 @@
 import os
+import json
+import asyncio
 import logging
 import utils
+import dispatcher
+import constants as consts
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 
 logger = logging.getLogger(__name__)
@@ -13,70 +17,76 @@ from telegram.ext import (
     filters,
 )
 
-async def send_morning_reminder(context: ContextTypes.DEFAULT_TYPE):
+async def _report_failures(kind, reminders):
+    """Wait for a batch of reminders to go out and tell the admin about any that could not be sent."""
+    results = await asyncio.gather(*(future for *_, future in reminders), return_exceptions=True)
 
-    challenges_issued_yesterday = utils.get_challenges_issued_yesterday()
+    for (group_id, challenge_id, challenge_text, _), result in zip(reminders, results):
+        if isinstance(result, Exception):
+            dispatcher.outbox.submit(
+                chat_id=os.getenv("ADMIN_TELEGRAM_USER_ID"),
+                priority=dispatcher.PRIORITY_LOW,
+                text=f"Failed to send {kind} reminder to group {group_id}\n\nChallenge ID: {challenge_id}\nChallenge: {challenge_text}\nError: {result}",
+                parse_mode='HTML'
+            )
+
+async def _send_reminders(kind, format_text, group_ids=None, timezone=None):
+    """
+    Send one reminder per challenge issued since the last nightly run to the participants who haven't completed it.
 
-    for challenge in challenges_issued_yesterday:
+    At most REMINDER_BATCH_SIZE reminders are queued at a time; each batch is sent before
+    the next is read, so memory doesn't grow with the number of challenges.
+
+    Args:
+        kind (str): "morning" or "evening", used in the admin failure report
+        format_text: Callable taking (participants_str, challenge_text) and returning the message text
+        group_ids (list): Only remind these groups; None for every group
+        timezone (str): The groups' timezone, which decides when the last nightly run was
+    """
+    reminders = []
+
+    async for challenge in utils.iter_challenges_to_remind(group_ids=group_ids, timezone=timezone):
         challenge_id = challenge["id"]
         goal_id = challenge["goal_id"]
+        group_id = challenge["group_id"]
         challenge_text = challenge["description"]
 
-        # Get group ID
-        group_id = utils.get_group_id_by_goal_id(goal_id)
-
-        # Get users participating in the challenge
-        participants = utils.get_challenge_accepted_participants(challenge_id)
-        participants_list = [p["name"] for p in participants]
-        participants_str = utils.format_names_list(participants_list)
-
         if not group_id:
             logger.error(f"No group found for goal_id: {goal_id}")
-            return  # Goal does not belong to any group
+            continue  # Goal does not belong to any group
 
-        try:
-            await context.bot.send_message(
-                chat_id=group_id,
-                text=f"🌅 Good morning {participants_str}! A reminder on your goal today:\n\n🎯 <b>Challenge:</b> {challenge_text}\n\nDon't forget to complete it today and mark it as done! Let's keep pushing towards our goals together! 💪",
-                parse_mode='HTML'
-            )
-        except Exception as e:
-            await context.bot.send_message(
-            chat_id=os.getenv("ADMIN_TELEGRAM_USER_ID"),
-            text=f"Failed to send morning reminder to group {group_id}\n\nChallenge ID: {challenge_id}\nChallenge: {challenge_text}\nError: {e}",
+        # Users who still have to complete the challenge
+        participants_list = json.loads(challenge["participants"])
+        if not participants_list:
+            continue  # Everyone is done
+        participants_str = utils.format_names_list(participants_list)
+
+        reminders.append((group_id, challenge_id, challenge_text, dispatcher.outbox.submit(
+            chat_id=group_id,
+            text=format_text(participants_str, challenge_text),
             parse_mode='HTML'
-            )
+        )))
 
-async def send_evening_reminder(context: ContextTypes.DEFAULT_TYPE):
-    
-    challenges_issued_yesterday = utils.get_challenges_issued_yesterday()
+        if len(reminders) >= consts.REMINDER_BATCH_SIZE:
+            await _report_failures(kind, reminders)
+            reminders = []
 
-    for challenge in challenges_issued_yesterday:
-        challenge_id = challenge["id"]
-        goal_id = challenge["goal_id"]
-        challenge_text = challenge["description"]
+    await _report_failures(kind, reminders)
 
-        # Get group ID
-        group_id = utils.get_group_id_by_goal_id(goal_id)
+async def send_morning_reminder(context: ContextTypes.DEFAULT_TYPE, group_ids=None, timezone=None):
 
-        # Get users participating in the challenge
-        participants = utils.get_challenge_accepted_participants(challenge_id)
-        participants_list = [p["name"] for p in participants]
-        participants_str = utils.format_names_list(participants_list)
+    await _send_reminders(
+        "morning",
+        lambda participants_str, challenge_text: f"🌅 Good morning {participants_str}! A reminder on your goal today:\n\n🎯 <b>Challenge:</b> {challenge_text}\n\nDon't forget to complete it today and mark it as done! Let's keep pushing towards our goals together! 💪",
+        group_ids,
+        timezone
+    )
 
-        if not group_id:
-            logger.error(f"No group found for goal_id: {goal_id}")
-            return  # Goal does not belong to any group
+async def send_evening_reminder(context: ContextTypes.DEFAULT_TYPE, group_ids=None, timezone=None):
 
-        try:
-            await context.bot.send_message(
-                chat_id=group_id,
-                text=f"🌆 Good evening {participants_str}! Just a friendly reminder to complete your challenge for today:\n\n🎯 <b>Challenge:</b> {challenge_text}\n\nMake sure to mark it as done before the deadline! Let's finish strong! 💪",
-                parse_mode='HTML'
-            )
-        except Exception as e:
-            await context.bot.send_message(
-            chat_id=os.getenv("ADMIN_TELEGRAM_USER_ID"),
-            text=f"Failed to send evening reminder to group {group_id}\n\nChallenge ID: {challenge_id}\nChallenge: {challenge_text}\nError: {e}",
-            parse_mode='HTML'
-            )
+    await _send_reminders(
+        "evening",
+        lambda participants_str, challenge_text: f"🌆 Good evening {participants_str}! Just a friendly reminder to complete your challenge for today:\n\n🎯 <b>Challenge:</b> {challenge_text}\n\nMake sure to mark it as done before the deadline! Let's finish strong! 💪",
+        group_ids,
+        timezone
+    )
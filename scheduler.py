@@ -0,0 +1,95 @@
+import json
+import logging
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+import pytz
+from telegram.ext import ContextTypes
+
+import db
+import remind
+import metrics
+import challenge
+import clear_challenges
+import constants as consts
+
+logger = logging.getLogger(__name__)
+
+# (hour, minute, job) in each group's local time. Jobs are called with the due groups' IDs
+# and their timezone; events due in the same tick run in this order.
+EVENTS = [
+    (consts.MORNING_REMINDER_HOUR, consts.MORNING_REMINDER_MINUTE, metrics.instrument(remind.send_morning_reminder)),
+    (consts.CHALLENGE_PREGENERATION_HOUR, consts.CHALLENGE_PREGENERATION_MINUTE, metrics.instrument(challenge.pregenerate_challenges)),
+    (consts.EVENING_REMINDER_HOUR, consts.EVENING_REMINDER_MINUTE, metrics.instrument(remind.send_evening_reminder)),
+    (consts.CHALLENGE_GENERATION_HOUR, consts.CHALLENGE_GENERATION_MINUTE, metrics.instrument(challenge.schedule_challenges)),
+    (consts.CHALLENGE_DEADLINE_HOUR, consts.CHALLENGE_DEADLINE_MINUTE, metrics.instrument(clear_challenges.fail_expiring_challenges)),
+    (consts.CHALLENGE_DEADLINE_HOUR, consts.CHALLENGE_DEADLINE_MINUTE, metrics.instrument(clear_challenges.fail_prizefights)),
+]
+
+# End of the window covered by the previous tick
+_last_tick = None
+
+
+async def get_groups_by_timezone():
+    """
+    Every group with goals or prize fights, bucketed by timezone.
+
+    Returns:
+        dict: timezone name -> list of group IDs
+    """
+    rows = await db.fetchall("""
+        SELECT COALESCE(gr.timezone, ?) AS timezone, json_group_array(s.group_id) AS group_ids
+        FROM (SELECT group_id FROM goals UNION SELECT group_id FROM prizefights) s
+        LEFT JOIN groups gr ON gr.group_id = s.group_id
+        GROUP BY 1
+    """, (consts.SCHEDULE_TIMEZONE,))
+
+    return {row["timezone"]: json.loads(row["group_ids"]) for row in rows}
+
+
+def is_due(hour, minute, tz, start, end):
+    """Whether hour:minute local time in tz falls within (start, end], both timezone-aware."""
+    for day in {start.astimezone(tz).date(), end.astimezone(tz).date()}:
+        at = tz.localize(datetime.combine(day, time(hour, minute)))
+        if start < at <= end:
+            return True
+    return False
+
+
+def seconds_until_next_tick():
+    """Delay before the first tick, so ticks land on the quarter hour (or whatever the tick length is)."""
+    interval = consts.SCHEDULER_TICK_MINUTES * 60
+    return interval - datetime.now(dt_timezone.utc).timestamp() % interval
+
+
+async def tick(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Run every job whose local time has arrived in some timezone since the previous tick.
+
+    Each job only processes the groups in the timezones it is due in, so groups spread across
+    timezones are handled in small batches through the day instead of all at once.
+    """
+    global _last_tick
+
+    now = datetime.now(dt_timezone.utc)
+    start = _last_tick or now - timedelta(minutes=consts.SCHEDULER_TICK_MINUTES)
+    _last_tick = now
+
+    groups_by_timezone = await get_groups_by_timezone()
+
+    for hour, minute, job in EVENTS:
+        for timezone, group_ids in groups_by_timezone.items():
+            try:
+                tz = pytz.timezone(timezone)
+            except pytz.UnknownTimeZoneError:
+                logger.error(f"Unknown timezone {timezone!r} for groups {group_ids}, using {consts.SCHEDULE_TIMEZONE}")
+                timezone = consts.SCHEDULE_TIMEZONE
+                tz = pytz.timezone(timezone)
+
+            if not is_due(hour, minute, tz, start, now):
+                continue
+
+            logger.info(f"Running {job.__name__} for {len(group_ids)} groups in {timezone}")
+            try:
+                await job(context, group_ids=group_ids, timezone=timezone)
+            except Exception:
+                logger.exception(f"{job.__name__} failed for groups in {timezone}")
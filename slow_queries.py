@@ -0,0 +1,170 @@
+import re
+import sys
+import time
+import logging
+import sqlite3
+import threading
+
+import constants as consts
+
+logger = logging.getLogger(__name__)
+
+# Statements worth asking SQLite for a plan; BEGIN/COMMIT/PRAGMA have none
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+
+# Per database thread: the function that issued the current db call, the statement being
+# timed and the slow statements waiting for EXPLAIN QUERY PLAN
+_local = threading.local()
+_lock = threading.Lock()
+
+# normalized SQL -> SlowQuery
+queries = {}
+
+
+def enabled():
+    return consts.SLOW_QUERY_THRESHOLD_MS > 0
+
+
+class SlowQuery:
+    def __init__(self, sql):
+        self.sql = sql
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.callers = {}
+        self.plan = None
+
+
+def normalize(sql):
+    """Statement text with literals replaced by ?, so the same query with different values aggregates together."""
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    return " ".join(sql.split())
+
+
+def find_caller():
+    """
+    Name of the function that called into db, e.g. "utils.get_pending_challenges".
+    Must be called on the event loop, from db.run or db.run_read.
+    """
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_globals.get("__name__") in ("db", __name__):
+        frame = frame.f_back
+    if frame is None:
+        return "unknown"
+    return f"{frame.f_globals.get('__name__')}.{frame.f_code.co_name}"
+
+
+def begin(caller):
+    """Start timing the statements of one db call on this thread."""
+    if not enabled():
+        return
+    _local.caller = caller
+    _local.current = None
+    _local.slow = []
+
+
+def trace(sql):
+    """
+    sqlite3 trace callback: called with the expanded SQL as each statement starts. A statement
+    is timed until the next one starts or the db call ends, so fetching its rows is included.
+    """
+    if getattr(_local, "explaining", False):
+        return
+    now = time.perf_counter()
+    _finish(now)
+    _local.current = (sql, now)
+
+
+def _finish(now):
+    current = getattr(_local, "current", None)
+    if current is None:
+        return
+    _local.current = None
+
+    sql, started = current
+    elapsed = now - started
+    if elapsed * 1000 >= consts.SLOW_QUERY_THRESHOLD_MS and hasattr(_local, "slow"):
+        _local.slow.append((sql, elapsed))
+
+
+def end(conn):
+    """Finish timing a db call and record its slow statements. Runs after fn's transaction has ended."""
+    if not enabled():
+        return
+    _finish(time.perf_counter())
+
+    slow = getattr(_local, "slow", [])
+    _local.slow = []
+    for sql, elapsed in slow:
+        _record(conn, sql, elapsed, getattr(_local, "caller", "unknown"))
+
+
+def explain(conn, sql):
+    """EXPLAIN QUERY PLAN output as an indented tree, or None if SQLite can't plan the statement."""
+    if not _EXPLAINABLE.match(sql):
+        return None
+
+    _local.explaining = True
+    try:
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    except sqlite3.Error as e:
+        return f"(no plan: {e})"
+    finally:
+        _local.explaining = False
+
+    depths = {0: -1}
+    lines = []
+    for node_id, parent_id, _, detail in rows:
+        depths[node_id] = depths.get(parent_id, -1) + 1
+        lines.append("  " * depths[node_id] + detail)
+    return "\n".join(lines)
+
+
+def _record(conn, sql, elapsed, caller):
+    key = normalize(sql)
+
+    with _lock:
+        query = queries.get(key)
+        if query is None:
+            query = queries[key] = SlowQuery(key)
+        query.count += 1
+        query.total_seconds += elapsed
+        query.max_seconds = max(query.max_seconds, elapsed)
+        query.callers[caller] = query.callers.get(caller, 0) + 1
+        needs_plan = query.plan is None
+
+    # The plan depends on the statement's shape, not its values, so it's captured once
+    plan = query.plan
+    if needs_plan:
+        plan = query.plan = explain(conn, sql) or ""
+
+    logger.warning(
+        f"Slow query ({elapsed * 1000:.0f} ms) from {caller}: {' '.join(sql.split())[:500]}"
+        + (f"\nQuery plan:\n{plan}" if plan else "")
+    )
+
+
+def report(top=consts.SLOW_QUERY_REPORT_TOP):
+    """The slowest statements by total time, with their callers and plans, as plain text."""
+    with _lock:
+        slowest = sorted(queries.values(), key=lambda query: query.total_seconds, reverse=True)[:top]
+        entries = [(query, dict(query.callers)) for query in slowest]
+
+    if not entries:
+        return f"No statements over {consts.SLOW_QUERY_THRESHOLD_MS:g} ms so far."
+
+    blocks = []
+    for query, callers in entries:
+        caller_text = ", ".join(f"{name} ({count})" for name, count in sorted(callers.items(), key=lambda item: -item[1]))
+        lines = [
+            f"{query.total_seconds * 1000:.0f} ms total, {query.count}x, max {query.max_seconds * 1000:.0f} ms",
+            f"from {caller_text}",
+            query.sql[:300],
+        ]
+        if query.plan:
+            lines.append(query.plan)
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
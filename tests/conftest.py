@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The bot's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# constants.py reads this at import time
+os.environ.setdefault("ADMIN_TELEGRAM_USER_ID", "0")
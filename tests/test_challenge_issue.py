@@ -0,0 +1,33 @@
+import pytest
+
+import db
+import challenge
+import migrations
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = db.connect(str(tmp_path / "goals.db"))
+    migrations.bootstrap(conn)
+    conn.execute("INSERT INTO groups (group_id, group_name) VALUES (1, 'Group')")
+    conn.execute("INSERT INTO users (user_id, display_name) VALUES (10, 'Ann')")
+    conn.execute("INSERT INTO goals (id, group_id, goal) VALUES (100, 1, 'Get fit')")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_second_run_for_the_same_night_issues_nothing(conn):
+    users = [{"user_id": 10, "name": "Ann"}]
+
+    with conn:
+        first = challenge._issue_challenge(conn, 100, "Run 5km", users, "2026-10-17")
+    with conn:
+        again = challenge._issue_challenge(conn, 100, "Run 10km", users, "2026-10-17")
+    with conn:
+        next_night = challenge._issue_challenge(conn, 100, "Swim 1km", users, "2026-10-18")
+
+    assert first is not None
+    assert again is None
+    assert next_night is not None
+    assert [row["description"] for row in conn.execute("SELECT description FROM challenges ORDER BY id")] == ["Run 5km", "Swim 1km"]
@@ -0,0 +1,108 @@
+import time
+import asyncio
+import sqlite3
+
+import pytest
+
+import db
+import constants as consts
+
+READERS = 32
+READS_PER_READER = 50
+
+
+@pytest.fixture
+def goals_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(consts, "GOALS_DB_SQLITE", str(tmp_path / "goals.db"))
+    conn = db.connect()
+    conn.executescript("""
+        CREATE TABLE ledger (id INTEGER PRIMARY KEY, amount INTEGER NOT NULL);
+        CREATE TABLE balance (total INTEGER NOT NULL);
+        INSERT INTO balance VALUES (0);
+    """)
+    conn.close()
+    yield
+    asyncio.run(db.close())
+
+
+def _deposit(conn, amount):
+    conn.execute("INSERT INTO ledger (amount) VALUES (?)", (amount,))
+    conn.execute("UPDATE balance SET total = total + ?", (amount,))
+
+
+def test_concurrent_reads_during_writes(goals_db):
+    async def main():
+        assert (await db.fetchone("PRAGMA journal_mode"))[0] == "wal"
+
+        stop = asyncio.Event()
+        writes = 0
+
+        async def writer():
+            nonlocal writes
+            while not stop.is_set():
+                await db.run(_deposit, 1)
+                writes += 1
+
+        async def reader():
+            snapshots = []
+            for _ in range(READS_PER_READER):
+                row = await db.fetchone("""
+                    SELECT (SELECT total FROM balance) AS total,
+                           (SELECT COALESCE(SUM(amount), 0) FROM ledger) AS ledger_sum
+                """)
+                snapshots.append((row["total"], row["ledger_sum"]))
+            return snapshots
+
+        writer_task = asyncio.create_task(writer())
+        try:
+            # Raises if any read failed with "database is locked" / SQLITE_BUSY
+            results = await asyncio.gather(*(reader() for _ in range(READERS)))
+        finally:
+            stop.set()
+            await writer_task
+
+        for snapshots in results:
+            # Each read sees both tables as of the same committed transaction...
+            assert all(total == ledger_sum for total, ledger_sum in snapshots)
+            # ...and never goes back in time
+            assert [total for total, _ in snapshots] == sorted(total for total, _ in snapshots)
+
+        assert writes > 0
+        assert (await db.fetchone("SELECT total FROM balance"))["total"] == writes
+
+    asyncio.run(main())
+
+
+def _slow_read(conn):
+    conn.execute("SELECT 1").fetchone()
+    time.sleep(0.2)
+    return conn.execute("SELECT 2").fetchone()[0]
+
+
+def test_close_waits_for_running_calls(goals_db):
+    async def main():
+        pending = asyncio.create_task(db.run_read(_slow_read))
+        await asyncio.sleep(0.05)
+        await db.close()
+
+        assert await pending == 2
+        # The pool reopens on the next call
+        assert (await db.fetchone("SELECT total FROM balance"))["total"] == 0
+
+    asyncio.run(main())
+
+
+def test_read_only_connection_leaves_the_file_alone(tmp_path):
+    path = str(tmp_path / "other.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.commit()
+    conn.close()
+
+    reader = db.connect(path, read_only=True)
+    try:
+        assert reader.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            reader.execute("INSERT INTO t VALUES (1)")
+    finally:
+        reader.close()
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+import db
+import utils
+import challenge
+import migrations
+
+
+class _RecordingConnection:
+    """Runs statements on the real connection and remembers them for EXPLAIN QUERY PLAN."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.statements = []
+
+    def execute(self, sql, params=()):
+        self.statements.append((sql, params))
+        return self.conn.execute(sql, params)
+
+
+@pytest.fixture
+def recorder(tmp_path, monkeypatch):
+    conn = db.connect(str(tmp_path / "goals.db"))
+    migrations.bootstrap(conn)
+    recording = _RecordingConnection(conn)
+
+    async def run(fn, *args):
+        return fn(recording, *args)
+
+    # The helpers' queries run inline on the bootstrapped database instead of the DB threads
+    monkeypatch.setattr(db, "run", run)
+    monkeypatch.setattr(db, "run_read", run)
+    yield recording
+    conn.close()
+
+
+async def _drain(rows):
+    return [row async for row in rows]
+
+
+def plan(recorder, call):
+    """Run call() and return the EXPLAIN QUERY PLAN details of every statement it issued."""
+    recorder.statements.clear()
+    asyncio.run(call())
+    return [
+        [row["detail"] for row in recorder.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        for sql, params in recorder.statements
+    ]
+
+
+# (helper call, statement index, index each statement must search)
+HOT_QUERIES = [
+    ("get_active_participanting_goals", lambda: utils.get_active_participanting_goals(1, 2), 0, "idx_goals_group_status"),
+    ("get_active_non_participanting_goal_ids", lambda: utils.get_active_non_participanting_goal_ids(1, 2), 0, "idx_goals_group_status"),
+    ("get_active_non_participanting_goal_ids", lambda: utils.get_active_non_participanting_goal_ids(1, 2), 0, "idx_goal_members_user"),
+    ("get_pending_challenges", lambda: utils.get_pending_challenges(1, 2), 0, "idx_challenge_responses_status"),
+    ("get_completed_unvalidated_challenges", utils.get_completed_unvalidated_challenges, 0, "idx_challenge_responses_status"),
+    ("get_past_challenges", lambda: utils.get_past_challenges(1), 0, "idx_challenges_goal_rejected_created"),
+    ("expire_overdue_challenges", utils.expire_overdue_challenges, 0, "idx_challenge_responses_status"),
+    ("get_pending_prizefights", utils.get_pending_prizefights, 0, "idx_prizefight_participants_status"),
+    ("get_goals_to_challenge", challenge.get_goals_to_challenge, 0, "idx_goals_status"),
+    ("iter_challenges_to_remind", lambda: _drain(utils.iter_challenges_to_remind()), 0, "idx_challenges_created"),
+]
+
+
+@pytest.mark.parametrize("name, call, statement, index", HOT_QUERIES, ids=[f"{q[0]}-{q[3]}" for q in HOT_QUERIES])
+def test_hot_query_searches_index(recorder, name, call, statement, index):
+    details = plan(recorder, call)[statement]
+
+    assert any(
+        detail.startswith("SEARCH ") and (f"USING INDEX {index} " in detail or f"USING COVERING INDEX {index} " in detail)
+        for detail in details
+    ), f"{name} does not search {index}:\n" + "\n".join(details)
+
+
+@pytest.mark.parametrize("name, call", {q[0]: q[1] for q in HOT_QUERIES}.items())
+def test_hot_query_never_scans_a_table(recorder, name, call):
+    for details in plan(recorder, call):
+        # json_each is the group_ids list, not a table
+        scans = [detail for detail in details if detail.startswith("SCAN ") and "VIRTUAL TABLE" not in detail]
+        assert not scans, f"{name} scans a table:\n" + "\n".join(details)
@@ -0,0 +1,121 @@
+import json
+from collections import OrderedDict
+
+import db
+import metrics
+import constants as consts
+
+
+def format_display_name(username, display_name):
+    """Same rule as the SQL CASE expression: "@username" if the user has one, else their first name."""
+    return f"@{username}" if username else display_name
+
+
+class UserCache:
+    """
+    In-process LRU cache of user_id -> display name, plus display name -> user_id for
+    prizefight lookups. Misses are loaded from the users table in bulk, and entries are
+    refreshed by upsert_user_and_group whenever a user's Telegram details change.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._names = OrderedDict()
+        self._user_ids = {}
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, user_id, username, display_name):
+        """Cache a user's current details, replacing anything cached for them before."""
+        self.invalidate(user_id)
+
+        name = format_display_name(username, display_name)
+        self._names[user_id] = name
+        self._user_ids[name] = user_id
+
+        while len(self._names) > self.max_size:
+            evicted_id, evicted_name = self._names.popitem(last=False)
+            if self._user_ids.get(evicted_name) == evicted_id:
+                del self._user_ids[evicted_name]
+
+    def invalidate(self, user_id):
+        """Drop a user from the cache."""
+        name = self._names.pop(user_id, None)
+        if name is not None and self._user_ids.get(name) == user_id:
+            del self._user_ids[name]
+
+    async def get_names(self, user_ids):
+        """
+        Resolve display names for many users, loading every miss with a single query.
+
+        Args:
+            user_ids: Iterable of Telegram user IDs
+
+        Returns:
+            dict: user_id -> display name, for users that exist
+        """
+        names = {}
+        missing = []
+
+        for user_id in dict.fromkeys(user_ids):
+            if user_id in self._names:
+                self._names.move_to_end(user_id)
+                names[user_id] = self._names[user_id]
+                self.hits += 1
+            else:
+                missing.append(user_id)
+                self.misses += 1
+
+        if missing:
+            rows = await db.fetchall("""
+                SELECT user_id, username, display_name
+                FROM users
+                WHERE user_id IN (SELECT value FROM json_each(?))
+            """, (json.dumps(missing),))
+
+            for row in rows:
+                self.put(row["user_id"], row["username"], row["display_name"])
+                names[row["user_id"]] = self._names[row["user_id"]]
+
+        return names
+
+    async def get_name(self, user_id):
+        """Display name for one user, or None if they are unknown."""
+        return (await self.get_names([user_id])).get(user_id)
+
+    async def get_user_id(self, display_name):
+        """
+        Find the user behind a display name ("@username" or first name).
+
+        Returns:
+            int: The user ID, or None if no user matches
+        """
+        user_id = self._user_ids.get(display_name)
+        if user_id is not None:
+            self.hits += 1
+            return user_id
+
+        self.misses += 1
+        row = await db.fetchone("""
+            SELECT u.user_id, u.username, u.display_name
+            FROM users u
+            WHERE (u.username = ? OR u.display_name = ?)
+        """, (display_name.lstrip('@'), display_name))
+
+        if not row:
+            return None
+
+        self.put(row["user_id"], row["username"], row["display_name"])
+        return row["user_id"]
+
+    def stats(self):
+        return {
+            "size": len(self._names),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+users = UserCache(consts.USER_CACHE_SIZE)
+# Looked up on each call, so the hit rate follows the cache if users is replaced
+metrics.register_cache("user_names", lambda: users.stats())
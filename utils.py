@@ -1,45 +1,139 @@
+import json
+import time
+import asyncio
 import sqlite3
 import logging
+from collections import OrderedDict
+from datetime import datetime, time as dt_time, timedelta
+import pytz
+import db
+import user_cache
 import constants as consts
 
 logger = logging.getLogger(__name__)
 
-async def upsert_user_and_group(user, group):
-    """Insert or update user, group, and group membership information in the database."""
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        cursor = conn.cursor()
+# (user_id, group_id, username, first_name) -> expiry time of tuples recently written
+_recent_upserts = OrderedDict()
+# Rows waiting for the next batched flush, keyed like _recent_upserts
+_pending_upserts = {}
+_upsert_flush = None
+# Flush tasks still running; the event loop only keeps weak references to tasks
+_upsert_flush_tasks = set()
 
-        # Insert or update user
+def _write_upserts(conn, rows):
+    """Write a batch of (user_id, username, first_name, group_id, group_title) rows. Returns the user IDs whose details changed."""
+    cursor = conn.cursor()
+    changed_user_ids = []
+
+    for user_id, username, first_name, group_id, group_title in rows:
+
+        # Insert or update user, only writing when their Telegram details changed
         cursor.execute(
             """
             INSERT INTO users (user_id, username, display_name)
             VALUES (?, ?, ?)
-            ON CONFLICT(user_id) DO NOTHING
+            ON CONFLICT(user_id) DO UPDATE SET
+                username = excluded.username,
+                display_name = excluded.display_name,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE users.username IS NOT excluded.username
+            OR users.display_name IS NOT excluded.display_name
             """,
-            (user.id, user.username, user.first_name)
+            (user_id, username, first_name)
         )
+        if cursor.rowcount > 0:
+            changed_user_ids.append(user_id)
+
+    # Insert or update group
+    cursor.executemany(
+        """
+        INSERT INTO groups (group_id, group_name)
+        VALUES (?, ?)
+        ON CONFLICT(group_id) DO NOTHING
+        """,
+        {(group_id, group_title) for _, _, _, group_id, group_title in rows}
+    )
+
+    # Insert or update group membership
+    cursor.executemany(
+        """
+        INSERT INTO group_members (group_id, user_id)
+        VALUES (?, ?)
+        ON CONFLICT(group_id, user_id) DO NOTHING
+        """,
+        [(group_id, user_id) for user_id, _, _, group_id, _ in rows]
+    )
+
+    return changed_user_ids
+
+async def _flush_upserts():
+    """Write every pending upsert in one transaction and wake up the handlers waiting on it."""
+    global _pending_upserts, _upsert_flush
+
+    pending, flush = _pending_upserts, _upsert_flush
+    _pending_upserts, _upsert_flush = {}, None
 
-        # Insert or update group
-        cursor.execute(
-            """
-            INSERT INTO groups (group_id, group_name)
-            VALUES (?, ?)
-            ON CONFLICT(group_id) DO NOTHING
-            """,
-            (group.id, group.title)
-        )
+    try:
+        changed_user_ids = set(await db.run(_write_upserts, list(pending.values())))
+    except Exception as e:
+        logger.error(f"Database error flushing {len(pending)} user upserts: {e}")
+        flush.set_exception(e)
+        # Already logged; mark it retrieved so callers that didn't wait don't trigger a second warning
+        flush.exception()
+        return
+
+    expires_at = time.monotonic() + consts.UPSERT_MEMO_TTL
+    for key, (user_id, username, first_name, _, _) in pending.items():
+        _recent_upserts[key] = expires_at
+        _recent_upserts.move_to_end(key)
+        if user_id in changed_user_ids:
+            user_cache.users.put(user_id, username, first_name)
+
+    while len(_recent_upserts) > consts.UPSERT_MEMO_SIZE:
+        _recent_upserts.popitem(last=False)
+
+    flush.set_result(None)
+
+def _start_upsert_flush():
+    task = asyncio.ensure_future(_flush_upserts())
+    _upsert_flush_tasks.add(task)
+    task.add_done_callback(_upsert_flush_done)
+
+def _upsert_flush_done(task):
+    _upsert_flush_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Unexpected error flushing user upserts", exc_info=task.exception())
+
+async def upsert_user_and_group(user, group, wait=True):
+    """
+    Insert or update user, group, and group membership information in the database.
 
-        # Insert or update group membership
-        cursor.execute(
-            """
-            INSERT INTO group_members (group_id, user_id)
-            VALUES (?, ?)
-            ON CONFLICT(group_id, user_id) DO NOTHING
-            """,
-            (group.id, user.id)
-        )
+    Skips the database entirely when the same user/group/name details were written within
+    UPSERT_MEMO_TTL. New or changed rows are coalesced with other handlers' upserts into one
+    transaction, written up to UPSERT_FLUSH_DELAY later.
+
+    Args:
+        wait (bool): Return once the row is committed. Handlers that go on to write rows
+                     referencing the user or group, or read them back, need this; the rest
+                     pass False and don't pay the flush delay.
+    """
+    global _upsert_flush
 
-        conn.commit()
+    key = (user.id, group.id, user.username, user.first_name)
+    expires_at = _recent_upserts.get(key)
+    if expires_at is not None and expires_at > time.monotonic():
+        return
+
+    _pending_upserts[key] = (user.id, user.username, user.first_name, group.id, group.title)
+
+    if _upsert_flush is None:
+        loop = asyncio.get_running_loop()
+        _upsert_flush = loop.create_future()
+        loop.call_later(consts.UPSERT_FLUSH_DELAY, _start_upsert_flush)
+
+    if wait:
+        # Shield so a cancelled handler doesn't cancel the flush for everyone else
+        await asyncio.shield(_upsert_flush)
 
 def get_display_name_from_telegram_user(user):
     """
@@ -78,463 +172,508 @@ def format_names_list(names):
     else:
         return ", ".join(names[:-1]) + f", and {names[-1]}"
 
-def get_active_participanting_goals(group_id, user_id):
-
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT g.id, g.goal
-            FROM goals g
-            JOIN goal_members gm ON g.id = gm.goal_id
-            WHERE g.group_id = ? AND gm.user_id = ? AND g.status = 'active'
-        """, (group_id, user_id))
-        goals = cursor.fetchall()
-        return goals
-    
-def get_active_non_participanting_goal_ids(group_id, user_id):
-
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT g.id, g.goal 
-            FROM goals g
-            WHERE g.group_id = ? 
-            AND g.status = 'active'
-            AND g.id NOT IN (
-                SELECT goal_id FROM goal_members WHERE user_id = ?
-            )
-        """, (group_id, user_id))
-        available_goals = cursor.fetchall()
-
-        return available_goals
-    
-def get_pending_challenges(group_id, user_id):
-
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT c.id, c.goal_id, c.description, c.due_date, c.created_at, c.rejected, cr.id as challenge_response_id
-            FROM challenges c
-            JOIN challenge_responses cr ON c.id = cr.challenge_id
-            JOIN goals g on c.goal_id = g.id
-            WHERE cr.user_id = ? AND cr.status = 'pending' AND c.rejected = 0 AND g.group_id = ?
-        """, (user_id, group_id))
-
-        pending_challenges = cursor.fetchall()
-
-        return pending_challenges
-    
-def get_completed_unvalidated_challenges():
-
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT cr.id as challenge_response_id, cr.challenge_id, cr.completed_at, c.description, c.goal_id, cr.user_id
-            FROM challenge_responses cr
-            JOIN challenges c ON cr.challenge_id = c.id
-            WHERE cr.status = 'completed' AND cr.validated = 0
-        """)
+def optional_json_list(values):
+    """Bind an optional list of IDs for "(?1 IS NULL OR x IN (SELECT value FROM json_each(?1)))" filters."""
+    return None if values is None else json.dumps(list(values))
+
+async def get_group_timezone(group_id):
+    """The group's timezone name, or consts.SCHEDULE_TIMEZONE if it hasn't set one."""
+    row = await db.fetchone("SELECT timezone FROM groups WHERE group_id = ?", (group_id,))
+    return (row["timezone"] if row else None) or consts.SCHEDULE_TIMEZONE
+
+async def set_group_timezone(group_id, timezone):
+    await db.execute("""
+        UPDATE groups
+        SET timezone = ?
+        WHERE group_id = ?
+    """, (timezone, group_id))
+
+async def get_active_participanting_goals(group_id, user_id):
+
+    return await db.fetchall("""
+        SELECT g.id, g.goal
+        FROM goals g
+        JOIN goal_members gm ON g.id = gm.goal_id
+        WHERE g.group_id = ? AND gm.user_id = ? AND g.status = 'active'
+    """, (group_id, user_id))
+
+async def get_active_non_participanting_goal_ids(group_id, user_id):
+
+    return await db.fetchall("""
+        SELECT g.id, g.goal
+        FROM goals g
+        WHERE g.group_id = ?
+        AND g.status = 'active'
+        AND g.id NOT IN (
+            SELECT goal_id FROM goal_members WHERE user_id = ?
+        )
+    """, (group_id, user_id))
+
+async def get_pending_challenges(group_id, user_id):
+
+    return await db.fetchall("""
+        SELECT c.id, c.goal_id, c.description, c.due_date, c.created_at, c.rejected, cr.id as challenge_response_id
+        FROM challenges c
+        JOIN challenge_responses cr ON c.id = cr.challenge_id
+        JOIN goals g on c.goal_id = g.id
+        WHERE cr.user_id = ? AND cr.status = 'pending' AND c.rejected = 0 AND g.group_id = ?
+    """, (user_id, group_id))
+
+async def get_completed_unvalidated_challenges():
+
+    return await db.fetchall("""
+        SELECT cr.id as challenge_response_id, cr.challenge_id, cr.completed_at, c.description, c.goal_id, cr.user_id
+        FROM challenge_responses cr
+        JOIN challenges c ON cr.challenge_id = c.id
+        WHERE cr.status = 'completed' AND cr.validated = 0
+    """)
+
+async def get_challenge_from_challenge_response_id(challenge_response_id):
+
+    return await db.fetchone("""
+        SELECT cr.id as challenge_response_id, cr.challenge_id, cr.completed_at, c.description, c.goal_id, cr.user_id
+        FROM challenge_responses cr
+        JOIN challenges c ON cr.challenge_id = c.id
+        WHERE cr.id = ?
+    """, (challenge_response_id,))
+
+async def get_members_in_goal(goal_id):
+
+    rows = await db.fetchall("""
+        SELECT gm.user_id, g.group_id
+        FROM goal_members gm
+        JOIN goals g ON gm.goal_id = g.id
+        WHERE gm.goal_id = ?
+    """, (goal_id,))
+
+    names = await user_cache.users.get_names(r["user_id"] for r in rows)
+
+    return [
+        {"user_id": r["user_id"], "name": names[r["user_id"]], "group_id": r["group_id"]}
+        for r in rows if r["user_id"] in names
+    ]
+
+async def get_group_id_by_goal_id(goal_id):
+    goal = await db.fetchone("""
+        SELECT group_id
+        FROM goals
+        WHERE id = ?
+    """, (goal_id,))
+
+    if goal:
+        return goal["group_id"]
+    else:
+        return None
 
-        completed_challenges = cursor.fetchall()
+async def get_group_id_by_prize_fight_id(prize_fight_id):
+    """Get group_id from a prizefight ID."""
+    prizefight = await db.fetchone("""
+        SELECT group_id
+        FROM prizefights
+        WHERE id = ?
+    """, (prize_fight_id,))
+
+    if prizefight:
+        return prizefight["group_id"]
+    else:
+        return None
 
-        return completed_challenges
-    
-def get_challenge_from_challenge_response_id(challenge_response_id):
+async def get_user_display_name_by_challenge_response_id(challenge_response_id):
+    response = await db.fetchone("""
+        SELECT user_id
+        FROM challenge_responses
+        WHERE id = ?
+    """, (challenge_response_id,))
 
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT cr.id as challenge_response_id, cr.challenge_id, cr.completed_at, c.description, c.goal_id, cr.user_id
-            FROM challenge_responses cr
-            JOIN challenges c ON cr.challenge_id = c.id
-            WHERE cr.id = ?
-        """, (challenge_response_id,))
+    if response:
+        return await user_cache.users.get_name(response["user_id"])
+    else:
+        return None
 
-        completed_challenges = cursor.fetchone()
+async def mark_challenge_as_validated(challenge_response_id):
+    await db.execute("""
+        UPDATE challenge_responses
+        SET validated = 1, validated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    """, (challenge_response_id,))
 
-        return completed_challenges
+async def mark_challenge_as_rejected(challenge_response_id):
+    await db.execute("""
+        UPDATE challenge_responses
+        SET status = 'rejected', validated = 0, validated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    """, (challenge_response_id,))
+
+async def goal_id_from_challenge_response_id_and_user_id(challenge_response_id, user_id):
+    result = await db.fetchone("""
+        SELECT c.goal_id
+        FROM challenges c
+        JOIN challenge_responses cr ON c.id = cr.challenge_id
+        WHERE cr.id = ? AND cr.user_id = ?
+    """, (challenge_response_id, user_id))
 
-def get_members_in_goal(goal_id):
+    if result:
+        return result["goal_id"]
+    else:
+        return None
 
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT u.user_id, 
-                CASE 
-                    WHEN u.username IS NOT NULL THEN '@' || u.username
-                    ELSE u.display_name
-                END AS name,
-                g.group_id    
-            FROM users u
-            JOIN goal_members gm ON u.user_id = gm.user_id
-            JOIN goals g ON gm.goal_id = g.id
-            WHERE gm.goal_id = ?
-        """, (goal_id,))
-
-        members = cursor.fetchall()
-
-        return members
-    
-def get_group_id_by_goal_id(goal_id):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT group_id
-            FROM goals
-            WHERE id = ?
-        """, (goal_id,))
-
-        goal = cursor.fetchone()
-
-        if goal:
-            return goal["group_id"]
-        else:
-            return None
-
-def get_group_id_by_prize_fight_id(prize_fight_id):
-    """Get group_id from a prizefight ID."""
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT group_id
-            FROM prizefights
-            WHERE id = ?
-        """, (prize_fight_id,))
+async def get_goal_id_from_challenge_id(challenge_id):
+    result = await db.fetchone("""
+        SELECT c.goal_id
+        FROM challenges c
+        WHERE c.id = ?
+    """, (challenge_id,))
 
-        prizefight = cursor.fetchone()
+    if result:
+        return result["goal_id"]
+    else:
+        return None
 
-        if prizefight:
-            return prizefight["group_id"]
-        else:
-            return None
-
-def get_user_display_name_by_challenge_response_id(challenge_response_id):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT u.user_id, 
-                CASE 
-                    WHEN u.username IS NOT NULL THEN '@' || u.username
-                    ELSE u.display_name
-                END AS name
-            FROM users u
-            JOIN challenge_responses cr ON u.user_id = cr.user_id
-            WHERE cr.id = ?
-        """, (challenge_response_id,))
-
-        user = cursor.fetchone()
-
-        if user:
-            return user["name"]
-        else:
-            return None
-        
-async def mark_challenge_as_validated(challenge_response_id):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE challenge_responses
-            SET validated = 1, validated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (challenge_response_id,))
-        conn.commit()
+async def get_display_name_from_user_id(user_id):
+    name = await user_cache.users.get_name(user_id)
 
-async def mark_challenge_as_rejected(challenge_response_id):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE challenge_responses
-            SET status = 'rejected', validated = 0, validated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (challenge_response_id,))
-        conn.commit()
-
-def goal_id_from_challenge_response_id_and_user_id(challenge_response_id, user_id):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT c.goal_id
-            FROM challenges c
-            JOIN challenge_responses cr ON c.id = cr.challenge_id
-            WHERE cr.id = ? AND cr.user_id = ?
-        """, (challenge_response_id, user_id))
+    if name is not None:
+        return {"user_id": user_id, "name": name}
+    else:
+        return None
 
-        result = cursor.fetchone()
+async def get_user_id_from_display_name(display_name):
+    user_id = await user_cache.users.get_user_id(display_name)
 
-    if result:
-        return result["goal_id"]
+    if user_id is not None:
+        return {"user_id": user_id}
     else:
         return None
-        
-def get_goal_id_from_challenge_id(challenge_id):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT c.goal_id
-            FROM challenges c
-            WHERE c.id = ?
-        """, (challenge_id,))
 
-        result = cursor.fetchone()
+async def get_username_from_user_id(user_id):
+    result = await db.fetchone("""
+        SELECT *
+        FROM users u
+        WHERE u.user_id = ?
+    """, (user_id,))
 
     if result:
-            return result["goal_id"]
+        return result
     else:
         return None
-        
-def get_display_name_from_user_id(user_id):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT u.user_id,
-                CASE 
-                    WHEN u.username IS NOT NULL THEN '@' || u.username
-                    ELSE u.display_name
-                END AS name
-            FROM users u
-            WHERE u.user_id = ?
-        """, (user_id,))
-
-        result = cursor.fetchone()
-
-        if result:
-            return result
-        else:
-            return None
-        
-def get_user_id_from_display_name(display_name):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT u.user_id
-            FROM users u
-            WHERE (u.username = ? OR u.display_name = ?)
-        """, (display_name.lstrip('@'), display_name))
-
-        result = cursor.fetchone()
-
-        if result:
-            return result
-        else:
-            return None
-        
-def get_username_from_user_id(user_id):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT *
-            FROM users u
-            WHERE u.user_id = ?
-        """, (user_id,))
-
-        result = cursor.fetchone()
-
-        if result:
-            return result
-        else:
-            return None
-        
-def get_challenge_accepted_participants(challenge_id):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT cr.*,
-                CASE 
-                    WHEN u.username IS NOT NULL THEN '@' || u.username
-                    ELSE u.display_name
-                END AS name
-            FROM challenge_responses cr
-            JOIN users u ON cr.user_id = u.user_id
-            WHERE cr.challenge_id = ? AND cr.status = 'issued'
-        """, (challenge_id,))
 
-        result = cursor.fetchall()
+async def get_challenge_accepted_participants(challenge_id):
+    rows = await db.fetchall("""
+        SELECT cr.*
+        FROM challenge_responses cr
+        WHERE cr.challenge_id = ? AND cr.status = 'issued'
+    """, (challenge_id,))
+
+    names = await user_cache.users.get_names(r["user_id"] for r in rows)
+
+    return [
+        {**dict(r), "name": names[r["user_id"]]}
+        for r in rows if r["user_id"] in names
+    ]
+
+async def get_goal_starting_date(goal_id):
+    return await db.fetchone("""
+        SELECT created_at
+        FROM goals
+        WHERE id = ?
+    """, (goal_id,))
+
+async def get_past_challenges(goal_id, limit = 7):
+    return await db.fetchall("""
+        SELECT *
+        FROM challenges
+        WHERE goal_id = ? AND rejected = 0
+        ORDER BY created_at DESC
+        LIMIT ?
+    """, (goal_id, limit))
+
+async def get_user_goal_stats(user_id, group_id):
+    """
+    A user's streak and completion counters for each active goal they're in, in this group.
 
-    return result
+    Returns:
+        list: Rows with goal, issued_count, completed_count, failed_count, current_streak and best_streak
+    """
+    return await db.fetchall("""
+        SELECT g.goal,
+               COALESCE(s.issued_count, 0) AS issued_count,
+               COALESCE(s.completed_count, 0) AS completed_count,
+               COALESCE(s.failed_count, 0) AS failed_count,
+               COALESCE(s.current_streak, 0) AS current_streak,
+               COALESCE(s.best_streak, 0) AS best_streak
+        FROM goal_members gm
+        JOIN goals g ON g.id = gm.goal_id
+        LEFT JOIN user_goal_stats s ON s.user_id = gm.user_id AND s.goal_id = gm.goal_id
+        WHERE gm.user_id = ? AND g.group_id = ? AND g.status = 'active'
+        ORDER BY g.created_at
+    """, (user_id, group_id))
+
+async def get_goal_streaks(goal_ids):
+    """
+    The longest current streak among each goal's members.
+
+    Returns:
+        dict: goal_id -> streak in days, for goals with any stats
+    """
+    rows = await db.fetchall("""
+        SELECT goal_id, MAX(current_streak) AS streak
+        FROM user_goal_stats
+        WHERE goal_id IN (SELECT value FROM json_each(?))
+        GROUP BY goal_id
+    """, (json.dumps(list(goal_ids)),))
+
+    return {row["goal_id"]: row["streak"] for row in rows}
+
+# Start of the current leaderboard period, computed the same way as the leaderboard triggers
+_LEADERBOARD_PERIOD_STARTS = {
+    "week": "DATE('now', 'weekday 0', '-6 days')",
+    "month": "DATE('now', 'start of month')",
+    "all": "''",
+}
+
+async def get_leaderboard(group_id, period, limit=consts.LEADERBOARD_SIZE):
+    """
+    A group's top members for the current week, month or all time, from leaderboard_scores.
+
+    Args:
+        period (str): "week", "month" or "all"
 
-def get_goal_starting_date(goal_id):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT created_at
-            FROM goals 
-            WHERE id = ?
-        """, (goal_id,))
+    Returns:
+        list: Dicts with user_id, name, challenges_completed, prizefights_won and points, best first
+    """
+    rows = await db.fetchall(f"""
+        SELECT user_id, challenges_completed, prizefights_won,
+               challenges_completed * ? + prizefights_won * ? AS points
+        FROM leaderboard_scores
+        WHERE group_id = ? AND period = ? AND period_start = {_LEADERBOARD_PERIOD_STARTS[period]}
+        ORDER BY points DESC, challenges_completed DESC, user_id
+        LIMIT ?
+    """, (consts.LEADERBOARD_CHALLENGE_POINTS, consts.LEADERBOARD_PRIZEFIGHT_POINTS, group_id, period, limit))
+
+    names = await user_cache.users.get_names(row["user_id"] for row in rows)
+
+    return [
+        {**dict(row), "name": names.get(row["user_id"], "Unknown")}
+        for row in rows
+    ]
+
+def last_challenge_run(timezone=None, now=None):
+    """
+    When the most recent nightly challenge run was due in the timezone, as a UTC timestamp
+    in the same format as CURRENT_TIMESTAMP, so it compares directly against created_at.
 
-        result = cursor.fetchone()
+    Args:
+        timezone (str): Group timezone, defaults to consts.SCHEDULE_TIMEZONE
+        now (datetime): Timezone-aware current time, for tests
+    """
+    tz = pytz.timezone(timezone or consts.SCHEDULE_TIMEZONE)
+    local_now = (now or datetime.now(pytz.utc)).astimezone(tz)
+    time_of_day = dt_time(consts.CHALLENGE_GENERATION_HOUR, consts.CHALLENGE_GENERATION_MINUTE)
 
-    return result
+    run_at = tz.localize(datetime.combine(local_now.date(), time_of_day))
+    if run_at > local_now:
+        run_at = tz.localize(datetime.combine(local_now.date() - timedelta(days=1), time_of_day))
 
-def get_past_challenges(goal_id, limit = 7):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT *
-            FROM challenges 
-            WHERE goal_id = ? AND rejected = 0
-            ORDER BY created_at DESC
-            LIMIT ? 
-        """, (goal_id, limit))
+    return run_at.astimezone(pytz.utc).strftime("%Y-%m-%d %H:%M:%S")
 
-        result = cursor.fetchall()
+async def iter_challenges_to_remind(batch_size=consts.REMINDER_BATCH_SIZE, group_ids=None, timezone=None):
+    """
+    Stream challenges issued since the groups' last nightly run, with everything a reminder needs.
+    Pass group_ids to only include those groups' challenges, and their timezone so the window
+    starts at that run in local time; older challenges have already expired.
 
-    return result
+    One query per page returns the challenge, its group and a JSON array of the display
+    names of participants who have not completed it yet. Pages are fetched by keyset on
+    (created_at, id), so only one page is held at a time however many challenges there are.
 
-def get_challenges_issued_yesterday():
+    Yields:
+        sqlite3.Row: id, goal_id, description, group_id (None if the goal is gone) and participants
+    """
+    since = last_challenge_run(timezone)
+    last_created_at, last_id = "", 0
+
+    while True:
+        rows = await db.fetchall("""
+            SELECT c.id, c.created_at, c.goal_id, c.description, g.group_id,
+                (
+                    SELECT json_group_array(
+                        CASE
+                            WHEN u.username IS NOT NULL THEN '@' || u.username
+                            ELSE u.display_name
+                        END
+                    )
+                    FROM challenge_responses cr
+                    JOIN users u ON cr.user_id = u.user_id
+                    WHERE cr.challenge_id = c.id AND cr.status IN ('issued', 'pending')
+                ) AS participants
+            FROM challenges c
+            LEFT JOIN goals g ON c.goal_id = g.id
+            WHERE c.created_at >= ?5
+            AND c.rejected = 0
+            AND (?1 IS NULL OR g.group_id IN (SELECT value FROM json_each(?1)))
+            AND (c.created_at, c.id) > (?2, ?3)
+            ORDER BY c.created_at, c.id
+            LIMIT ?4
+        """, (optional_json_list(group_ids), last_created_at, last_id, batch_size, since))
 
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT *
-            FROM challenges 
-            WHERE DATE(created_at) >= DATE('now', '-1 day')
-        """)
+        if not rows:
+            return
 
-        result = cursor.fetchall()
+        for row in rows:
+            yield row
 
-    return result
+        last_created_at, last_id = rows[-1]["created_at"], rows[-1]["id"]
 
-def insert_into_prizefights(challenge, prize, group_id):
+async def insert_into_prizefights(challenge, prize, group_id):
 
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO prizefights (challenge, prize, group_id)
-            VALUES (?, ?, ?)
-        """, (challenge, prize, group_id))
-        conn.commit()
+    cursor = await db.execute("""
+        INSERT INTO prizefights (challenge, prize, group_id)
+        VALUES (?, ?, ?)
+    """, (challenge, prize, group_id))
     return cursor.lastrowid
 
-def insert_into_prizefight_participants(prizefight_id, user_id):
+async def insert_into_prizefight_participants(prizefight_id, user_id):
 
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO prizefight_participants (prizefight_id, user_id)
-            VALUES (?, ?)
-        """, (prizefight_id, user_id))
-        conn.commit()
+    await db.execute("""
+        INSERT INTO prizefight_participants (prizefight_id, user_id)
+        VALUES (?, ?)
+    """, (prizefight_id, user_id))
 
-def get_prize_fight_for_user_id(user_id, group_id):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(
-                """
-                SELECT pf.id, pf.challenge, pf.prize
-                FROM prizefights pf
-                JOIN prizefight_participants pfp ON pf.id = pfp.prizefight_id
-                WHERE pfp.user_id = ? AND pf.group_id = ? AND pfp.status = 'pending'
-                """,
-                (user_id, group_id)
+async def accept_prizefight(prizefight_id, user_ids):
+    """
+    Add the participants to a proposed prize fight, in one transaction.
+
+    Returns:
+        sqlite3.Row: The prize fight's challenge and prize, or None if it doesn't exist
+                     or was already accepted
+    """
+    def _accept(conn):
+        prizefight = conn.execute("""
+            SELECT pf.challenge, pf.prize
+            FROM prizefights pf
+            WHERE pf.id = ?
+            AND NOT EXISTS (SELECT 1 FROM prizefight_participants pfp WHERE pfp.prizefight_id = pf.id)
+        """, (prizefight_id,)).fetchone()
+
+        if prizefight:
+            conn.executemany(
+                "INSERT INTO prizefight_participants (prizefight_id, user_id) VALUES (?, ?)",
+                [(prizefight_id, user_id) for user_id in user_ids]
             )
-        return cursor.fetchall()
-
-def edit_prize_fight_status(prize_fight_id, user_id, status):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE prizefight_participants
-            SET status = ?
-            WHERE prizefight_id = ? AND user_id = ?
-        """, (status, prize_fight_id, user_id))
-        conn.commit()
-
-def get_prize_fight_details(prize_fight_id):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT *
-            FROM prizefights
-            WHERE id = ?
+        return prizefight
+
+    return await db.run(_accept)
+
+async def delete_unaccepted_prizefight(prizefight_id):
+    """Remove a prize fight proposal nobody accepted."""
+    await db.execute("""
+        DELETE FROM prizefights
+        WHERE id = ?
+        AND NOT EXISTS (SELECT 1 FROM prizefight_participants pfp WHERE pfp.prizefight_id = prizefights.id)
+    """, (prizefight_id,))
+
+async def get_prize_fight_for_user_id(user_id, group_id):
+    return await db.fetchall(
+            """
+            SELECT pf.id, pf.challenge, pf.prize
+            FROM prizefights pf
+            JOIN prizefight_participants pfp ON pf.id = pfp.prizefight_id
+            WHERE pfp.user_id = ? AND pf.group_id = ? AND pfp.status = 'pending'
+            """,
+            (user_id, group_id)
+        )
+
+async def edit_prize_fight_status(prize_fight_id, user_id, status):
+    await db.execute("""
+        UPDATE prizefight_participants
+        SET status = ?
+        WHERE prizefight_id = ? AND user_id = ?
+    """, (status, prize_fight_id, user_id))
+
+async def get_prize_fight_details(prize_fight_id):
+    return await db.fetchone("""
+        SELECT *
+        FROM prizefights
+        WHERE id = ?
+    """, (prize_fight_id,))
+
+async def get_prize_fight_participants(prize_fight_id, exclude_user_id=None):
+    if exclude_user_id:
+        return await db.fetchall("""
+            SELECT u.user_id, u.username, u.display_name
+            FROM prizefight_participants pfp
+            JOIN users u ON pfp.user_id = u.user_id
+            WHERE pfp.prizefight_id = ? AND pfp.user_id != ?
+        """, (prize_fight_id, exclude_user_id))
+    else:
+        return await db.fetchall("""
+            SELECT u.user_id, u.username, u.display_name
+            FROM prizefight_participants pfp
+            JOIN users u ON pfp.user_id = u.user_id
+            WHERE pfp.prizefight_id = ?
         """, (prize_fight_id,))
 
-        prize_fight = cursor.fetchone()
-
-        return prize_fight
-    
-def get_prize_fight_participants(prize_fight_id, exclude_user_id=None):
-    with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        if exclude_user_id:
-            cursor.execute("""
-                SELECT u.user_id, u.username, u.display_name
-                FROM prizefight_participants pfp
-                JOIN users u ON pfp.user_id = u.user_id
-                WHERE pfp.prizefight_id = ? AND pfp.user_id != ?
-            """, (prize_fight_id, exclude_user_id))
-        else:
-            cursor.execute("""
-                SELECT u.user_id, u.username, u.display_name
-                FROM prizefight_participants pfp
-                JOIN users u ON pfp.user_id = u.user_id
-                WHERE pfp.prizefight_id = ?
-            """, (prize_fight_id,))
-        participants = cursor.fetchall()
-        return participants
-    
-def get_expiring_challenges():
+async def expire_overdue_challenges(group_ids=None):
     """
-    Get all challenges that are still pending with full challenge details
+    Mark every pending challenge response past its due date as failed, in one transaction.
+    Pass group_ids to only expire those groups' challenges.
+
+    Returns:
+        list: sqlite3.Row objects (challenge_response_id, challenge_id, user_id, name, description,
+              group_id) for the responses that were failed, ordered by group and challenge
+
+    Raises:
+        sqlite3.Error: If the update failed; nothing was expired
     """
-    try:
-        with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-
-            cursor.execute(
-                """
-                SELECT cr.id, cr.challenge_id, cr.user_id, c.description, c.goal_id
-                FROM challenge_responses cr
-                JOIN challenges c ON cr.challenge_id = c.id
-                WHERE cr.status = 'pending'
-                """
+    now = datetime.now().isoformat()
+
+    def _expire(conn):
+        failed_ids = [row["id"] for row in conn.execute("""
+            UPDATE challenge_responses
+            SET status = 'failed'
+            WHERE status = 'pending'
+            AND EXISTS (
+                SELECT 1 FROM challenges c
+                LEFT JOIN goals g ON c.goal_id = g.id
+                WHERE c.id = challenge_responses.challenge_id AND c.due_date <= ?1
+                AND (?2 IS NULL OR g.group_id IN (SELECT value FROM json_each(?2)))
             )
-            return cursor.fetchall()
+            RETURNING id
+        """, (now, optional_json_list(group_ids))).fetchall()]
 
-    except sqlite3.Error as e:
-        logger.error(f"Database error in get_expiring_challenges: {e}")
-        return []
-    
-def get_pending_prizefights():
+        return conn.execute("""
+            SELECT cr.id AS challenge_response_id, cr.challenge_id, cr.user_id,
+                CASE
+                    WHEN u.username IS NOT NULL THEN '@' || u.username
+                    ELSE u.display_name
+                END AS name,
+                c.description, g.group_id
+            FROM challenge_responses cr
+            JOIN challenges c ON cr.challenge_id = c.id
+            JOIN goals g ON c.goal_id = g.id
+            LEFT JOIN users u ON cr.user_id = u.user_id
+            WHERE cr.id IN (SELECT value FROM json_each(?))
+            ORDER BY g.group_id, cr.challenge_id
+        """, (json.dumps(failed_ids),)).fetchall()
+
+    return await db.run(_expire)
+
+async def get_pending_prizefights(group_ids=None):
     """
-    Get all prize fights that are still pending with full details
+    Get all prize fights that are still pending with full details, optionally only in group_ids
     """
     try:
-        with sqlite3.connect(consts.GOALS_DB_SQLITE) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-
-            cursor.execute(
-                """
-                SELECT pfp.id, pfp.prizefight_id, pfp.user_id, pf.challenge, pf.prize, pf.group_id
-                FROM prizefight_participants pfp
-                JOIN prizefights pf ON pfp.prizefight_id = pf.id
-                WHERE pfp.status = 'pending'
-                """
-            )
-            return cursor.fetchall()
+        return await db.fetchall(
+            """
+            SELECT pfp.id, pfp.prizefight_id, pfp.user_id, pf.challenge, pf.prize, pf.group_id
+            FROM prizefight_participants pfp
+            JOIN prizefights pf ON pfp.prizefight_id = pf.id
+            WHERE pfp.status = 'pending'
+            AND (?1 IS NULL OR pf.group_id IN (SELECT value FROM json_each(?1)))
+            """,
+            (optional_json_list(group_ids),)
+        )
 
     except sqlite3.Error as e:
         logger.error(f"Database error in get_pending_prizefights: {e}")
-        return []
\ No newline at end of file
+        return []
@@ -1,5 +1,6 @@
 import utils
 import random
+import callbacks
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -17,13 +18,12 @@ async def handle_validation_response(update: Update, context: ContextTypes.DEFAU
 
     await query.answer()
 
-    data = query.data
-    challenge_response_id = int(data.split("_")[1])
+    challenge_response_id, validated = context.args
 
-    challenger = utils.get_user_display_name_by_challenge_response_id(challenge_response_id)
-    challenge_description = utils.get_challenge_from_challenge_response_id(challenge_response_id)['description']
+    challenger = await utils.get_user_display_name_by_challenge_response_id(challenge_response_id)
+    challenge_description = (await utils.get_challenge_from_challenge_response_id(challenge_response_id))['description']
 
-    if data.endswith("_yes"):
+    if validated:
 
         await utils.mark_challenge_as_validated(challenge_response_id)
         
@@ -34,7 +34,7 @@ async def handle_validation_response(update: Update, context: ContextTypes.DEFAU
             parse_mode = 'HTML')
         await query.message.reply_text(f"✅ {challenger}'s challenge has been validated successfully by {validator_display_name}! Great job!")
 
-    elif data.endswith("_no"):
+    else:
 
         await utils.mark_challenge_as_rejected(challenge_response_id)
 
@@ -48,22 +48,22 @@ async def handle_validation_response(update: Update, context: ContextTypes.DEFAU
 
 async def validate(update: Update, context: ContextTypes.DEFAULT_TYPE, challenge_response_id, user_id) -> None:
 
-    challenge = utils.get_challenge_from_challenge_response_id(challenge_response_id)
+    challenge = await utils.get_challenge_from_challenge_response_id(challenge_response_id)
 
     challenge_description = challenge['description']
 
-    goal_id = utils.get_goal_id_from_challenge_id(challenge['challenge_id'])
+    goal_id = await utils.get_goal_id_from_challenge_id(challenge['challenge_id'])
 
-    group_id = utils.get_group_id_by_goal_id(goal_id)
+    group_id = await utils.get_group_id_by_goal_id(goal_id)
 
     # Select validator at random from group members
-    members = utils.get_members_in_goal(goal_id)
+    members = await utils.get_members_in_goal(goal_id)
 
     # Drop partners who are the user themselves
     validators = [v for v in members if v["user_id"] != user_id]
 
     # Username of challenger
-    challenger = utils.get_display_name_from_user_id(user_id)
+    challenger = await utils.get_display_name_from_user_id(user_id)
 
     if not validators:
         await context.bot.send_message(
@@ -82,8 +82,8 @@ async def validate(update: Update, context: ContextTypes.DEFAULT_TYPE, challenge
                 f"{selected_validator['name']}, you have been chosen to validate the completion of {challenger['name']}'s challenge! 🎯\n\n<b>Challenge Description:</b>\n{challenge_description}\n\nDo you think they completed their challenge?"
             ),
         reply_markup=InlineKeyboardMarkup([[
-            InlineKeyboardButton("Yes, they did!", callback_data=f"validate_{challenge_response_id}_yes"),
-            InlineKeyboardButton("No, they didn't.", callback_data=f"validate_{challenge_response_id}_no")
+            InlineKeyboardButton("Yes, they did!", callback_data=callbacks.encode(callbacks.VALIDATE_CHALLENGE, challenge_response_id, 1)),
+            InlineKeyboardButton("No, they didn't.", callback_data=callbacks.encode(callbacks.VALIDATE_CHALLENGE, challenge_response_id, 0))
         ]]),
         parse_mode='HTML'
     )
@@ -0,0 +1,298 @@
+"""
+Local harness for webhook mode: measures end-to-end handler latency without Telegram.
+
+The harness plays both sides of Telegram. It runs a stub Bot API server that answers the
+bot's outgoing calls (getMe, setWebhook, sendMessage, ...) and POSTs Update payloads to the
+bot's webhook listener with the secret token header. Latency is measured from the POST to
+the first Bot API call the bot makes for that update (a reply to the chat, or answering the
+callback query).
+
+Run against a bot you started yourself with
+    BOT_MODE=webhook WEBHOOK_URL=http://127.0.0.1:8443/telegram WEBHOOK_LISTEN=127.0.0.1
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081/bot WEBHOOK_SECRET_TOKEN=... python bot.py
+
+or let the harness start one against a scratch goals.db:
+    python webhook_harness.py --spawn-bot --count 500 --concurrency 20
+
+Recorded payloads (one Update JSON object per line, e.g. saved from getUpdates) can be
+replayed with --updates; otherwise synthetic /help commands from distinct groups are sent.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict, deque
+
+import httpx
+import tornado.web
+
+from timing import summarise
+
+HARNESS_BOT_TOKEN = "123456:harness"
+HARNESS_SECRET_TOKEN = "harness-secret"
+
+
+def synthetic_update(i, text="/help"):
+    """A group message from a distinct user in a distinct group, as Telegram would deliver it."""
+    command = text.split()[0]
+    return {
+        "update_id": i,
+        "message": {
+            "message_id": i,
+            "date": int(time.time()),
+            "chat": {"id": -1000000000000 - i, "type": "supergroup", "title": f"Harness group {i}"},
+            "from": {"id": 100000 + i, "is_bot": False, "first_name": f"User{i}", "username": f"harness_user_{i}"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}] if command.startswith("/") else [],
+        },
+    }
+
+
+def load_updates(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def correlation_keys(update):
+    """Keys a Bot API call can be matched to this update by: its callback query and its chat."""
+    keys = []
+    if "callback_query" in update:
+        keys.append(("callback_query", str(update["callback_query"]["id"])))
+        message = update["callback_query"].get("message") or {}
+    else:
+        message = update.get("message") or update.get("my_chat_member") or {}
+
+    chat = message.get("chat")
+    if chat:
+        keys.append(("chat", str(chat["id"])))
+    return keys
+
+
+class LatencyTracker:
+    """Matches outgoing Bot API calls to the earliest unanswered update sharing a key with them."""
+
+    def __init__(self):
+        self._pending = defaultdict(deque)
+        self._sent_at = {}
+        self.latencies = []
+        self.all_answered = asyncio.Event()
+        self.all_answered.set()
+
+    def sent(self, update_id, keys):
+        self._sent_at[update_id] = time.perf_counter()
+        self.all_answered.clear()
+        for key in keys:
+            self._pending[key].append(update_id)
+
+    def unanswered(self):
+        return len(self._sent_at)
+
+    def bot_call(self, keys):
+        now = time.perf_counter()
+        best = None
+        for key in keys:
+            queue = self._pending.get(key)
+            # Drop updates that were already answered through another key
+            while queue and queue[0] not in self._sent_at:
+                queue.popleft()
+            if queue and (best is None or self._sent_at[queue[0]] < self._sent_at[best]):
+                best = queue[0]
+
+        if best is None:
+            return
+
+        self.latencies.append(now - self._sent_at.pop(best))
+        if not self._sent_at:
+            self.all_answered.set()
+
+
+class StubBotApi(tornado.web.RequestHandler):
+    """Answers every Bot API method with a plausible successful result."""
+
+    def initialize(self, tracker, calls, ready):
+        self.tracker = tracker
+        self.calls = calls
+        self.ready = ready
+
+    def _param(self, name):
+        if self.request.headers.get("Content-Type", "").startswith("application/json"):
+            value = json.loads(self.request.body or b"{}").get(name)
+            return None if value is None else str(value)
+        return self.get_body_argument(name, None)
+
+    def post(self, token, method):
+        self.calls[method] += 1
+        chat_id = self._param("chat_id")
+        callback_query_id = self._param("callback_query_id")
+
+        keys = []
+        if callback_query_id:
+            keys.append(("callback_query", callback_query_id))
+        if chat_id:
+            keys.append(("chat", chat_id))
+        self.tracker.bot_call(keys)
+
+        if method == "getMe":
+            result = {"id": int(token.split(":")[0]), "is_bot": True, "first_name": "Harness", "username": "harness_bot",
+                      "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        elif method == "setWebhook":
+            self.ready.set()
+            result = True
+        elif method == "getWebhookInfo":
+            result = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        elif method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            try:
+                chat = int(chat_id)
+            except (TypeError, ValueError):
+                chat = 0
+            result = {
+                "message_id": sum(self.calls.values()),
+                "date": int(time.time()),
+                "chat": {"id": chat, "type": "private" if chat > 0 else "supergroup"},
+                "text": self._param("text") or "",
+            }
+        else:
+            result = True
+
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps({"ok": True, "result": result}))
+
+    get = post
+
+
+async def post_update(client, url, update, secret_token):
+    """POST one update to the webhook. Returns (status code, seconds until the listener acknowledged it)."""
+    started = time.perf_counter()
+    response = await client.post(
+        url,
+        content=json.dumps(update),
+        headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret_token or ""},
+    )
+    return response.status_code, time.perf_counter() - started
+
+
+def spawn_bot(args, workdir):
+    """Start bot.py in webhook mode against the stub API, with a fresh goals.db in workdir."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(
+        os.environ,
+        BOT_MODE="webhook",
+        TELEGRAM_BOT_TOKEN=HARNESS_BOT_TOKEN,
+        TELEGRAM_API_BASE_URL=f"http://127.0.0.1:{args.api_port}/bot",
+        WEBHOOK_URL=args.url,
+        WEBHOOK_LISTEN="127.0.0.1",
+        WEBHOOK_PORT=str(args.port),
+        WEBHOOK_PATH=args.path,
+        WEBHOOK_SECRET_TOKEN=args.secret_token,
+    )
+    env.setdefault("ADMIN_TELEGRAM_USER_ID", "1")
+
+    # bot.py creates the schema itself on startup
+    log = open(os.path.join(workdir, "bot.log"), "w")
+    return subprocess.Popen([sys.executable, os.path.join(here, "bot.py")], cwd=workdir, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+async def run(args):
+    tracker = LatencyTracker()
+    calls = defaultdict(int)
+    ready = asyncio.Event()
+
+    api = tornado.web.Application([
+        (r"/bot([^/]+)/(\w+)", StubBotApi, {"tracker": tracker, "calls": calls, "ready": ready}),
+    ])
+    api_server = api.listen(args.api_port, address="127.0.0.1")
+
+    bot_process = None
+    workdir = None
+    if args.spawn_bot:
+        workdir = tempfile.TemporaryDirectory(prefix="webhook-harness-")
+        bot_process = spawn_bot(args, workdir.name)
+        try:
+            await asyncio.wait_for(ready.wait(), timeout=args.startup_timeout)
+        except asyncio.TimeoutError:
+            print(f"Bot did not call setWebhook within {args.startup_timeout}s, see {workdir.name}/bot.log")
+            bot_process.terminate()
+            api_server.stop()
+            return 1
+
+    if args.updates:
+        templates = load_updates(args.updates)
+        updates = [dict(templates[i % len(templates)], update_id=i + 1) for i in range(args.count)]
+    else:
+        updates = [synthetic_update(i + 1, args.text) for i in range(args.count)]
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    acks = []
+    statuses = defaultdict(int)
+
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        # Sanity check: the listener must reject a wrong secret token
+        rejected_status, _ = await post_update(client, args.url, synthetic_update(0), "wrong-" + (args.secret_token or ""))
+
+        async def send(update):
+            async with semaphore:
+                tracker.sent(update["update_id"], correlation_keys(update))
+                status, elapsed = await post_update(client, args.url, update, args.secret_token)
+                statuses[status] += 1
+                acks.append(elapsed)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(update) for update in updates))
+        try:
+            await asyncio.wait_for(tracker.all_answered.wait(), timeout=args.timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+
+    report = {
+        "updates": len(updates),
+        "concurrency": args.concurrency,
+        "wrong_secret_status": rejected_status,
+        "http_statuses": dict(statuses),
+        "ack": summarise(acks),
+        "handled": summarise(tracker.latencies),
+        "unanswered": tracker.unanswered(),
+        "throughput_per_second": len(tracker.latencies) / elapsed if elapsed else None,
+        "bot_api_calls": dict(calls),
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if bot_process:
+        bot_process.terminate()
+        bot_process.wait()
+        workdir.cleanup()
+    api_server.stop()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay Update payloads against the bot's webhook and measure handler latency")
+    parser.add_argument("--updates", help="JSONL file of recorded Update payloads (default: synthetic /help commands)")
+    parser.add_argument("--text", default="/help", help="Message text for synthetic updates")
+    parser.add_argument("--count", type=int, default=200, help="Updates to send")
+    parser.add_argument("--concurrency", type=int, default=10, help="Updates in flight at once")
+    parser.add_argument("--port", type=int, default=8443, help="Bot webhook port")
+    parser.add_argument("--path", default="telegram", help="Bot webhook path")
+    parser.add_argument("--api-port", type=int, default=8081, help="Port for the stub Bot API")
+    parser.add_argument("--secret-token", default=os.getenv("WEBHOOK_SECRET_TOKEN", HARNESS_SECRET_TOKEN))
+    parser.add_argument("--spawn-bot", action="store_true", help="Start bot.py in webhook mode against a scratch database")
+    parser.add_argument("--startup-timeout", type=float, default=30)
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for outstanding replies")
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+    args.url = f"http://127.0.0.1:{args.port}/{args.path}"
+
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()